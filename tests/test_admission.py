@@ -0,0 +1,211 @@
+import io
+import pickle
+import threading
+
+import pytest
+from pilkit.lib import Image
+
+from variations import Variation, VariationSet
+from variations.admission import (
+    MemoryBudget,
+    MemoryBudgetExceeded,
+    estimate_peak_bytes,
+    preflight,
+    read_header,
+)
+
+from . import helper
+
+VARIATIONS = VariationSet({
+    "small": Variation(size=(200, 200)),
+    "fit": Variation(size=(100, 0), mode=Variation.Mode.FIT),
+})
+
+
+def make_source(size, format, mode="RGB"):
+    buffer = io.BytesIO()
+    Image.new(mode, size, "red").save(buffer, format)
+    buffer.seek(0)
+    return buffer
+
+
+def get_decodes(admissions):
+    return [admission.decode for admission in admissions]
+
+
+class TestPreflight:
+    def test_header(self):
+        header = read_header(helper.INPUT_PATH / "exif/landscape_6.jpg")
+        assert header.format == "JPEG"
+        assert header.mode == "RGB"
+        assert header.bands == 3
+        assert header.frames == 1
+        assert header.orientation == 6
+
+        header = read_header(helper.INPUT_PATH / "formats/gif/P.gif")
+        assert header.mode == "P"
+        assert header.bands == 1
+
+    def test_header_is_lazy(self):
+        source = make_source((100, 100), "png")
+        read_header(source)
+        assert source.tell() == 0
+
+    def test_estimate(self):
+        source = make_source((1000, 1000), "png", "RGBA")
+        header = read_header(source)
+        peak = estimate_peak_bytes(header, VARIATIONS)
+
+        decoded = 1000 * 1000 * 4
+        premultiplied = decoded
+        outputs = (200 * 200 + 100 * 100) * 4
+        assert peak == decoded + premultiplied + outputs + 200 * 200 * 4
+
+        # Rotated sources are copied.
+        rotated = header._replace(orientation=6)
+        assert estimate_peak_bytes(rotated, VARIATIONS) == peak + decoded
+
+        # Crops without resampling don't make working copies.
+        crop = VariationSet([Variation(size=(100, 100), mode=Variation.Mode.CROP)])
+        assert estimate_peak_bytes(header, crop) == decoded + 2 * 100 * 100 * 4
+
+    def test_draft(self):
+        source = make_source((1000, 1000), "jpeg")
+        standard, draft = preflight(source, VARIATIONS)
+
+        assert standard.decode == "standard"
+        assert standard.decoded_size == (500, 500)
+        assert draft.decode == "draft"
+        assert draft.draft_size == (200, 200)
+        assert draft.decoded_size == (250, 250)
+        assert draft.peak_bytes < standard.peak_bytes
+        assert source.tell() == 0
+
+    def test_strips(self):
+        source = make_source((2000, 3000), "bmp")
+        standard, strips = preflight(source, VARIATIONS, strip_height=64)
+
+        assert strips.decode == "strips"
+        assert strips.strip_height == 64
+        assert strips.peak_bytes < standard.peak_bytes / 10
+
+    def test_no_reduced_decode(self):
+        source = helper.INPUT_PATH / "formats/png/RGB.png"
+        crop = VariationSet([Variation(size=(100, 100), mode=Variation.Mode.CROP)])
+        assert get_decodes(preflight(source, crop)) == ["standard"]
+
+        identity = VariationSet([Variation(size=(0, 0), mode=Variation.Mode.NONE)])
+        assert get_decodes(preflight(source, identity)) == ["standard"]
+
+
+class TestMemoryBudget:
+    def test_invalid(self):
+        with pytest.raises(ValueError, match="'limit' must be"):
+            MemoryBudget(0)
+        with pytest.raises(ValueError):
+            MemoryBudget(100, policy="unknown")
+
+    def test_policy_string(self):
+        assert MemoryBudget(100, policy="Wait").policy is MemoryBudget.Policy.WAIT
+
+    def test_reduce(self):
+        source = make_source((2000, 3000), "bmp")
+        standard, strips = preflight(source, VARIATIONS, strip_height=64)
+
+        budget = MemoryBudget(standard.peak_bytes, strip_height=64)
+        assert budget.preflight(source, VARIATIONS).decode == "standard"
+
+        budget.try_reserve(strips.peak_bytes)
+        assert budget.preflight(source, VARIATIONS).decode == "strips"
+
+        budget = MemoryBudget(standard.peak_bytes - 1, strip_height=64)
+        assert budget.preflight(source, VARIATIONS).decode == "strips"
+
+        budget = MemoryBudget(strips.peak_bytes - 1, strip_height=64)
+        with pytest.raises(MemoryBudgetExceeded, match="the limit is"):
+            budget.preflight(source, VARIATIONS)
+
+    def test_wait(self):
+        source = make_source((1000, 1000), "jpeg")
+        standard, _ = preflight(source, VARIATIONS)
+
+        budget = MemoryBudget(standard.peak_bytes, policy="wait")
+        assert budget.try_reserve(1)
+        # Busy, but the job will fit once the budget is released.
+        assert budget.preflight(source, VARIATIONS).decode == "standard"
+
+        budget = MemoryBudget(standard.peak_bytes - 1, policy="wait")
+        with pytest.raises(MemoryBudgetExceeded):
+            budget.preflight(source, VARIATIONS)
+
+    def test_reject(self):
+        source = make_source((1000, 1000), "jpeg")
+        standard, _ = preflight(source, VARIATIONS)
+
+        budget = MemoryBudget(standard.peak_bytes, policy=MemoryBudget.Policy.REJECT)
+        assert budget.preflight(source, VARIATIONS).decode == "standard"
+
+        assert budget.try_reserve(1)
+        with pytest.raises(MemoryBudgetExceeded, match="available"):
+            budget.preflight(source, VARIATIONS)
+
+    def test_reserve(self):
+        budget = MemoryBudget(100)
+        assert budget.try_reserve(60)
+        assert not budget.try_reserve(60)
+        assert budget.available == 40
+
+        reserved = threading.Event()
+        thread = threading.Thread(target=lambda: (budget.reserve(60), reserved.set()))
+        thread.start()
+        assert not reserved.wait(0.1)
+
+        budget.release(60)
+        thread.join(5)
+        assert reserved.is_set()
+        assert budget.used == 60
+
+    def test_idle_budget_admits_any_job(self):
+        budget = MemoryBudget(100)
+        assert budget.try_reserve(1000)
+        assert not budget.try_reserve(1)
+        budget.release(1000)
+        assert budget.used == 0
+
+    def test_timeout(self):
+        budget = MemoryBudget(100, timeout=0.05)
+        budget.reserve(100)
+        with pytest.raises(MemoryBudgetExceeded, match="Timed out"):
+            budget.reserve(1)
+
+    def test_admit(self):
+        source = make_source((2000, 3000), "bmp")
+        budget = MemoryBudget(20 * 1024 ** 2, strip_height=64)
+
+        with budget.admit(source, VARIATIONS) as admission:
+            assert admission.decode == "strips"
+            assert budget.used == admission.peak_bytes
+            with Image.open(source) as img:
+                images = admission.process(img, VARIATIONS, source=source)
+        assert budget.used == 0
+
+        assert {key: img.size for key, img in images.items()} == {
+            "small": (200, 200),
+            "fit": (100, 150),
+        }
+
+    def test_process_draft(self):
+        source = make_source((1000, 1000), "jpeg")
+        _, admission = preflight(source, VARIATIONS)
+        with Image.open(source) as img:
+            images = admission.process(img, VARIATIONS, ["small"])
+            assert img.size == (250, 250)
+        assert images["small"].size == (200, 200)
+
+    def test_pickle(self):
+        budget = MemoryBudget(100, policy="reject")
+        budget.try_reserve(50)
+        budget = pickle.loads(pickle.dumps(budget))
+        assert budget.policy is MemoryBudget.Policy.REJECT
+        assert budget.used == 0
+        assert budget.try_reserve(100)
@@ -0,0 +1,89 @@
+import asyncio
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import ImageChops
+from pilkit.lib import Image
+
+from variations import Variation, aio, utils
+
+from . import helper
+
+
+@pytest.fixture(autouse=True)
+def reset_config():
+    yield
+    aio.configure()
+
+
+def test_invalid_concurrency():
+    with pytest.raises(ValueError, match="'max_concurrency' must be"):
+        aio.configure(max_concurrency=0)
+
+
+def test_concurrency_limit():
+    lock = threading.Lock()
+    state = {"running": 0, "max_running": 0}
+
+    def job():
+        with lock:
+            state["running"] += 1
+            state["max_running"] = max(state["max_running"], state["running"])
+        time.sleep(0.02)
+        with lock:
+            state["running"] -= 1
+
+    async def main():
+        await asyncio.gather(*(aio.run(job) for _ in range(10)))
+
+    with ThreadPoolExecutor(8) as executor:
+        aio.configure(executor=executor, max_concurrency=2)
+        asyncio.run(main())
+
+    assert state["max_running"] == 2
+
+
+def test_aprocess():
+    variation = Variation(size=(200, 200))
+    file = helper.INPUT_PATH / "exif/landscape_6.jpg"
+
+    async def main():
+        return await variation.aprocess(Image.open(file))
+
+    result = asyncio.run(main())
+    expected = variation.process(Image.open(file))
+    assert ImageChops.difference(result, expected).getbbox(alpha_only=False) is None
+
+
+def test_asave():
+    variation = Variation(size=(200, 200))
+    img = Image.new("RGB", (640, 480), color="red")
+
+    async def main(variation_buffer, utils_buffer):
+        await asyncio.gather(
+            variation.asave(img, variation_buffer, format="png"),
+            utils.asave_image(img, utils_buffer, format="png"),
+        )
+
+    with io.BytesIO() as variation_buffer, io.BytesIO() as utils_buffer:
+        asyncio.run(main(variation_buffer, utils_buffer))
+
+        variation_buffer.seek(0)
+        assert Image.open(variation_buffer).format == "PNG"
+
+        utils_buffer.seek(0)
+        assert Image.open(utils_buffer).format == "PNG"
+
+
+def test_aencode():
+    variation = Variation(size=(200, 200))
+    img = Image.new("RGB", (640, 480), color="red")
+
+    async def main():
+        return await variation.aencode(img, format="png")
+
+    view = asyncio.run(main())
+    assert view.tobytes() == variation.encode(img, format="png").tobytes()
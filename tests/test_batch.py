@@ -0,0 +1,226 @@
+import io
+import pickle
+import threading
+
+import pytest
+from pilkit.lib import Image
+
+from variations import Variation, VariationSet, metrics
+from variations.admission import MemoryBudget, preflight
+from variations.batch import BatchProcessor, process_batch, process_source
+
+from . import helper
+
+VARIATIONS = {
+    "small": Variation(size=(100, 100)),
+    "webp": Variation(size=(200, 0), mode=Variation.Mode.FIT, format="webp"),
+}
+
+
+def test_pickle_variation_set():
+    vs = pickle.loads(pickle.dumps(VariationSet(VARIATIONS)))
+    assert list(vs) == ["small", "webp"]
+    assert vs["webp"].format == "WEBP"
+
+
+class TestProcessSource:
+    def test_path(self, tmp_path):
+        source = helper.INPUT_PATH / "formats/jpg/RGB.jpg"
+        result = process_source(source, VariationSet(VARIATIONS), tmp_path)
+        assert result.ok
+        assert result.source == source
+        assert result.outputs == {
+            "small": tmp_path / "RGB.small.jpg",
+            "webp": tmp_path / "RGB.webp.webp",
+        }
+
+        with Image.open(result.outputs["small"]) as img:
+            assert img.size == (100, 100)
+
+        with Image.open(result.outputs["webp"]) as img:
+            assert img.size == (200, 400)
+
+    def test_callable_destination(self, tmp_path):
+        source = helper.INPUT_PATH / "formats/png/RGB.png"
+        result = process_source(
+            source,
+            VariationSet(VARIATIONS),
+            lambda src, key, variation: tmp_path / f"{key}.png",
+        )
+        assert result.ok
+        assert result.outputs == {
+            "small": tmp_path / "small.png",
+            "webp": tmp_path / "webp.png",
+        }
+
+    def test_passthrough(self, tmp_path):
+        source = helper.INPUT_PATH / "formats/jpg/RGB.jpg"
+        variations = VariationSet({
+            "original": Variation(size=(0, 0), mode=Variation.Mode.NONE),
+            "small": Variation(size=(100, 100)),
+        })
+        result = process_source(source, variations, tmp_path, strip_metadata=True)
+        assert result.ok
+        assert list(result.outputs) == ["original", "small"]
+
+        with Image.open(result.outputs["original"]) as img:
+            assert img.size == (300, 600)
+
+        with Image.open(result.outputs["small"]) as img:
+            assert img.size == (100, 100)
+
+    def test_error(self, tmp_path):
+        source = tmp_path / "broken.jpg"
+        source.write_bytes(b"not an image")
+
+        result = process_source(source, VariationSet(VARIATIONS), tmp_path, index=5)
+        assert not result.ok
+        assert result.index == 5
+        assert result.outputs == {}
+        assert "UnidentifiedImageError" in result.error
+
+
+class TestBatchProcessor:
+    def test_invalid_chunksize(self, tmp_path):
+        with pytest.raises(ValueError, match="'chunksize' must be"):
+            BatchProcessor(VARIATIONS, tmp_path, chunksize=0)
+
+    @pytest.mark.parametrize("chunksize", [1, 3])
+    def test_directory(self, tmp_path, chunksize):
+        root = helper.INPUT_PATH / "formats/png"
+        results = list(process_batch(
+            root,
+            VARIATIONS,
+            tmp_path,
+            max_workers=2,
+            chunksize=chunksize
+        ))
+
+        files = sorted(path for path in root.iterdir() if path.is_file())
+        assert sorted(result.index for result in results) == list(range(len(files)))
+        assert all(result.ok for result in results)
+
+        for file in files:
+            assert (tmp_path / f"{file.stem}.small.png").is_file()
+            assert (tmp_path / f"{file.stem}.webp.webp").is_file()
+
+    def test_file_objects_and_errors(self, tmp_path):
+        broken = io.BytesIO(b"not an image")
+        broken.name = "broken.png"
+
+        with open(helper.INPUT_PATH / "formats/jpg/L.jpg", "rb") as fp:
+            with BatchProcessor(VARIATIONS, tmp_path, max_workers=2) as processor:
+                results = sorted(
+                    processor.imap_unordered([fp, broken]),
+                    key=lambda r: r.index
+                )
+
+        assert results[0].ok
+        assert results[0].source.endswith("L.jpg")
+        assert (tmp_path / "L.small.jpg").is_file()
+
+        assert not results[1].ok
+        assert results[1].source == "broken.png"
+
+    def test_metrics(self, tmp_path):
+        broken = io.BytesIO(b"not an image")
+        broken.name = "broken.png"
+
+        registry = metrics.Metrics()
+        sources = [helper.INPUT_PATH / "formats/jpg/L.jpg", broken]
+        results = list(process_batch(sources, VARIATIONS, tmp_path, max_workers=1, metrics=registry))
+
+        assert all(result.seconds > 0 for result in results)
+        assert registry.get_counter("renders_total", variation="small") == 1
+        assert registry.get_counter("renders_total", variation="webp") == 1
+        assert registry.get_counter("errors_total") == 1
+        assert registry.get_histogram("render_seconds").count == 2
+
+        # The timings of the workers are recorded in the parent process.
+        ok, = [result for result in results if result.ok]
+        assert any(t.stage == "decode" for t in ok.timings)
+        assert registry.get_counter("encoded_images_total", format="WEBP") == 1
+        assert registry.get_counter("decoded_megapixels_total", format="JPEG") > 0
+        assert registry.get_histogram("stage_seconds", stage="decode", name="JPEG").count >= 1
+
+    def test_no_timings_without_metrics(self, tmp_path):
+        sources = [helper.INPUT_PATH / "formats/jpg/L.jpg"]
+        result, = process_batch(sources, VARIATIONS, tmp_path, max_workers=1)
+        assert result.ok
+        assert result.timings == []
+
+    def test_budget(self, tmp_path):
+        large = io.BytesIO()
+        Image.new("RGB", (2000, 2000)).save(large, "png")
+        large.name = "large.png"
+        large.seek(0)
+
+        sources = [
+            helper.INPUT_PATH / "formats/jpg/L.jpg",
+            large,
+            helper.INPUT_PATH / "formats/png/RGB.png",
+        ]
+        budget = MemoryBudget(8 * 1024 ** 2, policy="wait")
+        results = sorted(
+            process_batch(sources, VARIATIONS, tmp_path, max_workers=2, budget=budget),
+            key=lambda r: r.index
+        )
+
+        assert [result.ok for result in results] == [True, False, True]
+        assert "MemoryBudgetExceeded" in results[1].error
+        assert results[1].source == "large.png"
+        assert (tmp_path / "RGB.small.png").is_file()
+        assert budget.used == 0
+
+    def test_budget_reduce(self, tmp_path):
+        large = io.BytesIO()
+        Image.new("RGB", (2000, 3000), "red").save(large, "bmp")
+        large.name = "large.bmp"
+        large.seek(0)
+
+        budget = MemoryBudget(8 * 1024 ** 2, strip_height=64)
+        results = list(process_batch([large], VARIATIONS, tmp_path, max_workers=1, budget=budget))
+
+        assert results[0].ok
+        with Image.open(tmp_path / "large.small.bmp") as img:
+            assert img.size == (100, 100)
+
+    def test_budget_held_by_another_consumer(self, tmp_path):
+        sources = [
+            helper.INPUT_PATH / "formats/jpg/L.jpg",
+            helper.INPUT_PATH / "formats/png/RGB.png",
+        ]
+        budget = MemoryBudget(8 * 1024 ** 2)
+        assert budget.try_reserve(budget.limit)
+        timer = threading.Timer(0.2, budget.release, (budget.limit,))
+        timer.start()
+        try:
+            results = list(process_batch(sources, VARIATIONS, tmp_path, max_workers=1, budget=budget))
+        finally:
+            timer.cancel()
+
+        assert sorted(result.index for result in results) == [0, 1]
+        assert all(result.ok for result in results)
+
+    def test_budget_timeout(self, tmp_path):
+        sources = [
+            helper.INPUT_PATH / "formats/jpg/L.jpg",
+            helper.INPUT_PATH / "formats/png/RGB.png",
+        ]
+        budget = MemoryBudget(8 * 1024 ** 2, timeout=0.05)
+        assert budget.try_reserve(budget.limit)
+        results = list(process_batch(sources, VARIATIONS, tmp_path, max_workers=1, budget=budget))
+
+        assert sorted(result.index for result in results) == [0, 1]
+        assert all("MemoryBudgetExceeded" in result.error for result in results)
+
+    def test_budget_reject_throttles_the_batch(self, tmp_path):
+        source = helper.INPUT_PATH / "formats/png/RGB.png"
+        peak = preflight(source, VariationSet(VARIATIONS))[0].peak_bytes
+        budget = MemoryBudget(int(peak * 1.5), policy="reject")
+
+        results = list(process_batch([source] * 6, VARIATIONS, tmp_path, max_workers=2, budget=budget))
+
+        assert len(results) == 6
+        assert all(result.ok for result in results)
+        assert budget.used == 0
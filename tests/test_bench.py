@@ -0,0 +1,78 @@
+import io
+import json
+
+from pilkit.lib import Image
+
+from variations import bench
+
+SIZES = [(48, 32)]
+
+
+class TestCorpus:
+    def test_deterministic(self):
+        assert bench.make_corpus(SIZES) == bench.make_corpus(SIZES)
+        assert bench.make_corpus(SIZES, seed=1) != bench.make_corpus(SIZES)
+
+    def test_formats_and_modes(self):
+        corpus = bench.make_corpus(SIZES)
+        assert len(corpus) == sum(len(modes) for modes in bench.CORPUS_FORMATS.values())
+        for item in corpus:
+            with Image.open(io.BytesIO(item.data)) as img:
+                assert img.format == item.format
+                assert img.size == item.size
+
+
+class TestRun:
+    def test_results(self):
+        corpus = bench.make_corpus(SIZES, formats={"PNG": ("RGB", "RGBA")})
+        results = bench.run(corpus, repeat=2)
+        assert [r.scenario for r in results] == [
+            "fill", "fit", "crop", "none", "legacy",
+            "encode-jpeg", "encode-png", "encode-webp",
+        ]
+        for result in results:
+            assert result.count == 4
+            assert result.images_per_second > 0
+            assert result.p50 <= result.p90 <= result.p99
+
+    def test_percentile(self):
+        assert bench._percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.5
+        assert bench._percentile([1.0, 2.0, 3.0, 4.0], 100) == 4.0
+        assert bench._percentile([5.0], 99) == 5.0
+
+
+class TestCompare:
+    def make_result(self, scenario, images_per_second):
+        return bench.BenchResult(scenario, 10, 1.0, images_per_second, 1.0, 1.0, 1.0, 1.0)
+
+    def test_regression(self):
+        baseline = bench.to_json([
+            self.make_result("fill", 100.0),
+            self.make_result("fit", 100.0),
+        ])
+        report = bench.compare([
+            self.make_result("fill", 85.0),
+            self.make_result("fit", 95.0),
+            self.make_result("crop", 10.0),
+        ], baseline, threshold=0.1)
+
+        assert [item["scenario"] for item in report] == ["fill", "fit"]
+        assert [item["regression"] for item in report] == [True, False]
+
+
+class TestMain:
+    def test_json_and_baseline(self, tmp_path, capsys):
+        output_path = tmp_path / "results.json"
+        argv = ["--sizes", "32x24", "--repeat", "1", "-k", "fill", "crop"]
+        assert bench.main(argv + ["--json", str(output_path)]) == 0
+
+        data = json.loads(output_path.read_text())
+        assert [item["scenario"] for item in data["results"]][:2] == ["fill", "crop"]
+        assert "pillow" in data["environment"]
+
+        # The current run is much slower than this baseline.
+        for item in data["results"]:
+            item["images_per_second"] *= 100
+        output_path.write_text(json.dumps(data))
+        assert bench.main(argv + ["--baseline", str(output_path)]) == 1
+        assert "REGRESSION" in capsys.readouterr().out
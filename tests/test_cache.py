@@ -0,0 +1,197 @@
+import io
+import os
+import pickle
+
+import pytest
+from pilkit.lib import Image
+
+from variations import Variation, processors
+from variations.cache import FileSystemCache, RenderCache, get_source_hash
+from variations.processors import face_detection
+
+from . import helper
+
+SOURCE = helper.INPUT_PATH / "formats/jpg/RGB.jpg"     # 300x600
+
+
+class TestFingerprint:
+    def test_stable(self):
+        v = Variation(size=(100, 100), jpeg=dict(quality=80))
+        assert v.fingerprint() == Variation(size=(100, 100), jpeg=dict(quality=80)).fingerprint()
+        assert v.fingerprint() == v.copy().fingerprint()
+        assert len(v.fingerprint()) == 64
+
+    @pytest.mark.parametrize("variation", [
+        Variation(size=(100, 200)),
+        Variation(size=(100, 100), mode=Variation.Mode.FIT),
+        Variation(size=(100, 100), gravity=Variation.Gravity.TOP),
+        Variation(size=(100, 100), gravity=Variation.Gravity.AUTO),
+        Variation(size=(100, 100), upscale=True),
+        Variation(size=(100, 100), background="#FF0000"),
+        Variation(size=(100, 100), format="webp"),
+        Variation(size=(100, 100), jpeg=dict(quality=80)),
+        Variation(size=(100, 100), preprocessors=[processors.Grayscale()]),
+        Variation(size=(100, 100), postprocessors=[processors.GaussianBlur(2)]),
+        Variation(size=(100, 100), postprocessors=[processors.GaussianBlur(4)]),
+        Variation(size=(100, 100), clip=False),
+    ])
+    def test_changed(self, variation):
+        assert variation.fingerprint() != Variation(size=(100, 100)).fingerprint()
+
+
+class TestSourceHash:
+    def test_path_and_file_object(self):
+        with open(SOURCE, "rb") as fp:
+            fp.seek(10)
+            assert get_source_hash(fp) == get_source_hash(SOURCE)
+            assert fp.tell() == 0
+
+    def test_content(self):
+        assert get_source_hash(io.BytesIO(b"a")) != get_source_hash(io.BytesIO(b"b"))
+
+
+class TestFileSystemCache:
+    def test_get_set(self, tmp_path):
+        cache = FileSystemCache(tmp_path / "cache")
+        assert cache.get("abcdef") is None
+        cache.set("abcdef", b"data")
+        assert cache.get("abcdef") == b"data"
+        assert (tmp_path / "cache" / "ab" / "abcdef").is_file()
+
+        cache.delete("abcdef")
+        assert cache.get("abcdef") is None
+
+    def test_clear(self, tmp_path):
+        cache = FileSystemCache(tmp_path)
+        cache.set("abcdef", b"data")
+        cache.clear()
+        assert cache.get("abcdef") is None
+
+    def test_lru_eviction(self, tmp_path):
+        cache = FileSystemCache(tmp_path, max_size=25)
+        cache.set("key1", b"x" * 10)
+        cache.set("key2", b"x" * 10)
+        os.utime(cache._get_path("key1"), (1000, 1000))
+        os.utime(cache._get_path("key2"), (2000, 2000))
+
+        # Access updates the time of the entry.
+        assert cache.get("key1") is not None
+
+        cache.set("key3", b"x" * 10)
+        assert cache.get("key1") is not None
+        assert cache.get("key2") is None
+        assert cache.get("key3") is not None
+
+    def test_eviction_is_amortized(self, tmp_path, monkeypatch):
+        cache = FileSystemCache(tmp_path, max_size=100)
+        scans = []
+        evict = FileSystemCache.evict
+        monkeypatch.setattr(FileSystemCache, "evict", lambda self: (scans.append(1), evict(self)))
+
+        for index in range(9):
+            cache.set("key{}".format(index), b"x" * 10)
+        # The size is known after the first scan.
+        assert len(scans) == 1
+
+        cache.set("key1", b"x" * 20)
+        assert len(scans) == 1
+        cache.set("key9", b"x" * 10)
+        assert len(scans) == 2
+        assert cache._size <= 90
+        assert cache._size == sum(
+            path.stat().st_size for path in tmp_path.glob("*/*")
+        )
+
+    def test_pickle(self, tmp_path):
+        cache = pickle.loads(pickle.dumps(FileSystemCache(tmp_path, max_size=100)))
+        cache.set("abcdef", b"data")
+        assert cache.get("abcdef") == b"data"
+
+
+class TestRenderCache:
+    def test_render(self, tmp_path, monkeypatch):
+        cache = RenderCache(FileSystemCache(tmp_path))
+        variation = Variation(size=(100, 100))
+
+        data = cache.render(variation, SOURCE, format="jpeg")
+        with Image.open(io.BytesIO(data)) as img:
+            assert img.size == (100, 100)
+            assert img.format == "JPEG"
+
+        def fail(*args, **kwargs):
+            raise AssertionError("The source must not be processed.")
+
+        monkeypatch.setattr(Variation, "process_file", fail)
+        assert cache.render(Variation(size=(100, 100)), SOURCE, format="jpeg") == data
+
+    def test_key(self, tmp_path):
+        cache = RenderCache(FileSystemCache(tmp_path))
+        small = cache.render(Variation(size=(100, 100)), SOURCE)
+        assert cache.render(Variation(size=(50, 50)), SOURCE) != small
+        assert cache.render(Variation(size=(100, 100)), SOURCE, format="png") != small
+
+    def test_passthrough(self, tmp_path):
+        cache = RenderCache(FileSystemCache(tmp_path))
+        variation = Variation(size=(400, 800))
+        assert cache.render(variation, SOURCE, format="jpeg") == SOURCE.read_bytes()
+
+    def test_save(self, tmp_path):
+        cache = RenderCache(FileSystemCache(tmp_path / "cache"))
+        variation = Variation(size=(100, 100))
+
+        cache.save(variation, SOURCE, tmp_path / "output.png")
+        with Image.open(tmp_path / "output.png") as img:
+            assert img.format == "PNG"
+
+        buffer = io.BytesIO()
+        with open(SOURCE, "rb") as fp:
+            cache.save(variation, fp, buffer)
+        assert buffer.getvalue() == cache.render(variation, SOURCE)
+
+    def test_source_format(self, tmp_path):
+        cache = RenderCache(FileSystemCache(tmp_path))
+        data = cache.render(Variation(size=(100, 100)), SOURCE)
+        with Image.open(io.BytesIO(data)) as img:
+            assert img.format == "JPEG"
+
+        data = cache.render(Variation(size=(100, 100), format="webp"), SOURCE)
+        with Image.open(io.BytesIO(data)) as img:
+            assert img.format == "WEBP"
+
+    def test_cmyk(self, tmp_path):
+        cache = RenderCache(FileSystemCache(tmp_path))
+        data = cache.render(Variation(size=(100, 100)), helper.INPUT_PATH / "formats/jpg/CMYK.jpg")
+        with Image.open(io.BytesIO(data)) as img:
+            assert img.format == "JPEG"
+            assert img.size == (100, 100)
+
+    def test_detector_key(self, tmp_path):
+        cache = RenderCache(FileSystemCache(tmp_path))
+        variation = Variation(size=(100, 100), gravity=Variation.Gravity.AUTO)
+        default = face_detection.get_default_detector()
+        try:
+            face_detection.set_default_detector(face_detection.SaliencyDetector())
+            key = cache.get_key(variation, "hash", "JPEG")
+            face_detection.set_default_detector(face_detection.SaliencyDetector(coverage=0.9))
+            assert cache.get_key(variation, "hash", "JPEG") != key
+        finally:
+            face_detection.set_default_detector(default)
+
+        own = Variation(
+            size=(100, 100),
+            postprocessors=[face_detection.CropFace(50, 50, detector=face_detection.SaliencyDetector())]
+        )
+        other = Variation(
+            size=(100, 100),
+            postprocessors=[face_detection.CropFace(50, 50, detector=face_detection.SaliencyDetector(max_size=64))]
+        )
+        assert cache.get_key(own, "hash", "JPEG") != cache.get_key(other, "hash", "JPEG")
+
+        # Variations without face detection don't depend on the detector.
+        plain = Variation(size=(100, 100))
+        key = cache.get_key(plain, "hash", "JPEG")
+        try:
+            face_detection.set_default_detector(face_detection.SaliencyDetector(coverage=0.9))
+            assert cache.get_key(plain, "hash", "JPEG") == key
+        finally:
+            face_detection.set_default_detector(default)
@@ -0,0 +1,140 @@
+import io
+import json
+import pstats
+import tracemalloc
+
+from pilkit.lib import Image
+
+from variations import ThreadedExecutor, Variation, VariationSet
+from variations.batch import process_batch, process_source
+from variations.capture import SlowRenderCapture
+from variations.processors.face_cache import FaceCache
+from variations.processors.face_detection import CropFace
+
+from . import helper
+
+SOURCE = helper.INPUT_PATH / "formats/png/P.png"
+
+
+def get_reports(path):
+    return sorted(entry for entry in path.iterdir() if entry.is_dir())
+
+
+class TestSlowRenderCapture:
+    def test_fast(self, tmp_path):
+        capture = SlowRenderCapture(tmp_path / "slow", threshold=60)
+        capture.process_file(Variation(size=(64, 64)), SOURCE, tmp_path / "output.png")
+        assert not (tmp_path / "slow").exists()
+
+    def test_report(self, tmp_path):
+        variation = Variation(size=(64, 64))
+        capture = SlowRenderCapture(tmp_path / "slow", threshold=0, top=5, copy_source=True)
+        capture.process_file(variation, SOURCE, tmp_path / "output.jpg")
+        assert (tmp_path / "output.jpg").is_file()
+
+        report, = get_reports(tmp_path / "slow")
+        assert report.name.endswith("-P-0")
+
+        info = json.loads((report / "info.json").read_text())
+        with Image.open(SOURCE) as img:
+            assert info["source"]["format"] == img.format
+            assert info["source"]["mode"] == img.mode
+            assert info["source"]["size"] == list(img.size)
+        assert info["source"]["file_size"] == SOURCE.stat().st_size
+        assert info["variations"][""]["fingerprint"] == variation.fingerprint()
+        assert Variation.from_dict(info["variations"][""]["params"]).fingerprint() == variation.fingerprint()
+        assert info["seconds"] > 0
+        assert info["memory"]["traced_peak"] > 0
+
+        stats = pstats.Stats(str(report / "profile.pstats"))
+        assert any(func[2] == "process" for func in stats.stats)
+        assert "cumulative" in (report / "profile.txt").read_text()
+        assert "Traced peak" in (report / "memory.txt").read_text()
+        assert (report / "source.png").read_bytes() == SOURCE.read_bytes()
+        assert not tracemalloc.is_tracing()
+
+    def test_file_object(self, tmp_path):
+        capture = SlowRenderCapture(tmp_path, threshold=0)
+        with open(SOURCE, "rb") as fp:
+            capture.process_file(Variation(size=(64, 64)), fp, io.BytesIO(), "webp")
+        report, = get_reports(tmp_path)
+        assert json.loads((report / "info.json").read_text())["source"]["name"] == str(SOURCE)
+
+    def test_passthrough(self, tmp_path):
+        capture = SlowRenderCapture(tmp_path / "slow", threshold=0)
+        variation = Variation(size=(0, 0), mode=Variation.Mode.NONE)
+        assert capture.process_file(variation, SOURCE, tmp_path / "output.png") is True
+        assert not (tmp_path / "slow").exists()
+
+    def test_max_captures(self, tmp_path):
+        capture = SlowRenderCapture(tmp_path, threshold=0, max_captures=2)
+        for _ in range(3):
+            capture.process_file(Variation(size=(16, 16)), SOURCE, io.BytesIO(), "png")
+        assert len(get_reports(tmp_path)) == 2
+
+    def test_caches_bypassed(self, tmp_path):
+        class Detector:
+            expand = True
+            calls = 0
+
+            def detect(self, img):
+                self.calls += 1
+                return []
+
+        img = Image.new("RGB", (400, 400), color="red")
+        detector = Detector()
+        processor = CropFace(200, 200, cache=FaceCache(), detector=detector)
+        processor._detect_faces(img)
+        assert detector.calls == 1
+
+        # The cache is warm, but the repeated run detects the faces again.
+        capture = SlowRenderCapture(tmp_path, threshold=0)
+        report = capture.capture(lambda: processor._detect_faces(img), SOURCE, {}, 1.0)
+        assert detector.calls == 2
+        assert json.loads((report / "info.json").read_text())["rerun_caches"] == "bypassed"
+
+    def test_failure(self, tmp_path, caplog):
+        def fail():
+            raise RuntimeError("render error")
+
+        capture = SlowRenderCapture(tmp_path, threshold=0)
+        assert capture.capture(fail, SOURCE, {}, 1.0) is None
+        assert "Cannot capture" in caplog.text
+        assert not tracemalloc.is_tracing()
+
+
+class TestEngines:
+    def test_process_source(self, tmp_path):
+        variations = VariationSet({
+            "small": Variation(size=(32, 32)),
+            "copy": Variation(size=(0, 0), mode=Variation.Mode.NONE),
+        })
+        capture = SlowRenderCapture(tmp_path / "slow", threshold=0)
+        result = process_source(SOURCE, variations, tmp_path / "output", capture=capture)
+        assert result.ok
+
+        report, = get_reports(tmp_path / "slow")
+        info = json.loads((report / "info.json").read_text())
+        assert list(info["variations"]) == ["small"]
+
+    def test_process_batch(self, tmp_path):
+        capture = SlowRenderCapture(tmp_path / "slow", threshold=0)
+        results = list(process_batch(
+            [SOURCE, helper.INPUT_PATH / "formats/jpg/RGB.jpg"],
+            {"small": Variation(size=(32, 32))},
+            tmp_path / "output",
+            max_workers=1,
+            capture=capture
+        ))
+        assert all(result.ok for result in results)
+        assert len(get_reports(tmp_path / "slow")) == 2
+
+    def test_threaded_executor(self, tmp_path):
+        capture = SlowRenderCapture(tmp_path, threshold=0)
+        with ThreadedExecutor(max_workers=2, capture=capture) as executor:
+            futures = [
+                executor.submit(Variation(size=(32, 32)), SOURCE, io.BytesIO(), "png")
+                for _ in range(3)
+            ]
+            assert [future.result() for future in futures] == [False] * 3
+        assert len(get_reports(tmp_path)) == 3
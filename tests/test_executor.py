@@ -0,0 +1,156 @@
+import io
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from pilkit.lib import Image, ImageChops
+
+from variations import ThreadedExecutor, Variation, processors
+from variations.bench import make_image
+
+from . import helper
+
+SOURCES = sorted(
+    path
+    for folder in ("formats/jpg", "formats/png")
+    for path in (helper.INPUT_PATH / folder).iterdir()
+) + [
+    helper.INPUT_PATH / "exif/landscape_6.jpg",
+    helper.INPUT_PATH / "exif/portrait_3.jpg",
+]
+
+VARIATIONS = [
+    Variation(size=(160, 120)),
+    Variation(size=(160, 0), mode=Variation.Mode.FIT, background="#FFFFFF"),
+    Variation(size=(100, 100), mode=Variation.Mode.CROP, gravity=Variation.Gravity.TOP),
+    Variation(size=(200, 200), postprocessors=[processors.GaussianBlur(2)], format="png"),
+]
+
+
+def render_serial(variation, sources, format="png"):
+    results = []
+    for source in sources:
+        buffer = io.BytesIO()
+        variation.process_file(source, buffer, format=format)
+        results.append(buffer.getvalue())
+    return results
+
+
+def render_threaded(executor, variation, sources, format="png", repeat=1):
+    buffers = [io.BytesIO() for _ in range(len(sources) * repeat)]
+    futures = [
+        executor.submit(variation, source, buffer, format=format)
+        for source, buffer in zip(list(sources) * repeat, buffers)
+    ]
+    for future in futures:
+        future.result()
+    return [buffer.getvalue() for buffer in buffers]
+
+
+class TestThreadedExecutor:
+    @pytest.mark.parametrize("variation", VARIATIONS)
+    def test_same_output(self, variation):
+        expected = render_serial(variation, SOURCES)
+
+        # One variation is shared by all the threads. A fresh copy
+        # has no cached pipeline, so the threads also race to build it.
+        variation = variation.copy()
+        with ThreadedExecutor(max_workers=8) as executor:
+            results = render_threaded(executor, variation, SOURCES, repeat=2)
+
+        assert results == expected * 2
+
+    def test_legacy_pipeline_cache(self, monkeypatch):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            variation = Variation(size=(100, 0), clip=False)
+
+        # Forces the threads to constantly evict each other's pipelines.
+        monkeypatch.setattr(Variation, "LEGACY_PIPELINE_CACHE_SIZE", 2)
+
+        images = [
+            Image.new("RGB", (200 + i, 300 - i), color=(i * 10, 0, 0))
+            for i in range(12)
+        ]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            expected = [variation.process(img) for img in images]
+
+            with ThreadedExecutor(max_workers=8) as executor:
+                futures = [executor.process(variation, img) for img in images * 5]
+                results = [future.result() for future in futures]
+
+        for result, target in zip(results, expected * 5):
+            assert result.size == target.size
+            assert ImageChops.difference(result, target).getbbox(alpha_only=False) is None
+
+    def test_process_shared_image(self):
+        variation = Variation(size=(64, 64))
+        img = Image.open(helper.INPUT_PATH / "formats/jpg/RGB.jpg")
+        with ThreadedExecutor(max_workers=4) as executor:
+            futures = [executor.process(variation, img) for _ in range(8)]
+            results = [future.result() for future in futures]
+
+        expected = variation.process(Image.open(helper.INPUT_PATH / "formats/jpg/RGB.jpg"))
+        for result in results:
+            assert ImageChops.difference(result, expected).getbbox(alpha_only=False) is None
+
+    def test_process_draft(self):
+        # The shared image is decoded at the draft size, like in serial processing.
+        buffer = io.BytesIO()
+        make_image((3000, 2000), "RGB").save(buffer, "jpeg")
+        variation = Variation(size=(64, 64))
+        expected = variation.process(Image.open(io.BytesIO(buffer.getvalue())))
+
+        img = Image.open(io.BytesIO(buffer.getvalue()))
+        with ThreadedExecutor(max_workers=4) as executor:
+            futures = [executor.process(variation, img) for _ in range(4)]
+            results = [future.result() for future in futures]
+
+        assert img.size == (375, 250)
+        for result in results:
+            assert ImageChops.difference(result, expected).getbbox(alpha_only=False) is None
+
+    def test_save(self):
+        variation = Variation(size=(64, 64))
+        img = Image.new("RGBA", (100, 100), color=(255, 0, 0, 128))
+        buffers = [io.BytesIO() for _ in range(4)]
+        with ThreadedExecutor(max_workers=4) as executor:
+            for future in [executor.save(variation, img, buffer, "png") for buffer in buffers]:
+                future.result()
+
+        expected = io.BytesIO()
+        variation.save(img, expected, "png")
+        assert all(buffer.getvalue() == expected.getvalue() for buffer in buffers)
+
+    def test_map(self, tmp_path):
+        variation = Variation(size=(64, 64))
+        jobs = [(source, tmp_path / "{}.png".format(i)) for i, source in enumerate(SOURCES)]
+        with ThreadedExecutor(max_workers=4) as executor:
+            assert list(executor.map(variation, jobs)) == [False] * len(jobs)
+
+        for source, path in jobs:
+            assert path.read_bytes() == render_serial(variation, [source])[0]
+
+    def test_map_error(self, tmp_path):
+        variation = Variation(size=(64, 64))
+        jobs = [
+            (SOURCES[0], tmp_path / "0.png"),
+            (tmp_path / "missing.jpg", tmp_path / "1.png"),
+        ]
+        with ThreadedExecutor(max_workers=2) as executor:
+            with pytest.raises(FileNotFoundError):
+                list(executor.map(variation, jobs))
+
+    def test_shared_executor(self):
+        with ThreadPoolExecutor(2) as pool:
+            with ThreadedExecutor(executor=pool) as executor:
+                executor.process(Variation(size=(8, 8)), Image.new("RGB", (16, 16))).result()
+
+            # The shared executor is still usable.
+            assert pool.submit(lambda: 42).result() == 42
+
+    def test_invalid_arguments(self):
+        with ThreadPoolExecutor(1) as pool:
+            with pytest.raises(ValueError, match="Cannot use 'max_workers'"):
+                ThreadedExecutor(max_workers=2, executor=pool)
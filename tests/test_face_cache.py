@@ -0,0 +1,189 @@
+import pickle
+import time
+
+import pytest
+from pilkit.lib import Image
+
+from variations.bench import make_image
+from variations.processors import face_detection
+from variations.processors.face_cache import FaceCache, get_image_key
+from variations.processors.face_detection import CropFace
+
+from . import helper
+
+
+class TestImageKey:
+    def test_same_content(self):
+        img1 = Image.new("RGB", (64, 32), color="red")
+        img2 = Image.new("RGB", (64, 32), color="red")
+        assert get_image_key(img1) == get_image_key(img2)
+
+    def test_large_image(self):
+        img = Image.new("RGB", (3000, 2000), color="red")
+        key = get_image_key(img)
+        assert len(key) == 40
+        assert key != get_image_key(Image.new("RGB", (3000, 2000), color="blue"))
+        assert key != get_image_key(Image.new("RGB", (2000, 3000), color="red"))
+
+    def test_small_difference(self):
+        # Every pixel takes part in the key of a large image.
+        img = make_image((3000, 2000))
+        changed = img.copy()
+        changed.putpixel((1501, 999), (0, 0, 0))
+        assert get_image_key(img) != get_image_key(changed)
+
+    def test_palette(self):
+        img = Image.new("P", (64, 32))
+        changed = img.copy()
+        changed.putpalette([255, 0, 0] * 256)
+        assert get_image_key(img) != get_image_key(changed)
+
+    def test_different_content(self):
+        img = Image.new("RGB", (64, 32), color="red")
+        assert get_image_key(img) != get_image_key(img.convert("RGBA"))
+        assert get_image_key(img) != get_image_key(img.transpose(Image.Transpose.ROTATE_90))
+        assert get_image_key(img) != get_image_key(Image.new("RGB", (64, 32), color="blue"))
+
+
+class TestFaceCache:
+    def test_invalid_maxsize(self):
+        with pytest.raises(ValueError, match="'maxsize' must be"):
+            FaceCache(maxsize=-1)
+
+    def test_memory(self):
+        cache = FaceCache()
+        assert cache.get("a") is None
+
+        cache.set("a", [(10, 50, 60, 0)])
+        cache.set("b", [])
+        assert cache.get("a") == [(10, 50, 60, 0)]
+        assert cache.get("b") == []
+
+    def test_lru(self):
+        cache = FaceCache(maxsize=2)
+        cache.set("a", [])
+        cache.set("b", [])
+        cache.get("a")
+        cache.set("c", [])
+        assert len(cache) == 2
+        assert cache.get("a") == []
+        assert cache.get("b") is None
+
+    def test_sqlite(self):
+        path = helper.OUTPUT_PATH / "face_cache/faces.sqlite3"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.unlink(missing_ok=True)
+
+        cache = FaceCache(path=path)
+        cache.set("a", [(10, 50, 60, 0), (1, 2, 3, 4)])
+        cache.set("b", [])
+        cache.close()
+
+        cache = FaceCache(maxsize=0, path=path)
+        assert cache.get("a") == [(10, 50, 60, 0), (1, 2, 3, 4)]
+        assert cache.get("b") == []
+        assert cache.get("c") is None
+        cache.close()
+
+    def test_pickle(self):
+        cache = FaceCache(maxsize=16)
+        cache.set("a", [])
+
+        restored = pickle.loads(pickle.dumps(cache))
+        assert restored.maxsize == 16
+        assert restored.get("a") is None
+
+
+class CachedDetector:
+    expand = True
+
+    def __repr__(self):
+        return "CachedDetector()"
+
+    def detect(self, img):
+        raise AssertionError("The face locations must be taken from the cache.")
+
+
+class CountingDetector:
+    expand = True
+
+    def __init__(self):
+        self.calls = 0
+
+    def __repr__(self):
+        return "CountingDetector()"
+
+    def detect(self, img):
+        self.calls += 1
+        return [(100, 150, 150, 100)]
+
+
+class TestDetection:
+    def test_cached_faces(self):
+        img = Image.new("RGB", (400, 400), color="red")
+        cache = FaceCache()
+        detector = CachedDetector()
+        processor = CropFace(200, 200, cache=cache, detector=detector)
+        cache.set(processor._get_cache_key(img, detector), [(100, 150, 150, 100)])
+
+        assert processor._detect_faces(img) == (75, 65, 100, 110)
+
+    def test_default_cache(self):
+        img = Image.new("RGB", (400, 400), color="red")
+        detector = CachedDetector()
+        cache = FaceCache()
+        cache.set(CropFace(200, 200)._get_cache_key(img, detector), [])
+
+        default_cache = face_detection.get_default_cache()
+        face_detection.set_default_cache(cache)
+        try:
+            assert CropFace(200, 200, detector=detector)._detect_faces(img) is None
+        finally:
+            face_detection.set_default_cache(default_cache)
+
+    def test_bypass_cache(self):
+        img = Image.new("RGB", (400, 400), color="red")
+        cache = FaceCache()
+        detector = CountingDetector()
+        processor = CropFace(200, 200, cache=cache, detector=detector)
+        processor._detect_faces(img)
+        processor._detect_faces(img)
+        assert detector.calls == 1
+
+        with face_detection.bypass_cache():
+            processor._detect_faces(img)
+        assert detector.calls == 2
+        assert len(cache) == 1
+
+    def test_cheap_detector_is_not_cached(self):
+        pytest.importorskip("numpy")
+        img = Image.new("RGB", (400, 400), color="red")
+        cache = FaceCache()
+        default_cache = face_detection.get_default_cache()
+        face_detection.set_default_cache(cache)
+        try:
+            CropFace(200, 200, detector=face_detection.SaliencyDetector())._detect_faces(img)
+            assert len(cache) == 0
+
+            # An explicit cache is used anyway.
+            CropFace(200, 200, cache=cache, detector=face_detection.SaliencyDetector())._detect_faces(img)
+            assert len(cache) == 1
+        finally:
+            face_detection.set_default_cache(default_cache)
+
+    def test_cache_hit_is_cheaper_than_detection(self):
+        if not face_detection.FACE_DETECTION_SUPPORT:
+            pytest.skip("face_recognition is not installed")
+        img = make_image((3000, 2000))
+        detector = face_detection.FaceRecognitionDetector()
+
+        def measure(func):
+            timings = []
+            for _ in range(3):
+                start = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - start)
+            return min(timings)
+
+        # The cached detector is slower than computing the key.
+        assert measure(lambda: get_image_key(img)) * 2 < measure(lambda: detector.detect(img))
@@ -0,0 +1,127 @@
+import io
+import pickle
+import socket
+
+import pytest
+from pilkit.lib import Image
+
+from variations import Variation, metrics, processors, timing
+from variations.processors.face_detection import CropFace, SaliencyDetector
+
+from . import helper
+
+
+@pytest.fixture
+def registry():
+    registry = metrics.Metrics()
+    with timing.hook(registry):
+        yield registry
+
+
+class TestHistogram:
+    def test_observe(self):
+        histogram = metrics.Histogram([1, 0.1, 0.5])
+        for value in (0.05, 0.1, 0.3, 2.0):
+            histogram.observe(value)
+
+        assert histogram.buckets == (0.1, 0.5, 1)
+        assert histogram.cumulative_counts() == [2, 3, 3]
+        assert histogram.count == 4
+        assert histogram.sum == pytest.approx(2.45)
+
+
+class TestMetrics:
+    def test_render(self, registry):
+        variation = Variation(size=(100, 100), preprocessors=[processors.Grayscale()])
+        img = variation.process(Image.open(helper.INPUT_PATH / "exif/landscape_6.jpg"))
+        buffer = io.BytesIO()
+        variation.save(img, buffer, "jpeg")
+
+        assert registry.get_counter("encoded_images_total", format="JPEG") == 1
+        assert registry.get_counter("encoded_bytes_total", format="JPEG") == len(buffer.getvalue())
+        assert registry.get_counter("decoded_megapixels_total", format="JPEG") > 0
+        assert registry.get_histogram("stage_seconds", stage="processor", name="Grayscale").count == 1
+
+    def test_draft(self, registry):
+        # Megapixels are counted after the draft.
+        buffer = io.BytesIO()
+        Image.new("RGB", (2000, 1000)).save(buffer, "jpeg")
+        Variation(size=(100, 50)).process(Image.open(buffer))
+        assert registry.get_counter("decoded_megapixels_total", format="JPEG") == 250 * 125 / 1e6
+
+    def test_detections(self, registry):
+        numpy = pytest.importorskip("numpy")  # noqa
+
+        detector = SaliencyDetector()
+        blank = Image.new("RGB", (200, 100))
+        detailed = Image.effect_noise((200, 100), 64).convert("RGB")
+        for img in (blank, detailed, detailed):
+            CropFace(50, 50, detector=detector).process(img)
+
+        labels = {"detector": "SaliencyDetector"}
+        assert registry.get_counter("detections_total", result="miss", **labels) == 1
+        assert registry.get_counter("detections_total", result="hit", **labels) == 2
+
+    def test_prometheus(self):
+        registry = metrics.Metrics(buckets=[0.1, 1])
+        registry.increment("encoded_bytes_total", 1024, format="PNG")
+        registry.increment("renders_total", variation='say "hi"\n')
+        registry.observe("stage_seconds", 0.5, stage="encode", name="PNG")
+
+        assert registry.to_prometheus() == "\n".join([
+            "# HELP variations_encoded_bytes_total Bytes of encoded output images.",
+            "# TYPE variations_encoded_bytes_total counter",
+            'variations_encoded_bytes_total{format="PNG"} 1024',
+            "# HELP variations_renders_total Saved outputs of the batch engine.",
+            "# TYPE variations_renders_total counter",
+            'variations_renders_total{variation="say \\"hi\\"\\n"} 1',
+            "# HELP variations_stage_seconds Duration of processing stages.",
+            "# TYPE variations_stage_seconds histogram",
+            'variations_stage_seconds_bucket{name="PNG",stage="encode",le="0.1"} 0',
+            'variations_stage_seconds_bucket{name="PNG",stage="encode",le="1"} 1',
+            'variations_stage_seconds_bucket{name="PNG",stage="encode",le="+Inf"} 1',
+            'variations_stage_seconds_sum{name="PNG",stage="encode"} 0.5',
+            'variations_stage_seconds_count{name="PNG",stage="encode"} 1',
+        ]) + "\n"
+
+    def test_empty(self):
+        assert metrics.Metrics().to_prometheus() == ""
+
+    def test_pickle(self):
+        registry = metrics.Metrics()
+        registry.increment("errors_total")
+        registry = pickle.loads(pickle.dumps(registry))
+        registry.increment("errors_total")
+        assert registry.get_counter("errors_total") == 2
+
+
+class TestStatsdClient:
+    def test_format_line(self):
+        client = metrics.StatsdClient()
+        labels = {"stage": "processor", "name": "ResizeToFill"}
+        assert client.format_line("stage_seconds", 12.5, "ms", labels) == \
+            "variations.stage_seconds.processor.ResizeToFill:12.5|ms"
+
+        client = metrics.StatsdClient(prefix="", tags=True)
+        assert client.format_line("encoded_bytes_total", 100, "c", {"format": "JPEG"}) == \
+            "encoded_bytes_total:100|c|#format:JPEG"
+
+    def test_send(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(5)
+
+        client = metrics.StatsdClient(port=server.getsockname()[1])
+        # The client can be sent to worker processes.
+        client = pickle.loads(pickle.dumps(client))
+        try:
+            with timing.hook(client):
+                Variation(size=(10, 10)).save(Image.new("RGB", (20, 20)), io.BytesIO(), "png")
+
+            lines = {server.recv(1024).decode() for _ in range(4)}
+        finally:
+            client.close()
+            server.close()
+
+        assert "variations.encoded_images_total.PNG:1|c" in lines
+        assert any(line.startswith("variations.stage_seconds.encode.PNG:") for line in lines)
@@ -0,0 +1,148 @@
+import io
+
+import pytest
+from PIL import PngImagePlugin
+from pilkit.lib import Image, ImageChops
+
+from variations import Variation, processors
+from variations.passthrough import copy_file, remove_metadata
+
+from . import helper
+
+
+def make_jpeg(**options) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), color="red").save(buffer, format="JPEG", **options)
+    return buffer.getvalue()
+
+
+def make_png() -> bytes:
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Comment", "secret")
+    info.add_itxt("Author", "secret")
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), color="red").save(buffer, format="PNG", pnginfo=info)
+    return buffer.getvalue()
+
+
+class TestRemoveMetadata:
+    def test_jpeg(self):
+        exif = Image.Exif()
+        exif[0x010E] = "secret"
+        data = make_jpeg(exif=exif.tobytes(), comment=b"secret", icc_profile=b"profile")
+        assert data.count(b"secret") == 2
+
+        stripped = remove_metadata(data, "jpeg")
+        assert b"secret" not in stripped
+        with Image.open(io.BytesIO(stripped)) as img:
+            assert img.info.get("icc_profile") == b"profile"
+            assert not img.getexif()
+            assert ImageChops.difference(
+                img.convert("RGB"),
+                Image.open(io.BytesIO(data)).convert("RGB")
+            ).getbbox(alpha_only=False) is None
+
+    def test_png(self):
+        data = make_png()
+        stripped = remove_metadata(data, "PNG")
+        assert b"secret" in data
+        assert b"secret" not in stripped
+        with Image.open(io.BytesIO(stripped)) as img:
+            img.load()
+            assert img.size == (64, 48)
+
+    def test_unsupported_format(self):
+        with pytest.raises(ValueError, match="Cannot strip metadata"):
+            remove_metadata(b"", "GIF")
+
+    def test_invalid_data(self):
+        with pytest.raises(ValueError, match="Invalid JPEG data"):
+            remove_metadata(make_png(), "JPEG")
+
+
+class TestCopyFile:
+    def test_path(self, tmp_path):
+        source = helper.INPUT_PATH / "formats/jpg/RGB.jpg"
+        copy_file(source, tmp_path / "copy.jpg")
+        assert (tmp_path / "copy.jpg").read_bytes() == source.read_bytes()
+
+    def test_file_object(self):
+        data = make_jpeg(comment=b"secret")
+        source = io.BytesIO(data)
+        source.seek(10)
+
+        dest = io.BytesIO()
+        copy_file(source, dest)
+        assert dest.getvalue() == data
+
+        dest = io.BytesIO()
+        copy_file(source, dest, strip_metadata=True, format="JPEG")
+        assert dest.getvalue() == remove_metadata(data, "JPEG")
+
+    def test_format_required(self):
+        with pytest.raises(ValueError, match="'format' is required"):
+            copy_file(io.BytesIO(), io.BytesIO(), strip_metadata=True)
+
+
+class TestIsPassthrough:
+    source = helper.INPUT_PATH / "formats/jpg/RGB.jpg"     # 300x600
+
+    @pytest.mark.parametrize("variation", [
+        Variation(size=(400, 800)),
+        Variation(size=(300, 0), mode=Variation.Mode.FIT),
+        Variation(size=(400, 0), mode=Variation.Mode.CROP),
+        Variation(size=(0, 0), mode=Variation.Mode.NONE),
+    ])
+    def test_identity(self, variation):
+        with Image.open(self.source) as img:
+            assert variation.is_passthrough(img)
+            assert variation.is_passthrough(img, "jpeg", strip_metadata=True)
+
+    @pytest.mark.parametrize("variation", [
+        Variation(size=(200, 200)),
+        Variation(size=(400, 800), upscale=True),
+        Variation(size=(400, 800), format="webp"),
+        Variation(size=(400, 800), jpeg=dict(quality=80)),
+        Variation(size=(400, 800), postprocessors=[processors.Grayscale()]),
+        Variation(size=(400, 800), clip=False),
+    ])
+    def test_changed(self, variation):
+        with Image.open(self.source) as img:
+            assert not variation.is_passthrough(img)
+
+    def test_output_format(self):
+        with Image.open(self.source) as img:
+            assert not Variation(size=(400, 800)).is_passthrough(img, "PNG")
+
+    def test_exif_orientation(self):
+        with Image.open(helper.INPUT_PATH / "exif/portrait_6.jpg") as img:
+            assert not Variation(size=(0, 0), mode=Variation.Mode.NONE).is_passthrough(img)
+
+    def test_strip_metadata_support(self):
+        with Image.open(helper.INPUT_PATH / "formats/gif/P.gif") as img:
+            v = Variation(size=(0, 0), mode=Variation.Mode.NONE)
+            assert v.is_passthrough(img)
+            assert not v.is_passthrough(img, strip_metadata=True)
+
+
+class TestProcessFile:
+    source = helper.INPUT_PATH / "formats/jpg/RGB.jpg"     # 300x600
+
+    def test_copy(self, tmp_path):
+        output_path = tmp_path / "copy.jpg"
+        assert Variation(size=(400, 800)).process_file(self.source, output_path) is True
+        assert output_path.read_bytes() == self.source.read_bytes()
+
+    def test_process(self, tmp_path):
+        output_path = tmp_path / "small.jpg"
+        assert Variation(size=(100, 100)).process_file(self.source, output_path) is False
+        with Image.open(output_path) as img:
+            assert img.size == (100, 100)
+
+    def test_file_object(self):
+        dest = io.BytesIO()
+        with open(self.source, "rb") as fp:
+            v = Variation(size=(0, 0), mode=Variation.Mode.NONE, format="jpeg")
+            assert v.process_file(fp, dest) is True
+        assert dest.getvalue() == self.source.read_bytes()
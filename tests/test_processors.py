@@ -1,7 +1,8 @@
 import pytest
-from pilkit.lib import Image
+from pilkit.lib import Image, ImageChops
 
 from variations.processors import *
+from variations.processors import face_detection
 from variations.processors.face_detection import CropFace, ResizeToFillFace
 from variations.utils import save_image
 
@@ -159,6 +160,37 @@ class TestResizeToFit:
             print(f"ERROR: {target_path} not exist")
 
 
+@pytest.mark.iterdir("file", ["tests/input/formats/jpg", "tests/input/formats/gif"])
+@pytest.mark.parametrize("size", (
+    (200, 500),
+    (200, 800),
+    (400, 500),
+    (100, 100),
+))
+@pytest.mark.parametrize("anchor", (Anchor.CENTER, Anchor.TOP_LEFT, (0.3, 0.8)))
+@pytest.mark.parametrize("upscale", (False, True))
+class TestResizeToFill:
+    def test_processor(self, file, size, anchor, upscale):
+        from pilkit.processors import ResizeToFill as PilkitResizeToFill
+
+        img = Image.open(file)
+        new_img = ResizeToFill(*size, anchor=anchor, upscale=upscale).process(img)
+
+        img = Image.open(file)
+        target_img = PilkitResizeToFill(*size, anchor=anchor, upscale=upscale).process(img)
+
+        assert new_img.size == target_img.size
+        assert new_img.mode == target_img.mode
+        assert ImageChops.difference(new_img, target_img).getbbox(alpha_only=False) is None
+
+    def test_reducing_gap(self, file, size, anchor, upscale):
+        img = Image.open(file)
+        new_img = ResizeToFill(*size, anchor=anchor, upscale=upscale, reducing_gap=2).process(img)
+        assert new_img.size == (
+            ResizeToFill(*size, anchor=anchor, upscale=upscale).process(img).size
+        )
+
+
 @pytest.mark.iterdir("file", "tests/input/faces")
 @pytest.mark.parametrize("size", ([400, 400], [200, 200]))
 @pytest.mark.parametrize("upscale", (False, True))
@@ -186,6 +218,68 @@ class TestResizeToFillFace:
             print(f"ERROR: {target_path} not exist")
 
 
+class TestFaceDetectionProxy:
+    @pytest.mark.parametrize("mode", ("RGB", "RGBA", "P", "CMYK", "1"))
+    def test_proxy(self, mode):
+        img = Image.new("RGB", (2400, 1200), color="red").convert(mode)
+        proxy = face_detection._get_proxy(img, 800)
+        assert proxy.size == (800, 400)
+        assert proxy.mode == "L"
+
+    def test_small_image(self):
+        img = Image.new("RGB", (600, 300), color="red")
+        proxy = face_detection._get_proxy(img, 800)
+        assert proxy.size == (600, 300)
+
+    def test_source_coordinates(self):
+        img = Image.new("RGB", (2400, 1200), color="red")
+        proxy = face_detection._get_proxy(img, 800)
+        rects = face_detection._scale_rects([(100, 300, 200, 200)], proxy, img)
+        assert rects == [(300, 900, 600, 600)]
+
+
+class TestSaliencyDetector:
+    def test_invalid_coverage(self):
+        with pytest.raises(ValueError, match="'coverage' must be"):
+            face_detection.SaliencyDetector(coverage=0)
+
+    def test_detect(self):
+        img = Image.new("RGB", (2000, 1000), color="white")
+        img.paste(Image.effect_noise((200, 100), 100).convert("RGB"), (1500, 200))
+
+        rects = face_detection.SaliencyDetector().detect(img)
+        assert len(rects) == 1
+
+        top, right, bottom, left = rects[0]
+        assert 1450 <= left < right <= 1750
+        assert 150 <= top < bottom <= 350
+
+    def test_flat_image(self):
+        img = Image.new("RGB", (2000, 1000), color="white")
+        assert face_detection.SaliencyDetector().detect(img) == []
+
+    def test_processors(self):
+        img = Image.new("RGB", (2000, 1000), color="white")
+        img.paste(Image.effect_noise((200, 200), 100).convert("RGB"), (1700, 400))
+        detector = face_detection.SaliencyDetector()
+
+        salient_region = img.crop((1700, 400, 1900, 600))
+
+        new_img = CropFace(400, 400, detector=detector).process(img)
+        assert new_img.size == (400, 400)
+        assert ImageChops.difference(
+            new_img.convert("RGB").crop((100, 100, 300, 300)),
+            salient_region
+        ).getbbox(alpha_only=False) is None
+
+        new_img = ResizeToFillFace(500, 1000, detector=detector).process(img)
+        assert new_img.size == (500, 1000)
+        assert ImageChops.difference(
+            new_img.convert("RGB").crop((200, 400, 400, 600)),
+            salient_region
+        ).getbbox(alpha_only=False) is None
+
+
 class TestFilters:
     def _test_processor(self, file, filter, folder):
         output_path = helper.OUTPUT_PATH / "processors/filters" / folder / file.name
@@ -226,3 +320,80 @@ class TestFilters:
     @pytest.mark.iterdir("file", "tests/input/processors")
     def test_stack_blur(self, file):
         self._test_processor(file, StackBlur(10), folder="stack_blur")
+
+
+class TestParams:
+    @pytest.mark.parametrize("processor", [
+        Grayscale(),
+        GaussianBlur(5),
+        BoxBlur(2),
+        ColorOverlay("#FF000080"),
+        MakeOpaque((0, 0, 255)),
+        Crop(100, 50, anchor=Anchor.TOP),
+        ResizeToFit(100, 50, upscale=False, mat_color=(255, 0, 0)),
+        ResizeToFill(100, 50, anchor=Anchor.BOTTOM, reducing_gap=2.0),
+        Resize(100, 50, upscale=False),
+        ResizeToCover(100, 50),
+        ResizeCanvas(100, 50, color=(0, 0, 0), anchor=Anchor.LEFT),
+    ])
+    def test_round_trip(self, processor):
+        data = processor_to_dict(processor)
+        restored = processor_from_dict(data)
+        assert type(restored) is type(processor)
+        assert processor_to_dict(restored) == data
+        assert get_cache_key(restored) == get_cache_key(processor)
+
+    def test_params(self):
+        assert GaussianBlur(5).params() == {"radius": 5}
+        assert ColorOverlay("#FF0000", 0.5).params() == {"color": (255, 0, 0, 128)}
+        assert get_params(Resize(100, 50)) == {"width": 100, "height": 50, "upscale": True}
+
+    def test_cache_key(self):
+        assert GaussianBlur(5).cache_key() == GaussianBlur(5).cache_key()
+        assert GaussianBlur(5).cache_key() != GaussianBlur(4).cache_key()
+        assert GaussianBlur(5).cache_key() != BoxBlur(5).cache_key()
+        assert get_cache_key(Resize(100, 50)) != get_cache_key(Resize(100, 60))
+
+    def test_unknown_params(self):
+        with pytest.raises(TypeError, match="Cannot get the parameters"):
+            get_params(AddBorder(2))
+
+    def test_not_a_processor(self):
+        with pytest.raises(ValueError, match="is not a processor"):
+            processor_from_dict({"class": "collections.OrderedDict", "params": {}})
+
+    @pytest.mark.parametrize("path", [
+        "os.system",
+        "subprocess.Popen",
+        "pilkit.processors.base.Image",
+        "variations.processors.face_cache.FaceCache",
+        "variations.processors.base.missing",
+    ])
+    def test_untrusted_class(self, path):
+        with pytest.raises(ValueError, match="is not a processor"):
+            processor_from_dict({"class": path, "params": {}})
+
+    def test_pilkit_processor(self):
+        processor = processor_from_dict({
+            "class": "pilkit.processors.resize.Thumbnail",
+            "params": {"width": 100, "height": 50},
+        })
+        assert processor.width == 100
+
+    def test_register_processor(self):
+        class Custom:
+            def __init__(self, value):
+                self.value = value
+
+            def process(self, img):
+                return img
+
+        data = processor_to_dict(Custom(5))
+        with pytest.raises(ValueError, match="is not a processor"):
+            processor_from_dict(data)
+
+        assert register_processor(Custom) is Custom
+        assert processor_from_dict(data).value == 5
+
+        with pytest.raises(ValueError, match="is not a processor"):
+            register_processor(dict)
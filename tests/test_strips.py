@@ -0,0 +1,226 @@
+import io
+import warnings
+
+import PIL
+import pytest
+from pilkit.lib import Image, ImageChops
+from pilkit.processors.utils import resolve_palette
+
+from variations import Variation, processors, strips
+from variations.bench import make_image
+
+from . import helper
+
+SIZE = (641, 957)
+
+VARIATIONS = [
+    Variation(size=(120, 90)),
+    Variation(size=(120, 0)),
+    Variation(size=(120, 90), mode=Variation.Mode.FIT, background="#FF0000"),
+    Variation(size=(90, 120), mode=Variation.Mode.FIT),
+    Variation(size=(100, 100), mode=Variation.Mode.CROP, gravity=Variation.Gravity.BOTTOM_RIGHT),
+    Variation(size=(500, 80), upscale=False),
+    Variation(size=(120, 90), postprocessors=[processors.Grayscale()]),
+]
+
+
+def encode(img, format, **options):
+    buffer = io.BytesIO()
+    img.save(buffer, format, **options)
+    return buffer.getvalue()
+
+
+def assert_similar(img, expected):
+    # Resampling of separate strips may round differently, so a few pixels
+    # can differ slightly. Colors are compared premultiplied by alpha,
+    # which is what is resampled.
+    assert img.size == expected.size
+    assert img.mode == expected.mode
+    diff = ImageChops.difference(
+        img.convert("RGBA").convert("RGBa"),
+        expected.convert("RGBA").convert("RGBa")
+    )
+    assert max(high for low, high in diff.getextrema()) <= 1
+
+
+class TestStripReader:
+    @pytest.mark.parametrize("format, mode", [
+        ("BMP", "RGB"),
+        ("BMP", "P"),
+        ("PPM", "L"),
+        ("TIFF", "RGBA"),
+        ("TIFF", "L"),
+    ])
+    def test_streaming(self, format, mode):
+        data = encode(make_image(SIZE, mode), format)
+        with Image.open(io.BytesIO(data)) as img:
+            reader = strips.StripReader(img, strip_height=64)
+            assert reader.streaming
+            new_img = strips.resize_in_strips(reader, (160, 240), strip_height=64)
+
+            # The source has never been decoded entirely.
+            assert img.tile
+            assert reader.peak_rows < SIZE[1] // 2
+
+        with Image.open(io.BytesIO(data)) as img:
+            expected = resolve_palette(img).resize((160, 240), Image.LANCZOS)
+        assert_similar(new_img, expected)
+
+    def test_tiles(self):
+        source = make_image(SIZE, "RGB")
+        data = encode(source, "TIFF") + bytes(SIZE[0] * 3)
+
+        with Image.open(io.BytesIO(data)) as img:
+            # Describes the data as a grid of 128x96 tiles.
+            _, _, offset, (rawmode, _, _) = img.tile[0]
+            stride = SIZE[0] * 3
+            img.tile = [
+                ("raw", (x, y, min(x + 128, SIZE[0]), min(y + 96, SIZE[1])),
+                 offset + y * stride + x * 3, (rawmode, stride, 1))
+                for y in range(0, SIZE[1], 96)
+                for x in range(0, SIZE[0], 128)
+            ]
+            reader = strips.StripReader(img, strip_height=200)
+            assert [(y0, y1) for y0, y1, _ in reader._bands][:2] == [(0, 288), (288, 576)]
+            assert ImageChops.difference(reader.get_rows(100, 700), source.crop((0, 100, SIZE[0], 700))).getbbox(alpha_only=False) is None
+
+    @pytest.mark.parametrize("mode", ["1", "L", "P"])
+    def test_nearest(self, mode):
+        data = encode(make_image(SIZE, mode), "TIFF")
+        box = (10.5, 20.25, 600, 900)
+        with Image.open(io.BytesIO(data)) as img:
+            reader = strips.StripReader(img, strip_height=64)
+            new_img = strips.resize_in_strips(reader, (97, 131), box, Image.NEAREST, strip_height=64)
+        with Image.open(io.BytesIO(data)) as img:
+            expected = resolve_palette(img).resize((97, 131), Image.NEAREST, box=box)
+        assert ImageChops.difference(new_img, expected).getbbox(alpha_only=False) is None
+
+    def test_palette(self):
+        data = encode(make_image(SIZE, "P"), "BMP")
+        with Image.open(io.BytesIO(data)) as img:
+            reader = strips.StripReader(img, strip_height=64)
+            rows = reader.get_rows(100, 300)
+            assert rows.mode == "P"
+            assert rows.getpalette() == img.getpalette()
+        with Image.open(io.BytesIO(data)) as img:
+            expected = img.crop((0, 100, SIZE[0], 300))
+            assert ImageChops.difference(rows.convert("RGB"), expected.convert("RGB")).getbbox(alpha_only=False) is None
+
+    def test_unknown_layout(self):
+        data = encode(make_image(SIZE, "RGB"), "BMP")
+        with Image.open(io.BytesIO(data)) as img:
+            img.tile = [("unknown", (0, 0) + SIZE, 0, None)]
+            assert strips._get_raw_tiles(img) is None
+
+    def test_compressed(self):
+        data = encode(make_image(SIZE, "RGB"), "PNG")
+        with Image.open(io.BytesIO(data)) as img:
+            assert not strips.can_decode_in_strips(img)
+            reader = strips.StripReader(img)
+            assert not reader.streaming
+            assert reader.peak_rows == SIZE[1]
+
+
+class TestProcessInStrips:
+    @pytest.mark.parametrize("variation", VARIATIONS)
+    @pytest.mark.parametrize("format, mode", [
+        ("BMP", "RGB"),
+        ("BMP", "P"),
+        ("TIFF", "LA"),
+        ("TIFF", "CMYK"),
+        ("PNG", "RGBA"),
+        ("JPEG", "L"),
+    ])
+    def test_same_output(self, variation, format, mode):
+        data = encode(make_image(SIZE, mode), format)
+        with Image.open(io.BytesIO(data)) as img:
+            expected = variation.process(img)
+            expected.load()
+        with Image.open(io.BytesIO(data)) as img:
+            new_img = variation.process_in_strips(img, strip_height=64)
+        assert_similar(new_img, expected)
+
+    @pytest.mark.parametrize("variation", VARIATIONS)
+    @pytest.mark.parametrize("mode", ["1", "L", "LA", "P", "RGB", "RGBA", "CMYK"])
+    def test_modes(self, variation, mode):
+        data = encode(make_image(SIZE, mode), "TIFF")
+        with Image.open(io.BytesIO(data)) as img:
+            expected = variation.process(img)
+            expected.load()
+        with Image.open(io.BytesIO(data)) as img:
+            new_img = variation.process_in_strips(img, strip_height=64)
+        if mode == "1":
+            assert ImageChops.difference(new_img, expected).getbbox(alpha_only=False) is None
+        else:
+            assert_similar(new_img, expected)
+
+    def test_decoding_error(self, monkeypatch):
+        def decode_band(*args):
+            raise ValueError("unsupported layout")
+
+        monkeypatch.setattr(strips.StripReader, "_decode_band", decode_band)
+        variation = VARIATIONS[0]
+        data = encode(make_image(SIZE, "RGB"), "BMP")
+        with Image.open(io.BytesIO(data)) as img:
+            expected = variation.process(img)
+            expected.load()
+        with Image.open(io.BytesIO(data)) as img:
+            new_img = variation.process_in_strips(img, strip_height=64)
+        assert ImageChops.difference(new_img, expected).getbbox(alpha_only=False) is None
+
+    def test_unsupported_pillow(self, monkeypatch):
+        # The loader state isn't read: the source is decoded entirely.
+        monkeypatch.setattr(strips, "PILLOW_VERSIONS", ((0, 0), (0, 1)))
+        variation = VARIATIONS[0]
+        data = encode(make_image(SIZE, "RGB"), "BMP")
+        with Image.open(io.BytesIO(data)) as img:
+            expected = variation.process(img)
+            expected.load()
+        with Image.open(io.BytesIO(data)) as img:
+            assert not strips.can_decode_in_strips(img)
+            new_img = variation.process_in_strips(img, strip_height=64)
+        assert_similar(new_img, expected)
+
+    def test_unknown_pillow_version(self, monkeypatch, caplog):
+        # The version can't be checked: the image is processed by process().
+        monkeypatch.setattr(PIL, "__version__", "dev")
+        variation = VARIATIONS[0]
+        data = encode(make_image(SIZE, "RGB"), "BMP")
+        with Image.open(io.BytesIO(data)) as img:
+            expected = variation.process(img)
+            expected.load()
+        with Image.open(io.BytesIO(data)) as img:
+            new_img = variation.process_in_strips(img, strip_height=64)
+        assert "falling back to process()" in caplog.text
+        assert ImageChops.difference(new_img, expected).getbbox(alpha_only=False) is None
+
+    @pytest.mark.parametrize("variation", [
+        Variation(size=(64, 64), preprocessors=[processors.Grayscale()]),
+        Variation(size=(0, 0), mode=Variation.Mode.NONE),
+        Variation(size=(2000, 2000), mode=Variation.Mode.FIT, background="#FFFFFF", upscale=False),
+    ])
+    def test_fallback(self, variation):
+        data = encode(make_image(SIZE, "RGB"), "BMP")
+        with Image.open(io.BytesIO(data)) as img:
+            expected = variation.process(img)
+            expected.load()
+        with Image.open(io.BytesIO(data)) as img:
+            new_img = variation.process_in_strips(img)
+            new_img.load()
+        assert ImageChops.difference(new_img, expected).getbbox(alpha_only=False) is None
+
+    def test_exif_orientation(self):
+        variation = Variation(size=(100, 100))
+        path = helper.INPUT_PATH / "exif/landscape_6.jpg"
+        with Image.open(path) as img:
+            expected = variation.process(img)
+        with Image.open(path) as img:
+            new_img = variation.process_in_strips(img)
+        assert ImageChops.difference(new_img, expected).getbbox(alpha_only=False) is None
+
+    def test_legacy(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            variation = Variation(size=(100, 0), clip=False)
+            img = make_image(SIZE, "RGB")
+            assert variation.process_in_strips(img).size == variation.process(img).size
@@ -0,0 +1,109 @@
+import io
+import threading
+import warnings
+
+from pilkit.lib import Image
+
+from variations import Variation, VariationSet, processors, timing
+
+from . import helper
+
+SOURCE = helper.INPUT_PATH / "exif/landscape_6.jpg"
+
+
+class TestHooks:
+    def test_no_hooks(self):
+        assert timing.get_hooks() == ()
+
+    def test_collect(self):
+        variation = Variation(size=(100, 100), preprocessors=[processors.Grayscale()])
+        with timing.collect() as timings:
+            img = variation.process(Image.open(SOURCE))
+            variation.save(img, io.BytesIO(), "jpeg")
+
+        assert [(t.stage, t.name) for t in timings] == [
+            ("decode", "JPEG"),
+            ("exif", ""),
+            ("processor", "Grayscale"),
+            ("processor", "ResizeToFill"),
+            ("convert", "JPEG"),
+            ("encode", "JPEG"),
+        ]
+        assert all(t.seconds >= 0 for t in timings)
+
+        decode, exif, grayscale, resize, convert, encode = timings
+        assert decode.input_mode == "RGB"
+        assert exif.input_size == exif.output_size[::-1]
+        assert grayscale.output_mode == "LA"
+        assert resize.output_size == (100, 100)
+        assert convert.output_mode == "RGB"
+        assert encode.bytes_written > 0
+        assert timing.get_hooks() == ()
+
+    def test_bytes_written(self, tmp_path):
+        img = Image.new("RGB", (64, 64), color="red")
+        buffer = io.BytesIO(b"prefix")
+        buffer.seek(0, io.SEEK_END)
+        with timing.collect() as timings:
+            Variation(size=(100, 100)).save(img, buffer, "png")
+            Variation(size=(100, 100)).save(img, tmp_path / "image.png")
+
+        assert timings[1].bytes_written == len(buffer.getvalue()) - len(b"prefix")
+        assert timings[3].bytes_written == (tmp_path / "image.png").stat().st_size
+
+    def test_legacy(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            variation = Variation(size=(100, 100), clip=False)
+
+            with timing.collect() as timings:
+                variation.process(Image.new("RGB", (200, 300)))
+
+        assert [(t.stage, t.name) for t in timings] == [("processor", "ResizeToFit")]
+
+    def test_variation_set(self):
+        variations = VariationSet({
+            "small": Variation(size=(50, 50)),
+            "large": Variation(size=(100, 100)),
+        })
+        with timing.collect() as timings:
+            variations.process(Image.open(SOURCE))
+
+        stages = [t.stage for t in timings]
+        assert stages[:2] == ["decode", "exif"]
+        assert stages.count("decode") == 1
+        assert stages.count("processor") == 2
+
+    def test_global_hook(self):
+        timings = []
+        timing.add_hook(timings.append)
+        try:
+            thread = threading.Thread(
+                target=Variation(size=(10, 10)).process,
+                args=(Image.new("RGB", (20, 20)),)
+            )
+            thread.start()
+            thread.join()
+        finally:
+            timing.remove_hook(timings.append)
+
+        assert [t.name for t in timings] == ["", "", "ResizeToFill"]
+        assert timing.get_hooks() == ()
+
+    def test_context_hook_is_local(self):
+        other_thread_hooks = []
+        with timing.collect():
+            thread = threading.Thread(target=lambda: other_thread_hooks.append(timing.get_hooks()))
+            thread.start()
+            thread.join()
+        assert other_thread_hooks == [()]
+
+    def test_failing_hook(self, caplog):
+        def failing_hook(t):
+            raise RuntimeError("hook error")
+
+        with timing.hook(failing_hook):
+            img = Variation(size=(10, 10)).process(Image.new("RGB", (20, 20)))
+
+        assert img.size == (10, 10)
+        assert "Timing hook" in caplog.text
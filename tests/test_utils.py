@@ -217,3 +217,127 @@ class TestSaveRGBA2(TestSaveBase):
 
     def test_webp(self):
         self._test_file("WEBP")
+
+
+class TestEncodingProfiles:
+    @pytest.fixture
+    def saved_options(self, monkeypatch):
+        saved = {}
+
+        def save(img, fp, format=None, **options):
+            saved.clear()
+            saved.update(options)
+
+        monkeypatch.setattr(Image.Image, "save", save)
+        return saved
+
+    def test_default(self, saved_options):
+        img = Image.new("RGB", (8, 8))
+        utils.save_image(img, io.BytesIO(), "JPEG")
+        assert saved_options == {"optimize": True}
+
+        utils.save_image(img, io.BytesIO(), "PNG")
+        assert saved_options == {"optimize": True}
+
+        utils.save_image(img, io.BytesIO(), "WEBP")
+        assert saved_options == {}
+
+    def test_default_output(self):
+        # The default profile reproduces the output of the previous versions.
+        img = Image.open(helper.INPUT_PATH / "formats/png/RGB.png")
+        for format in ("PNG", "JPEG"):
+            expected = io.BytesIO()
+            img.save(expected, format, optimize=True)
+            buffer = io.BytesIO()
+            utils.save_image(img, buffer, format)
+            assert buffer.getvalue() == expected.getvalue()
+
+    @pytest.mark.parametrize("profile,format,expected", [
+        ("balanced", "PNG", {"optimize": False, "compress_level": 6}),
+        ("fast", "PNG", {"optimize": False, "compress_level": 1}),
+        ("fast", "WEBP", {"method": 0}),
+        ("smallest", "JPEG", {"optimize": True, "progressive": True}),
+        ("smallest", "WEBP", {"method": 6}),
+        ("smallest", "GIF", {}),
+    ])
+    def test_profile(self, saved_options, profile, format, expected):
+        utils.save_image(Image.new("RGB", (8, 8)), io.BytesIO(), format, profile=profile)
+        assert saved_options == expected
+
+    def test_explicit_options(self, saved_options):
+        img = Image.new("RGB", (8, 8))
+        utils.save_image(img, io.BytesIO(), "WEBP", profile="fast", method=3, quality=70)
+        assert saved_options == {"method": 3, "quality": 70}
+
+    def test_unknown_profile(self):
+        with pytest.raises(ValueError, match="Unknown encoding profile"):
+            utils.save_image(Image.new("RGB", (8, 8)), io.BytesIO(), "PNG", profile="best")
+
+    def test_file_size(self):
+        img = Image.open(helper.INPUT_PATH / "formats/png/RGB.png")
+        sizes = {}
+        for profile in ("fast", "smallest"):
+            buffer = io.BytesIO()
+            utils.save_image(img, buffer, "PNG", profile=profile)
+            sizes[profile] = buffer.tell()
+        assert sizes["smallest"] < sizes["fast"]
+
+
+class TestConvertForFormat:
+    def test_conversion(self):
+        img = Image.new("RGBA", (8, 8), color=(255, 0, 0, 128))
+        assert utils.convert_for_format(img, "png") is img
+        assert utils.convert_for_format(img, "jpeg").mode == "RGB"
+
+    def test_cache(self):
+        img = Image.new("RGBA", (8, 8), color=(255, 0, 0, 128))
+        cache = {}
+        jpeg = utils.convert_for_format(img, "JPEG", cache=cache)
+        assert utils.convert_for_format(img, "BMP", cache=cache) is jpeg
+
+    def test_deprecated_prepare_image(self):
+        img = Image.new("RGB", (8, 8))
+        with pytest.warns(DeprecationWarning):
+            assert utils.prepare_image(img) is img
+
+
+class TestWriteChunked:
+    class Stream(io.RawIOBase):
+        """Non-blocking raw stream: each write is answered from `results`."""
+        def __init__(self, *results):
+            self.results = list(results)
+            self.data = b""
+
+        def writable(self):
+            return True
+
+        def write(self, data):
+            result = self.results.pop(0)
+            if result is not None:
+                self.data += bytes(data[:result])
+            return result
+
+    def test_short_writes(self):
+        stream = self.Stream(3, 1, 4, 2)
+        assert utils.write_chunked(b"0123456789", stream, chunk_size=4) == 10
+        assert stream.data == b"0123456789"
+
+    def test_would_block(self):
+        stream = self.Stream(3, None)
+        with pytest.raises(BlockingIOError) as exc_info:
+            utils.write_chunked(b"0123456789", stream, chunk_size=4)
+        assert exc_info.value.characters_written == 3
+        assert stream.data == b"012"
+
+    def test_writer_without_result(self):
+        class Response:
+            """Like Django's HttpResponse, write() returns nothing."""
+            def __init__(self):
+                self.data = b""
+
+            def write(self, data):
+                self.data += bytes(data)
+
+        response = Response()
+        assert utils.write_chunked(b"0123456789", response, chunk_size=4) == 10
+        assert response.data == b"0123456789"
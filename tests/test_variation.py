@@ -1,4 +1,8 @@
 import io
+import json
+import pickle
+import threading
+
 import pytest
 from PIL import Image
 from pilkit import processors
@@ -325,6 +329,60 @@ class TestFaceDetection:
             Variation(size=(640, 480), mode=Variation.Mode.FILL, face_detection=True)
 
 
+class TestDetector:
+    def test_default_value(self):
+        v = Variation(size=(640, 480), gravity=Variation.Gravity.AUTO)
+        assert v.detector is None
+        assert v.get_pipeline()[0].detector is None
+
+    def test_pipeline(self):
+        pytest.importorskip("numpy")
+        from variations.processors.face_detection import CropFace, SaliencyDetector
+
+        detector = SaliencyDetector()
+        v = Variation(size=(64, 64), gravity=Variation.Gravity.AUTO, detector=detector)
+        assert v.get_pipeline()[0].detector is detector
+
+        v = Variation(
+            size=(64, 64),
+            mode=Variation.Mode.CROP,
+            gravity=Variation.Gravity.AUTO,
+            detector=detector
+        )
+        img = Image.new("RGB", (400, 300), color="white")
+        img.paste(Image.new("RGB", (20, 20), color="black"), (350, 250))
+        expected = CropFace(64, 64, detector=detector).process(img)
+        assert v.get_pipeline()[0].detector is detector
+        assert v.get_pipeline()[0].process(img).tobytes() == expected.tobytes()
+
+    def test_invalid_value(self):
+        with pytest.raises(TypeError, match="'detect\\(\\)' method"):
+            Variation(size=(640, 480), gravity=Variation.Gravity.AUTO, detector="faces")
+
+    def test_without_auto_gravity(self, caplog):
+        pytest.importorskip("numpy")
+        from variations.processors.face_detection import SaliencyDetector
+
+        Variation(size=(640, 480), detector=SaliencyDetector())
+        assert "'detector' makes sense only" in caplog.text
+
+    def test_serialization(self):
+        pytest.importorskip("numpy")
+        from variations.processors.face_detection import SaliencyDetector
+
+        v = Variation(
+            size=(640, 480),
+            gravity=Variation.Gravity.AUTO,
+            detector=SaliencyDetector(coverage=0.8)
+        )
+        data = json.loads(json.dumps(v.to_dict()))
+        restored = Variation.from_dict(data)
+        assert isinstance(restored.detector, SaliencyDetector)
+        assert restored.detector.coverage == 0.8
+        assert restored.fingerprint() == v.fingerprint()
+        assert v.fingerprint() != Variation(size=(640, 480), gravity=Variation.Gravity.AUTO).fingerprint()
+
+
 class TestFormat:
     def test_default_value(self):
         v = Variation(size=(640, 480))
@@ -441,7 +499,401 @@ class TestCopy:
         assert len(v1.jpeg) == 3
 
 
+class TestPickle:
+    def test_pickle(self):
+        v1 = Variation(
+            size=(640, 480),
+            format="jpg",
+            jpeg=dict(quality=80)
+        )
+        v2 = pickle.loads(pickle.dumps(v1))
+        assert v2.size == (640, 480)
+        assert v2.format == "JPEG"
+        assert v2.jpeg == {"quality": 80}
+
+
+class TestSerialization:
+    @pytest.mark.parametrize("variation", [
+        Variation(size=(640, 480)),
+        Variation(
+            size=(640, 0),
+            mode=Variation.Mode.FIT,
+            gravity=Variation.Gravity.TOP_LEFT,
+            background="#FF000080",
+            format="png",
+            preprocessors=[processors.GaussianBlur(4)],
+            postprocessors=[processors.ColorOverlay("#00FF00")],
+            png=dict(optimize=True),
+        ),
+        Variation(size=(640, 480), gravity=Variation.Gravity.AUTO),
+        Variation(size=(640, 480), mode=Variation.Mode.CROP, gravity=(0.2, 0.8)),
+    ])
+    def test_round_trip(self, variation):
+        data = json.loads(json.dumps(variation.to_dict()))
+        restored = Variation.from_dict(data)
+        assert restored.to_dict() == variation.to_dict()
+        assert restored.fingerprint() == variation.fingerprint()
+        assert pickle.loads(pickle.dumps(variation.to_dict())) == variation.to_dict()
+
+    def test_legacy(self):
+        with pytest.warns(DeprecationWarning):
+            variation = Variation(size=(640, 0), clip=False, max_height=480, anchor="tl")
+
+        restored = Variation.from_dict(variation.to_dict())
+        assert restored.legacy_mode
+        assert restored.to_dict() == variation.to_dict()
+        assert restored.fingerprint() == variation.fingerprint()
+
+    def test_to_dict(self):
+        variation = Variation(size=(640, 480), postprocessors=[processors.Grayscale()])
+        assert variation.to_dict() == {
+            "size": (640, 480),
+            "mode": "fill",
+            "gravity": (0.5, 0.5),
+            "upscale": False,
+            "background": None,
+            "format": None,
+            "options": {},
+            "preprocessors": [],
+            "postprocessors": [
+                {"class": "variations.processors.filters.Grayscale", "params": {}},
+            ],
+        }
+
+    def test_fingerprint_processor_params(self):
+        v1 = Variation(size=(640, 480), postprocessors=[processors.GaussianBlur(2)])
+        v2 = Variation(size=(640, 480), postprocessors=[processors.GaussianBlur(3)])
+        assert v1.fingerprint() != v2.fingerprint()
+
+
+class TestPipeline:
+    def test_cached(self):
+        v = Variation(size=(640, 480))
+        pipeline1 = v.get_pipeline()
+        pipeline2 = v.get_pipeline()
+        assert pipeline1 is not pipeline2
+        assert all(a is b for a, b in zip(pipeline1, pipeline2))
+
+    @pytest.mark.parametrize("name,value", [
+        ("size", (320, 240)),
+        ("mode", Variation.Mode.FIT),
+        ("gravity", Variation.Gravity.TOP),
+        ("background", "#FF0000"),
+        ("upscale", True),
+        ("preprocessors", [processors.Grayscale()]),
+        ("postprocessors", [processors.Grayscale()]),
+    ])
+    def test_invalidation(self, name, value):
+        v = Variation(size=(640, 480))
+        pipeline = v.get_pipeline()
+        setattr(v, name, value)
+        assert v.get_pipeline()[0] is not pipeline[0]
+
+    def test_modify_result(self):
+        v = Variation(size=(640, 480))
+        v.get_pipeline().append(processors.Grayscale())
+        assert len(v.get_pipeline()) == 1
+
+    def test_legacy_cache(self):
+        v = Variation(size=(640, 480), clip=False)
+        img = Image.new("RGB", (1024, 768), color="red")
+        assert v.process(img).size == (640, 480)
+        assert list(v._legacy_pipelines) == [(1024, 768)]
+
+        v.clip = True
+        assert v._legacy_pipelines == {}
+        assert v.process(img).size == (640, 480)
+
+
+class TestDraftSize:
+    @pytest.mark.parametrize("size,mode,source_size,expected", [
+        ((400, 300), Variation.Mode.FILL, (4000, 2000), (1200, 600)),
+        ((400, 0), Variation.Mode.FILL, (4000, 2000), (800, 400)),
+        ((0, 300), Variation.Mode.FILL, (4000, 2000), (1200, 600)),
+        ((400, 300), Variation.Mode.FIT, (4000, 2000), (800, 400)),
+        ((0, 300), Variation.Mode.FIT, (4000, 2000), (1200, 600)),
+        ((333, 0), Variation.Mode.FIT, (1000, 1001), (666, 667)),
+        ((400, 300), Variation.Mode.FIT, (400, 200), None),
+        ((400, 300), Variation.Mode.FIT, (600, 300), None),
+        ((400, 300), Variation.Mode.CROP, (4000, 2000), None),
+        ((400, 300), Variation.Mode.NONE, (4000, 2000), None),
+        ((0, 0), Variation.Mode.FILL, (4000, 2000), None),
+    ])
+    def test_modes(self, size, mode, source_size, expected):
+        v = Variation(size=size, mode=mode)
+        assert v.get_draft_size(source_size) == expected
+
+    def test_orientation(self):
+        v = Variation(size=(400, 0), mode=Variation.Mode.FIT)
+        assert v.get_draft_size((2000, 4000)) == (800, 1600)
+        assert v.get_draft_size((2000, 4000), orientation=3) == (800, 1600)
+        assert v.get_draft_size((2000, 4000), orientation=6) == (400, 800)
+
+    def test_legacy(self):
+        v = Variation(size=(400, 300), clip=False)
+        assert v.get_draft_size((4000, 2000)) is None
+
+    def test_process(self):
+        img = Image.new("RGB", (1600, 1200), color="red")
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG")
+
+        v = Variation(size=(200, 0), mode=Variation.Mode.FIT)
+        buffer.seek(0)
+        img = Image.open(buffer)
+        new_img = v.process(img)
+        assert img.size == (400, 300)
+        assert new_img.size == (200, 150)
+
+
+class TestPlan:
+    def test_fill(self):
+        plan = Variation(size=(400, 300)).plan((1000, 500))
+        assert plan.resize_size == (600, 300)
+        assert plan.canvas_size == (400, 300)
+        assert plan.offset == (-100, 0)
+        assert plan.crop_box == (100, 0, 500, 300)
+        assert plan.padding == (0, 0, 0, 0)
+        assert plan.resized is True
+
+    def test_fit_background(self):
+        plan = Variation(
+            size=(400, 300),
+            mode=Variation.Mode.FIT,
+            gravity=Variation.Gravity.TOP_LEFT,
+            background="#FFFFFF"
+        ).plan((1000, 500))
+        assert plan.resize_size == (400, 200)
+        assert plan.canvas_size == (400, 300)
+        assert plan.offset == (0, 0)
+        assert plan.padding == (0, 0, 0, 100)
+
+    def test_crop(self):
+        plan = Variation(size=(400, 0), mode=Variation.Mode.CROP).plan((1000, 500))
+        assert plan.resized is False
+        assert plan.canvas_size == (400, 500)
+        assert plan.crop_box == (300, 0, 700, 500)
+
+    def test_auto_gravity(self):
+        plan = Variation(size=(400, 300), gravity=Variation.Gravity.AUTO).plan((1000, 500))
+        assert plan.canvas_size == (400, 300)
+        assert plan.offset is None
+        assert plan.crop_box is None
+
+    def test_identity(self):
+        assert Variation(size=(400, 300)).plan((200, 100)).is_identity
+        assert Variation(size=(0, 0), mode=Variation.Mode.NONE).plan((200, 100)).is_identity
+        assert not Variation(size=(400, 300)).plan((400, 400)).is_identity
+
+    def test_orientation(self):
+        v = Variation(size=(400, 0), mode=Variation.Mode.FIT)
+        assert v.plan((2000, 4000)).canvas_size == (400, 800)
+        assert v.plan((2000, 4000), orientation=6).canvas_size == (400, 200)
+
+    def test_legacy(self):
+        with pytest.raises(ValueError, match="Cannot plan a legacy variation"):
+            Variation(size=(400, 300), clip=False).plan((1000, 500))
+
+    @pytest.mark.parametrize("source_size", ((640, 480), (480, 640), (301, 97), (150, 150)))
+    @pytest.mark.parametrize("size", ((200, 0), (0, 200), (200, 300), (500, 100)))
+    @pytest.mark.parametrize("mode", (Variation.Mode.FILL, Variation.Mode.FIT, Variation.Mode.CROP))
+    @pytest.mark.parametrize("gravity", (Variation.Gravity.CENTER, (0.3, 0.8)))
+    def test_same_as_pipeline(self, source_size, size, mode, gravity):
+        img = Image.new("RGB", source_size, color="red")
+        options = {} if mode is Variation.Mode.CROP else dict(upscale=True)
+        variations = [Variation(size=size, mode=mode, gravity=gravity, **options)]
+        if mode is Variation.Mode.FIT:
+            variations.append(Variation(size=size, mode=mode, gravity=gravity, background="#FFF"))
+
+        for v in variations:
+            plan = v.plan(source_size)
+            assert v.get_pipeline().process(img).size == plan.canvas_size
+
+
+class TestPlanMany:
+    @pytest.mark.parametrize("size", ((200, 0), (0, 200), (400, 300), (7, 3)))
+    @pytest.mark.parametrize("options", (
+        dict(mode=Variation.Mode.FILL),
+        dict(mode=Variation.Mode.FILL, upscale=True, gravity=(0.3, 0.8)),
+        dict(mode=Variation.Mode.FILL, gravity=Variation.Gravity.AUTO),
+        dict(mode=Variation.Mode.FIT),
+        dict(mode=Variation.Mode.FIT, upscale=True, background="#FFF"),
+        dict(mode=Variation.Mode.FIT, background="#FFF", gravity=Variation.Gravity.BOTTOM),
+        dict(mode=Variation.Mode.CROP, gravity=Variation.Gravity.RIGHT),
+        dict(mode=Variation.Mode.NONE),
+    ))
+    def test_same_as_plan(self, size, options):
+        numpy = pytest.importorskip("numpy")
+        rng = numpy.random.default_rng(0)
+        widths = numpy.concatenate([rng.integers(1, 5000, 500), [400, 800, 301, 1]])
+        heights = numpy.concatenate([rng.integers(1, 5000, 500), [300, 600, 97, 1]])
+        orientations = rng.integers(1, 9, len(widths))
+
+        v = Variation(size=size, **options)
+        plans = v.plan_many(widths, heights, orientations)
+        assert len(plans) == len(widths)
+
+        for index in range(len(widths)):
+            expected = v.plan((int(widths[index]), int(heights[index])), int(orientations[index]))
+            assert plans.item(index) == expected
+
+            if expected.offset is not None:
+                assert tuple(plans.crop_box[index].tolist()) == expected.crop_box
+                assert tuple(plans.padding[index].tolist()) == expected.padding
+
+    def test_legacy(self):
+        with pytest.raises(ValueError, match="Cannot plan a legacy variation"):
+            Variation(size=(400, 300), clip=False).plan_many([1000], [500])
+
+
+class TestEncode:
+    img = Image.new("RGB", (64, 48), color="red")
+
+    def test_encode(self):
+        v = Variation(size=(100, 200))
+        view = v.encode(self.img, "png")
+        assert isinstance(view, memoryview)
+
+        buffer = io.BytesIO()
+        v.save(self.img, buffer, "png")
+        assert view.tobytes() == buffer.getvalue()
+
+    def test_default_format(self):
+        view = Variation(size=(100, 200), format="jpeg").encode(self.img)
+        assert Image.open(io.BytesIO(view)).format == "JPEG"
+
+        view = Variation(size=(100, 200)).encode(self.img)
+        assert Image.open(io.BytesIO(view)).format == "WEBP"
+
+    def test_reuse_buffer(self):
+        v = Variation(size=(100, 200))
+        buffer = io.BytesIO()
+
+        view = v.encode(self.img, "jpeg", buffer=buffer)
+        jpeg_size = len(view)
+        view.release()
+
+        with v.encode(self.img, "png", buffer=buffer) as view:
+            assert len(view) == len(v.encode(self.img, "png"))
+            assert len(view) != jpeg_size
+            assert view[:4] == b"\x89PNG"
+
+    def test_unreleased_buffer(self):
+        v = Variation(size=(100, 200))
+        buffer = io.BytesIO()
+        jpeg = v.encode(self.img, "jpeg", buffer=buffer)
+        jpeg_data = jpeg.tobytes()
+
+        # The previous view is kept, so the data is encoded into a new buffer.
+        png = v.encode(self.img, "png", buffer=buffer)
+        assert png[:4] == b"\x89PNG"
+        assert jpeg.tobytes() == jpeg_data
+        assert buffer.getbuffer().tobytes() == jpeg_data
+
+    def test_encode_to(self):
+        class Stream:
+            """Non-seekable stream accepting at most 10 bytes at a time."""
+            def __init__(self):
+                self.chunks = []
+
+            def write(self, data):
+                self.chunks.append(bytes(data[:10]))
+                return len(self.chunks[-1])
+
+        v = Variation(size=(100, 200))
+        stream = Stream()
+        written = v.encode_to(self.img, stream, "png", chunk_size=16)
+        data = b"".join(stream.chunks)
+        assert written == len(data)
+        assert data == v.encode(self.img, "png").tobytes()
+
+
+class TestSaveMany:
+    img = Image.new("RGBA", (64, 48), color=(255, 0, 0, 128))
+
+    def test_save_many(self, tmp_path):
+        v = Variation(size=(100, 200), jpeg=dict(quality=70))
+        buffer = io.BytesIO()
+        formats = v.save_many(self.img, [
+            tmp_path / "image.jpg",
+            tmp_path / "image.png",
+            (buffer, "webp"),
+        ])
+        assert formats == ["JPEG", "PNG", "WEBP"]
+
+        for path, format in ((tmp_path / "image.jpg", "jpeg"), (tmp_path / "image.png", "png")):
+            expected = io.BytesIO()
+            v.save(self.img, expected, format)
+            assert path.read_bytes() == expected.getvalue()
+
+        expected = io.BytesIO()
+        v.save(self.img, expected, "webp")
+        assert buffer.getvalue() == expected.getvalue()
+
+    def test_shared_conversion(self, monkeypatch):
+        calls = []
+        process = processors.MakeOpaque.process
+
+        def make_opaque(self, img):
+            calls.append(img.mode)
+            return process(self, img)
+
+        monkeypatch.setattr(processors.MakeOpaque, "process", make_opaque)
+        Variation(size=(100, 200)).save_many(self.img, [
+            (io.BytesIO(), "jpeg"),
+            (io.BytesIO(), "bmp"),
+            (io.BytesIO(), "png"),
+        ])
+        assert calls == ["RGBA"]
+
+    def test_parallel(self, monkeypatch):
+        barrier = threading.Barrier(3, timeout=5)
+        save = Image.Image.save
+
+        def wait_and_save(img, *args, **kwargs):
+            # Fails if the files are not saved at the same time.
+            barrier.wait()
+            return save(img, *args, **kwargs)
+
+        monkeypatch.setattr(Image.Image, "save", wait_and_save)
+        Variation(size=(100, 200)).save_many(self.img, [
+            (io.BytesIO(), "jpeg"),
+            (io.BytesIO(), "png"),
+            (io.BytesIO(), "webp"),
+        ])
+
+    def test_error(self):
+        with pytest.raises(KeyError):
+            Variation(size=(100, 200)).save_many(self.img, [
+                (io.BytesIO(), "png"),
+                (io.BytesIO(), "unknown"),
+            ])
+
+
 class TestSave:
+    def test_profile(self, monkeypatch):
+        saved = []
+        monkeypatch.setattr(
+            Image.Image,
+            "save",
+            lambda img, fp, format=None, **options: saved.append((format, options))
+        )
+
+        img = Image.new("RGB", (640, 480), color="red")
+        v = Variation(size=(100, 200), profile="fast", png=dict(profile="smallest"))
+        v.save(img, io.BytesIO(), "webp")
+        v.save(img, io.BytesIO(), "png")
+        v.save(img, io.BytesIO(), "webp", method=5)
+        assert saved == [
+            ("WEBP", {"method": 0}),
+            ("PNG", {"optimize": True, "compress_level": 9}),
+            ("WEBP", {"method": 5}),
+        ]
+
+    def test_invalid_profile(self):
+        with pytest.raises(ValueError, match="Invalid encoding profile"):
+            Variation(size=(100, 200), profile="best")
+
     def test_save_string(self):
         v = Variation(size=(100, 200))
         img = Image.new("RGB", (640, 480), color="red")
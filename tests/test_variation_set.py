@@ -0,0 +1,171 @@
+import pytest
+from PIL import ImageChops, ImageStat
+from pilkit.lib import Image
+
+from variations import Variation, VariationSet, utils
+
+from . import helper
+
+
+class TestInit:
+    def test_mapping(self):
+        vs = VariationSet({
+            "small": Variation(size=(100, 100)),
+            "large": Variation(size=(400, 400)),
+        })
+        assert list(vs) == ["small", "large"]
+        assert vs["small"].size == (100, 100)
+        assert len(vs) == 2
+
+    def test_iterable(self):
+        vs = VariationSet([
+            Variation(size=(100, 100)),
+            Variation(size=(400, 400)),
+        ])
+        assert list(vs) == [0, 1]
+        assert vs[1].size == (400, 400)
+
+    def test_invalid_item(self):
+        with pytest.raises(TypeError, match="must be an instance of 'Variation'"):
+            VariationSet({"small": (100, 100)})
+
+
+class TestDraftSize:
+    def test_largest_size(self):
+        vs = VariationSet([
+            Variation(size=(100, 800)),
+            Variation(size=(400, 400)),
+        ])
+        assert vs.get_draft_size((3200, 3200)) == (1600, 1600)
+        assert vs.get_draft_size((6400, 3200)) == (3200, 1600)
+        assert vs.get_draft_size((6400, 3200), orientation=6) == (1600, 800)
+
+    def test_full_resolution(self):
+        vs = VariationSet([
+            Variation(size=(100, 800)),
+            Variation(size=(0, 0), mode=Variation.Mode.NONE),
+        ])
+        assert vs.get_draft_size((1600, 1600)) is None
+
+    def test_legacy(self):
+        vs = VariationSet([
+            Variation(size=(100, 800)),
+            Variation(size=(400, 400), clip=False),
+        ])
+        assert vs.get_draft_size((1600, 1600)) is None
+
+
+def get_decoded_size(file, draft_size):
+    with Image.open(file) as img:
+        if draft_size is not None:
+            img.draft(img.mode, draft_size)
+        return img.size
+
+
+@pytest.mark.iterdir("file", ["tests/input/exif", "tests/input/formats/png"])
+class TestProcess:
+    def test_same_as_variation(self, file):
+        variations = {
+            "fill": Variation(size=(300, 300)),
+            "fit": Variation(size=(150, 0), mode=Variation.Mode.FIT),
+            "crop": Variation(size=(100, 400), mode=Variation.Mode.CROP),
+            "none": Variation(size=(0, 0), mode=Variation.Mode.NONE),
+        }
+
+        variation_set = VariationSet(variations)
+        results = variation_set.process(Image.open(file))
+        assert list(results) == list(variations)
+
+        with Image.open(file) as img:
+            orientation = utils.get_exif_orientation(img)
+            shared_size = get_decoded_size(file, variation_set.get_draft_size(img.size, orientation))
+
+        for name, variation in variations.items():
+            expected = variation.process(Image.open(file))
+            assert results[name].size == expected.size
+            diff = ImageChops.difference(
+                results[name].convert("RGBA"),
+                expected.convert("RGBA")
+            )
+
+            with Image.open(file) as img:
+                own_size = get_decoded_size(file, variation.get_draft_size(img.size, orientation))
+            if own_size == shared_size:
+                assert diff.getbbox(alpha_only=False) is None
+            else:
+                # Resampled from a larger draft of the source.
+                assert max(ImageStat.Stat(diff).mean) < 2
+                assert max(high for low, high in diff.getextrema()) <= 32
+
+
+def test_legacy_variation():
+    file = helper.INPUT_PATH / "exif/portrait_6.jpg"
+    variations = {
+        "modern": Variation(size=(200, 200)),
+        "legacy": Variation(size=(200, 200), clip=False),
+    }
+
+    results = VariationSet(variations).process(Image.open(file))
+    for name, variation in variations.items():
+        expected = variation.process(Image.open(file))
+        assert results[name].size == expected.size
+
+
+class TestCascade:
+    variations = {
+        "w2048": Variation(size=(2048, 0)),
+        "w1024": Variation(size=(1024, 0)),
+        "w512": Variation(size=(512, 0), mode=Variation.Mode.FIT),
+        "sq256": Variation(size=(256, 256), gravity=Variation.Gravity.TOP),
+        "crop": Variation(size=(256, 256), mode=Variation.Mode.CROP),
+    }
+
+    def test_invalid_ratio(self):
+        with pytest.raises(ValueError, match="'cascade_ratio' must be"):
+            VariationSet(self.variations, cascade=True, cascade_ratio=0.5)
+
+    def test_disabled(self):
+        vs = VariationSet(self.variations)
+        assert vs.get_cascade_plan((4000, 3000)) == [
+            ("w2048", None),
+            ("w1024", None),
+            ("w512", None),
+            ("sq256", None),
+        ]
+
+    def test_plan(self):
+        vs = VariationSet(self.variations, cascade=True)
+        assert vs.get_cascade_plan((4000, 3000)) == [
+            ("w2048", None),
+            ("w1024", "w2048"),
+            ("w512", "w1024"),
+            ("sq256", "w1024"),
+        ]
+
+    def test_ratio(self):
+        vs = VariationSet(self.variations, cascade=True, cascade_ratio=3)
+        assert vs.get_cascade_plan((4000, 3000)) == [
+            ("w2048", None),
+            ("w1024", None),
+            ("w512", "w2048"),
+            ("sq256", "w1024"),
+        ]
+
+    def test_upscale(self):
+        vs = VariationSet(self.variations, cascade=True)
+        assert vs.get_cascade_plan((800, 600)) == [
+            ("w512", None),
+            ("sq256", None),
+        ]
+
+    def test_process(self):
+        img = Image.open(helper.INPUT_PATH / "faces/RGB1.jpg")
+        img.load()
+
+        results = VariationSet(self.variations, cascade=True).process(img.copy())
+        assert list(results) == list(self.variations)
+
+        for name, variation in self.variations.items():
+            expected = variation.process(img.copy())
+            assert results[name].size == expected.size
+            assert results[name].mode == expected.mode
@@ -1,6 +1,16 @@
 __version__ = "0.4.0"
 
 from . import processors
+from .executor import ThreadedExecutor
+from .plan import VariationPlan, VariationPlanArray
 from .variation import Variation
+from .variation_set import VariationSet
 
-__all__ = ["Variation", "processors"]
+__all__ = [
+    "ThreadedExecutor",
+    "Variation",
+    "VariationPlan",
+    "VariationPlanArray",
+    "VariationSet",
+    "processors",
+]
@@ -0,0 +1,515 @@
+"""
+Memory-budgeted admission of jobs before decoding.
+
+Nothing in ``Image.open()`` decodes the pixels, so the header of a source
+(size, mode, bands, number of frames, Exif orientation) is available for free.
+`preflight()` reads it and estimates the peak memory of the job for every
+way of decoding the source:
+
+- ``standard``: ``process()`` with the usual draft (see ``Variation.get_draft_size()``)
+- ``strips``: ``process_in_strips()`` (see ``variations.strips``)
+- ``draft``: a stronger draft, down to the resampled size instead of twice it.
+  Only formats that support ``Image.draft()`` (JPEG) can be decoded this way.
+
+`MemoryBudget` admits jobs while their estimates fit into the limit.
+When a job doesn't fit, the policy decides what happens:
+
+- ``REDUCE``: a cheaper decode is picked (strips first, since they don't change
+  the result, then the stronger draft), or the job waits
+- ``WAIT``: the job waits until other jobs release enough memory
+- ``REJECT``: the job is rejected with `MemoryBudgetExceeded`
+
+A job whose estimate exceeds the whole limit is always rejected. A job is always
+admitted when no other job holds the budget, so a busy budget never deadlocks.
+
+The estimate counts the pixel data held by Pillow: the decoded source, the copy
+made by the Exif orientation, the working copies of the processors (palette
+conversion, alpha premultiplication) and the processed images. It doesn't count
+encoder buffers or the memory of custom processors.
+
+Example:
+```python
+from variations.admission import MemoryBudget
+
+budget = MemoryBudget(2 * 1024 ** 3, policy=MemoryBudget.Policy.REDUCE)
+with budget.admit("scan.tif", variations) as admission:
+    with Image.open("scan.tif") as img:
+        images = admission.process(img, variations, source="scan.tif")
+```
+"""
+
+import enum
+import math
+import os
+import threading
+import time
+from collections.abc import Hashable, Iterable, Iterator
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional, Union
+
+from pilkit.lib import Image
+
+from . import strips, utils
+from .typing import FilePointer, Size
+from .variation import Variation
+from .variation_set import VariationSet
+
+__all__ = [
+    "SourceHeader",
+    "Admission",
+    "MemoryBudgetExceeded",
+    "MemoryBudget",
+    "read_header",
+    "estimate_peak_bytes",
+    "preflight",
+]
+
+# Bytes per pixel of Pillow's storage. Images with 2-4 bands are stored
+# with 4 bytes per pixel.
+MODE_BYTES = {
+    "1": 1, "L": 1, "P": 1,
+    "I;16": 2, "I;16L": 2, "I;16B": 2, "I;16N": 2,
+}
+DEFAULT_MODE_BYTES = 4
+
+# Orientations that create a copy of the decoded source.
+TRANSFORMING_ORIENTATIONS = {2, 3, 4, 5, 6, 7, 8}
+
+
+class MemoryBudgetExceeded(Exception):
+    """
+    The job doesn't fit into the memory budget.
+    """
+
+
+class SourceHeader(NamedTuple):
+    format: Optional[str]
+    size: Size                      # size of the stored (not rotated) image
+    mode: str
+    bands: int
+    frames: int
+    orientation: Optional[int]
+    transparency: bool              # palette images with a transparent color
+
+
+class Admission(NamedTuple):
+    """
+    How a job is decoded and how much memory it is expected to need.
+    """
+
+    header: SourceHeader
+    decode: str                     # "standard", "strips" or "draft"
+    decoded_size: Size              # size of the decoded source
+    draft_size: Optional[Size]      # size passed to Image.draft() by the "draft" decode
+    peak_bytes: int
+    strip_height: Optional[int] = None
+
+    def process(
+        self,
+        img: Image,
+        variations: VariationSet,
+        keys: Iterable[Hashable] = None,
+        source: FilePointer = None
+    ) -> Dict[Hashable, Image]:
+        """
+        Same as ``variations.process(img, keys)``, but the source is decoded
+        the admitted way. The ``strips`` decode reads the source once per
+        variation, so it requires the `source` the image was opened from.
+        """
+        if self.decode == "draft":
+            # The following draft of the variations is ignored by Pillow.
+            img.draft(img.mode, self.draft_size)
+        elif self.decode == "strips" and source is not None:
+            keys = list(variations.keys() if keys is None else keys)
+            return {
+                key: _process_in_strips(source, variations[key], self.strip_height)
+                for key in keys
+            }
+        return variations.process(img, keys)
+
+
+def _rewind(source: FilePointer):
+    if not isinstance(source, (str, os.PathLike)):
+        source.seek(0)
+
+
+def _process_in_strips(
+    source: FilePointer,
+    variation: Variation,
+    strip_height: Optional[int]
+) -> Image:
+    # Every variation needs a source that isn't loaded yet.
+    _rewind(source)
+    with Image.open(source) as img:
+        new_img = variation.process_in_strips(img, strip_height)
+        new_img.load()
+    _rewind(source)
+    return new_img
+
+
+def _get_header(img: Image) -> SourceHeader:
+    return SourceHeader(
+        format=img.format,
+        size=img.size,
+        mode=img.mode,
+        bands=len(img.getbands()),
+        frames=getattr(img, "n_frames", 1),
+        orientation=utils.get_exif_orientation(img),
+        transparency=img.mode == "P" and "transparency" in img.info,
+    )
+
+
+def read_header(source: FilePointer) -> SourceHeader:
+    """
+    Reads the header of the source without decoding the pixels.
+    """
+    _rewind(source)
+    try:
+        with Image.open(source) as img:
+            return _get_header(img)
+    finally:
+        _rewind(source)
+
+
+def _get_image_bytes(size: Size, mode: str) -> int:
+    return size[0] * size[1] * MODE_BYTES.get(mode, DEFAULT_MODE_BYTES)
+
+
+def _get_oriented_size(size: Size, orientation: Optional[int]) -> Size:
+    if orientation in {5, 6, 7, 8}:
+        return size[1], size[0]
+    return size
+
+
+def _get_working_bytes(header: SourceHeader, size: Size) -> int:
+    """
+    Full-size copies made by the processors before resampling.
+    """
+    copies = 0
+    if header.mode == "P":
+        # resolve_palette()
+        copies += 1
+    if header.transparency or header.mode in {"RGBA", "LA", "PA"}:
+        # Image.resize() premultiplies the alpha channel.
+        copies += 1
+    return copies * size[0] * size[1] * DEFAULT_MODE_BYTES
+
+
+def _get_variation_bytes(variation: Variation, header: SourceHeader, size: Size):
+    """
+    Returns the working and the output bytes of a variation
+    for a decoded (and oriented) source of the given size.
+    """
+    if variation.legacy_mode:
+        # Legacy variations can't be planned without processing.
+        working = _get_working_bytes(header, size)
+        return working, size[0] * size[1] * DEFAULT_MODE_BYTES
+
+    plan = variation.plan(size)
+    working = _get_working_bytes(header, size) if plan.resized else 0
+    if variation.preprocessors:
+        working += size[0] * size[1] * DEFAULT_MODE_BYTES
+    canvas_width, canvas_height = plan.canvas_size
+    return working, canvas_width * canvas_height * DEFAULT_MODE_BYTES
+
+
+def _get_keys(variations: VariationSet, keys: Optional[Iterable[Hashable]]) -> List[Hashable]:
+    return list(variations.keys() if keys is None else keys)
+
+
+def estimate_peak_bytes(
+    header: SourceHeader,
+    variations: VariationSet,
+    keys: Iterable[Hashable] = None,
+    decoded_size: Optional[Size] = None
+) -> int:
+    """
+    Estimates the peak memory of ``variations.process()`` for the source.
+
+    :param header: The header of the source (see `read_header()`).
+    :param decoded_size: The size of the source after ``Image.draft()``.
+                         Defaults to the size of the source.
+    """
+    decoded_size = decoded_size or header.size
+    decoded = _get_image_bytes(decoded_size, header.mode)
+    if header.orientation in TRANSFORMING_ORIENTATIONS:
+        decoded *= 2
+
+    size = _get_oriented_size(decoded_size, header.orientation)
+    working = outputs = largest = 0
+    for key in _get_keys(variations, keys):
+        variation_working, output = _get_variation_bytes(variations[key], header, size)
+        working = max(working, variation_working)
+        outputs += output
+        largest = max(largest, output)
+
+    # Processed images are held until they are saved. The last one
+    # may be built from an intermediate of the same size.
+    return decoded + working + outputs + largest
+
+
+def _estimate_strips_peak_bytes(
+    header: SourceHeader,
+    variations: VariationSet,
+    keys: List[Hashable],
+    decoded_size: Size,
+    streaming: bool,
+    strip_height: int
+) -> int:
+    if streaming:
+        # Up to two bands of rows, and their converted copies.
+        rows = min(decoded_size[1], 2 * strip_height)
+        decoded = 2 * decoded_size[0] * rows * DEFAULT_MODE_BYTES
+    else:
+        decoded = _get_image_bytes(decoded_size, header.mode)
+
+    outputs = largest = 0
+    for key in keys:
+        _, output = _get_variation_bytes(variations[key], header, decoded_size)
+        outputs += output
+        largest = max(largest, output)
+    return decoded + outputs + largest
+
+
+def _open_drafted(source: FilePointer, draft_size: Optional[Size]) -> Image:
+    _rewind(source)
+    img = Image.open(source)
+    if draft_size is not None:
+        img.draft(img.mode, draft_size)
+    return img
+
+
+def preflight(
+    source: FilePointer,
+    variations: Union[VariationSet, Variation],
+    keys: Iterable[Hashable] = None,
+    strip_height: Optional[int] = None
+) -> List[Admission]:
+    """
+    Reads the header of the source and estimates the peak memory
+    of every applicable decode. The ``standard`` decode comes first,
+    then the decodes that are cheaper than it, in the order of preference.
+    """
+    if isinstance(variations, Variation):
+        variations = VariationSet([variations])
+    keys = _get_keys(variations, keys)
+    strip_height = strip_height or strips.DEFAULT_STRIP_HEIGHT
+
+    try:
+        with _open_drafted(source, None) as img:
+            header = _get_header(img)
+            draft_size = variations.get_draft_size(img.size, header.orientation, keys)
+            img.draft(img.mode, draft_size)
+            decoded_size = img.size
+
+            admissions = [Admission(
+                header,
+                "standard",
+                decoded_size,
+                None,
+                estimate_peak_bytes(header, variations, keys, decoded_size)
+            )]
+
+            plans_supported = all(
+                strips.is_supported(variations[key], img)
+                and not variations[key].plan(header.size).is_identity
+                for key in keys
+            )
+            if keys and plans_supported:
+                admissions.append(Admission(
+                    header,
+                    "strips",
+                    decoded_size,
+                    None,
+                    _estimate_strips_peak_bytes(
+                        header,
+                        variations,
+                        keys,
+                        decoded_size,
+                        strips.can_decode_in_strips(img),
+                        strip_height
+                    ),
+                    strip_height
+                ))
+
+        if draft_size is not None:
+            # Drafts to the resampled size instead of a multiple of it.
+            reduced_size = tuple(
+                max(1, math.ceil(value / Variation.DRAFT_REDUCING_GAP))
+                for value in draft_size
+            )
+            with _open_drafted(source, reduced_size) as img:
+                if img.size != decoded_size:
+                    admissions.append(Admission(
+                        header,
+                        "draft",
+                        img.size,
+                        reduced_size,
+                        estimate_peak_bytes(header, variations, keys, img.size)
+                    ))
+    finally:
+        _rewind(source)
+
+    standard = admissions[0]
+    return [standard] + [a for a in admissions[1:] if a.peak_bytes < standard.peak_bytes]
+
+
+class MemoryBudget:
+    """
+    Thread-safe budget of memory shared by concurrent jobs.
+
+    :param limit: The budget, in bytes.
+    :param policy: What to do with jobs that don't fit (see `MemoryBudget.Policy`).
+    :param timeout: The maximum time, in seconds, a job waits for the budget.
+                    ``None`` means waiting indefinitely.
+    :param strip_height: The strip height of the ``strips`` decode.
+    """
+
+    class Policy(enum.Enum):
+        REDUCE = "reduce"
+        WAIT = "wait"
+        REJECT = "reject"
+
+    def __init__(
+        self,
+        limit: int,
+        policy: Union[Policy, str] = Policy.REDUCE,
+        timeout: Optional[float] = None,
+        strip_height: Optional[int] = None
+    ):
+        if limit <= 0:
+            raise ValueError("'limit' must be a positive integer.")
+
+        self.limit = limit
+        self.policy = policy if isinstance(policy, self.Policy) else self.Policy(policy.lower())
+        self.timeout = timeout
+        self.strip_height = strip_height
+        self._used = 0
+        self._condition = threading.Condition()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_condition"]
+        state["_used"] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._condition = threading.Condition()
+
+    @property
+    def used(self) -> int:
+        return self._used
+
+    @property
+    def available(self) -> int:
+        return self.limit - self._used
+
+    def _fits(self, nbytes: int) -> bool:
+        # An idle budget admits any job, so that a job larger
+        # than the remainder can't wait forever.
+        return self._used == 0 or self._used + nbytes <= self.limit
+
+    def choose(self, admissions: List[Admission], queue: bool = False) -> Admission:
+        """
+        Picks the decode of a job according to the policy and the available
+        budget. Raises `MemoryBudgetExceeded` if the job is rejected.
+
+        :param queue: Don't reject jobs that only have to wait for the budget,
+                      even with the ``REJECT`` policy. Used by callers that
+                      throttle their own concurrency (e.g. the batch engine).
+        """
+        standard = admissions[0]
+        if self.policy is self.Policy.REDUCE:
+            candidates = admissions
+        else:
+            candidates = [standard]
+
+        fitting = [a for a in candidates if a.peak_bytes <= self.limit]
+        if not fitting:
+            raise MemoryBudgetExceeded(
+                "The job needs about {} bytes, the limit is {} bytes.".format(
+                    min(a.peak_bytes for a in candidates), self.limit
+                )
+            )
+
+        with self._condition:
+            for admission in fitting:
+                if self._fits(admission.peak_bytes):
+                    return admission
+
+        if self.policy is self.Policy.REJECT and not queue:
+            raise MemoryBudgetExceeded(
+                "The job needs about {} bytes, {} bytes are available.".format(
+                    standard.peak_bytes, self.available
+                )
+            )
+        return fitting[0]
+
+    def preflight(
+        self,
+        source: FilePointer,
+        variations: Union[VariationSet, Variation],
+        keys: Iterable[Hashable] = None,
+        queue: bool = False
+    ) -> Admission:
+        """
+        Reads the header of the source and picks its decode (see `choose()`).
+        The budget is not reserved.
+        """
+        return self.choose(preflight(source, variations, keys, self.strip_height), queue)
+
+    def try_reserve(self, nbytes: int) -> bool:
+        with self._condition:
+            if not self._fits(nbytes):
+                return False
+            self._used += nbytes
+            return True
+
+    def reserve(self, nbytes: int, timeout: Optional[float] = None):
+        """
+        Waits until `nbytes` fit into the budget and reserves them.
+        Raises `MemoryBudgetExceeded` on timeout.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while not self._fits(nbytes):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise MemoryBudgetExceeded(
+                        "Timed out waiting for {} bytes of the budget.".format(nbytes)
+                    )
+                self._condition.wait(remaining)
+            self._used += nbytes
+
+    def release(self, nbytes: int):
+        with self._condition:
+            self._used = max(0, self._used - nbytes)
+            self._condition.notify_all()
+
+    @contextmanager
+    def admit(
+        self,
+        source: FilePointer,
+        variations: Union[VariationSet, Variation],
+        keys: Iterable[Hashable] = None
+    ) -> Iterator[Admission]:
+        """
+        Admits the job within the context: picks its decode, waits for
+        the budget if the policy allows it, and releases the budget on exit.
+        """
+        admission = self.preflight(source, variations, keys)
+        if self.policy is self.Policy.REJECT:
+            if not self.try_reserve(admission.peak_bytes):
+                raise MemoryBudgetExceeded(
+                    "The job needs about {} bytes, {} bytes are available.".format(
+                        admission.peak_bytes, self.available
+                    )
+                )
+        else:
+            self.reserve(admission.peak_bytes)
+        try:
+            yield admission
+        finally:
+            self.release(admission.peak_bytes)
@@ -0,0 +1,75 @@
+"""
+Helpers for running blocking image operations from asyncio code.
+
+Blocking calls are offloaded to an executor, and the number of calls running
+at the same time is limited by a semaphore, so that many requests can be
+in flight without starving the event loop or oversubscribing CPU cores.
+
+Example:
+```python
+from concurrent.futures import ThreadPoolExecutor
+from variations import aio
+
+aio.configure(executor=ThreadPoolExecutor(4), max_concurrency=4)
+
+new_img = await variation.aprocess(img)
+await variation.asave(new_img, "dest.jpg")
+```
+"""
+
+import asyncio
+import functools
+import os
+import weakref
+from concurrent.futures import Executor
+from typing import Any, Callable, Optional
+
+__all__ = ["configure", "get_max_concurrency", "run"]
+
+_executor: Optional[Executor] = None
+_max_concurrency: Optional[int] = None
+
+# Semaphores are bound to an event loop, so a separate one is kept for each loop.
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def configure(executor: Executor = None, max_concurrency: int = None):
+    """
+    Sets the executor for blocking calls and the limit of concurrent calls.
+
+    :param executor: An executor to offload blocking calls to.
+        If not set, the default executor of the event loop is used.
+    :param max_concurrency: Maximum number of blocking calls running at the same time.
+        Defaults to the number of CPUs.
+    """
+    global _executor, _max_concurrency
+
+    if max_concurrency is not None and max_concurrency < 1:
+        raise ValueError("'max_concurrency' must be a positive integer.")
+
+    _executor = executor
+    _max_concurrency = max_concurrency
+    _semaphores.clear()
+
+
+def get_max_concurrency() -> int:
+    return _max_concurrency or os.cpu_count() or 1
+
+
+def _get_semaphore(loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(get_max_concurrency())
+    return semaphore
+
+
+async def run(func: Callable, *args, **kwargs) -> Any:
+    """
+    Runs a blocking function in the configured executor.
+    """
+    loop = asyncio.get_running_loop()
+    async with _get_semaphore(loop):
+        return await loop.run_in_executor(
+            _executor,
+            functools.partial(func, *args, **kwargs)
+        )
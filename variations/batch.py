@@ -0,0 +1,497 @@
+"""
+Batch processing of many source images on a pool of worker processes.
+
+Example:
+```python
+from variations import Variation
+from variations.batch import process_batch
+
+variations = {
+    "large": Variation(size=(1920, 1080)),
+    "small": Variation(size=(640, 480)),
+}
+
+for result in process_batch("photos/", variations, "thumbnails/", max_workers=4):
+    if result.error:
+        print(result.source, result.error)
+```
+"""
+
+import io
+import os
+import time
+import traceback
+from collections.abc import Hashable, Iterable, Iterator, Mapping
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from pilkit.lib import Image
+
+from . import passthrough, timing, utils
+from .admission import Admission, MemoryBudget, MemoryBudgetExceeded
+from .capture import SlowRenderCapture
+from .metrics import Collector
+from .typing import FilePath, FilePointer
+from .variation import Variation
+from .variation_set import VariationSet
+
+Destination = Union[FilePath, Callable[[Any, Hashable, Variation], FilePointer]]
+
+__all__ = ["BatchResult", "BatchProcessor", "process_source", "process_batch"]
+
+# Per-worker state, populated by the pool initializer.
+_worker_variations = None
+_worker_destination = None
+_worker_strip_metadata = False
+_worker_capture = None
+_worker_collect_timings = False
+
+
+class BatchResult:
+    """
+    Outcome of processing a single source image.
+
+    - `index`: Position of the source in the input iterable.
+    - `source`: The source path, or the name of the source file object.
+    - `outputs`: Dictionary mapping variation keys to destination paths.
+    - `error`: Formatted traceback if processing has failed, otherwise ``None``.
+    - `seconds`: Time spent on the source, including saving.
+    - `timings`: Stage timings of the worker (see ``variations.timing``),
+      when they are recorded by a collector of the parent process.
+    """
+
+    __slots__ = ("index", "source", "outputs", "error", "seconds", "timings")
+
+    def __init__(
+        self,
+        index: int,
+        source: Any,
+        outputs: Dict[Hashable, FilePointer] = None,
+        error: Optional[str] = None,
+        seconds: Optional[float] = None,
+        timings: List[timing.StageTiming] = None
+    ):
+        self.index = index
+        self.source = source
+        self.outputs = outputs or {}
+        self.error = error
+        self.seconds = seconds
+        self.timings = timings or []
+
+    def __repr__(self):
+        return "{}({}, {!r}, {})".format(
+            self.__class__.__name__,
+            self.index,
+            self.source,
+            "failed" if self.error else "ok"
+        )
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _get_source_name(source: Any) -> Any:
+    if isinstance(source, (str, os.PathLike)):
+        return source
+    return getattr(source, "name", None)
+
+
+def _get_destination(
+    destination: Destination,
+    index: int,
+    source: Any,
+    key: Hashable,
+    variation: Variation
+) -> FilePointer:
+    if callable(destination):
+        return destination(source, key, variation)
+
+    name = _get_source_name(source)
+    if name:
+        stem, extension = os.path.splitext(os.path.basename(name))
+    else:
+        stem, extension = str(index), ""
+
+    path = Path(destination) / "{}.{}{}".format(stem, key, extension)
+    if variation.format:
+        path = utils.replace_extension(path, variation.format)
+    return path
+
+
+def process_source(
+    source: FilePointer,
+    variations: VariationSet,
+    destination: Destination,
+    index: int = 0,
+    strip_metadata: bool = False,
+    capture: Optional[SlowRenderCapture] = None,
+    admission: Optional[Admission] = None
+) -> BatchResult:
+    """
+    Renders all variations of a single source and saves them.
+    Any exception is captured in the returned result.
+
+    Variations that don't change the source are saved by copying
+    the source file (see ``Variation.is_passthrough()``).
+
+    If the processing takes longer than the threshold of `capture`
+    (see ``variations.capture.SlowRenderCapture``), it is profiled.
+
+    `admission` selects the decode of the source
+    (see ``variations.admission.MemoryBudget``).
+    """
+    outputs = {}
+    formats = {}
+    start = time.perf_counter()
+    try:
+        with Image.open(source) as img:
+            paths = {}
+            for key, variation in variations.items():
+                path = _get_destination(destination, index, source, key, variation)
+                if isinstance(path, Path):
+                    path.parent.mkdir(parents=True, exist_ok=True)
+
+                output_format = variation.get_output_format(img, path)
+                if variation.is_passthrough(img, output_format, strip_metadata=strip_metadata):
+                    passthrough.copy_file(
+                        source,
+                        path,
+                        strip_metadata=strip_metadata,
+                        format=output_format
+                    )
+                    outputs[key] = path
+                else:
+                    paths[key] = path
+                    formats[key] = output_format
+
+            if not paths:
+                images = {}
+            elif admission is not None:
+                images = admission.process(img, variations, paths.keys(), source)
+            else:
+                images = variations.process(img, paths.keys())
+            for key, new_img in images.items():
+                variations[key].save(new_img, paths[key])
+                outputs[key] = paths[key]
+
+        outputs = {key: outputs[key] for key in variations}
+    except Exception:
+        return BatchResult(
+            index,
+            _get_source_name(source),
+            outputs,
+            error=traceback.format_exc(),
+            seconds=time.perf_counter() - start
+        )
+
+    seconds = time.perf_counter() - start
+    if capture is not None and formats and capture.is_slow(seconds):
+        capture.capture(
+            partial(_render_in_memory, source, variations, formats),
+            source,
+            {key: variations[key] for key in formats},
+            seconds
+        )
+
+    return BatchResult(index, _get_source_name(source), outputs, seconds=seconds)
+
+
+def _render_in_memory(
+    source: FilePointer,
+    variations: VariationSet,
+    formats: Dict[Hashable, str]
+) -> Dict[Hashable, io.BytesIO]:
+    """
+    Repeats the processing of `process_source()` without writing the files.
+    """
+    buffers = {}
+    with Image.open(source) as img:
+        images = variations.process(img, formats.keys())
+        for key, new_img in images.items():
+            buffers[key] = io.BytesIO()
+            variations[key].save(new_img, buffers[key], formats[key])
+    return buffers
+
+
+def _init_worker(
+    variations: VariationSet,
+    destination: Destination,
+    strip_metadata: bool,
+    metrics: Optional[Collector] = None,
+    capture: Optional[SlowRenderCapture] = None,
+    collect_timings: bool = False
+):
+    global _worker_variations, _worker_destination, _worker_strip_metadata, _worker_capture
+    global _worker_collect_timings
+    _worker_variations = variations
+    _worker_destination = destination
+    _worker_strip_metadata = strip_metadata
+    _worker_capture = capture
+    _worker_collect_timings = collect_timings
+    if metrics is not None:
+        timing.add_hook(metrics)
+
+
+Chunk = List[Tuple[int, FilePointer, Optional[Admission]]]
+
+
+def _process_chunk(chunk: Chunk) -> List[BatchResult]:
+    results = []
+    for index, source, admission in chunk:
+        process = partial(
+            process_source,
+            source,
+            _worker_variations,
+            _worker_destination,
+            index,
+            strip_metadata=_worker_strip_metadata,
+            capture=_worker_capture,
+            admission=admission
+        )
+        if _worker_collect_timings:
+            # The timings are sent back with the result.
+            with timing.collect() as timings:
+                result = process()
+            result.timings = timings
+        else:
+            result = process()
+        results.append(result)
+    return results
+
+
+def _prepare_source(source: FilePointer) -> FilePointer:
+    """
+    File objects can't be sent to a worker process, so their content is read
+    in the parent process.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return source
+
+    buffer = io.BytesIO(source.read())
+    name = getattr(source, "name", None)
+    if isinstance(name, str):
+        buffer.name = name
+    return buffer
+
+
+def _iter_sources(sources: Union[FilePath, Iterable[FilePointer]]) -> Iterator[FilePointer]:
+    if isinstance(sources, (str, os.PathLike)):
+        root = Path(sources)
+        if not root.is_dir():
+            raise ValueError("{} is not a directory".format(root))
+        return iter(sorted(path for path in root.iterdir() if path.is_file()))
+    return iter(sources)
+
+
+def _reject(chunk: Chunk) -> List[BatchResult]:
+    """
+    Returns failed results for the sources of the chunk.
+    Called while handling `MemoryBudgetExceeded`.
+    """
+    error = traceback.format_exc()
+    return [
+        BatchResult(index, _get_source_name(source), error=error)
+        for index, source, _ in chunk
+    ]
+
+
+class BatchProcessor:
+    """
+    Processes source images on a pool of worker processes.
+
+    The variations and the destination are sent to each worker once,
+    when the worker starts. Sources are submitted in chunks, and no more
+    than `max_pending` chunks are in flight at the same time, so an
+    arbitrarily long iterable of sources can be processed.
+
+    Parameters:
+    - `variations` (VariationSet, mapping or iterable): Variations to render.
+    - `destination` (path or callable): A directory for the output files,
+      or a picklable callable `(source, key, variation)` that returns
+      the output path.
+    - `max_workers` (int, optional): Number of worker processes.
+      Defaults to the number of CPUs.
+    - `chunksize` (int, optional): Number of sources sent to a worker at once.
+    - `max_pending` (int, optional): Maximum number of chunks in flight.
+      Defaults to twice the number of workers.
+    - `mp_context` (optional): A multiprocessing context for the pool.
+    - `strip_metadata` (bool, optional): Remove the metadata from the source
+      files that are copied without processing.
+    - `metrics` (optional): A collector of `variations.metrics` that records
+      every result and the timings of the workers. Collectors that push
+      metrics out of the process (e.g. `StatsdClient`) are installed in
+      the workers; the timings for other collectors (e.g. `Metrics`)
+      are sent back with the results (see `BatchResult.timings`).
+    - `capture` (SlowRenderCapture, optional): Profiles sources that take
+      longer than its threshold (see `variations.capture`).
+    - `budget` (MemoryBudget, optional): Admits chunks only while the estimated
+      peak memory of the jobs in flight fits into the budget
+      (see `variations.admission`). Headers of the sources are read
+      in the parent process. Chunks that don't fit wait for the budget
+      whatever the policy, and only sources that exceed the whole limit
+      (or time out waiting for it) are returned as failed results.
+    """
+
+    def __init__(
+        self,
+        variations: Union[VariationSet, Mapping[Hashable, Variation], Iterable[Variation]],
+        destination: Destination,
+        *,
+        max_workers: int = None,
+        chunksize: int = 1,
+        max_pending: int = None,
+        mp_context=None,
+        strip_metadata: bool = False,
+        metrics: Optional[Collector] = None,
+        capture: Optional[SlowRenderCapture] = None,
+        budget: Optional[MemoryBudget] = None
+    ):
+        if not isinstance(variations, VariationSet):
+            variations = VariationSet(variations)
+
+        if chunksize < 1:
+            raise ValueError("'chunksize' must be a positive integer.")
+
+        self.variations = variations
+        self.destination = destination
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.max_pending = max_pending or self.max_workers * 2
+        self.metrics = metrics
+        self.budget = budget
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(
+                variations,
+                destination,
+                strip_metadata,
+                metrics if metrics is not None and metrics.push else None,
+                capture,
+                metrics is not None and not metrics.push
+            ),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def _iter_chunks(self, sources) -> Iterator[List[Tuple[int, FilePointer]]]:
+        indexed_sources = (
+            (index, _prepare_source(source))
+            for index, source in enumerate(_iter_sources(sources))
+        )
+        while True:
+            chunk = list(islice(indexed_sources, self.chunksize))
+            if not chunk:
+                return
+            yield chunk
+
+    def imap_unordered(
+        self,
+        sources: Union[FilePath, Iterable[FilePointer]]
+    ) -> Iterator[BatchResult]:
+        """
+        Processes the sources and yields results as soon as they are ready.
+        `sources` is either a directory or an iterable of paths and file objects.
+        """
+        chunks = self._iter_chunks(sources)
+        pending = {}    # future -> reserved bytes
+        admitted = None
+        while True:
+            while len(pending) < self.max_pending:
+                if admitted is None:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    admitted, nbytes, rejected = self._admit(chunk)
+                    yield from self._record(rejected)
+
+                if admitted and self.budget is not None:
+                    if pending and not self.budget.try_reserve(nbytes):
+                        # The chunk waits until running chunks release the budget.
+                        break
+                    if not pending:
+                        # The budget is held by another consumer.
+                        try:
+                            self.budget.reserve(nbytes)
+                        except MemoryBudgetExceeded:
+                            yield from self._record(_reject(admitted))
+                            admitted = None
+                            continue
+
+                if admitted:
+                    pending[self._executor.submit(_process_chunk, admitted)] = nbytes
+                admitted = None
+
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                nbytes = pending.pop(future)
+                if self.budget is not None:
+                    self.budget.release(nbytes)
+                yield from self._record(future.result())
+
+    def _admit(
+        self,
+        chunk: List[Tuple[int, FilePointer]]
+    ) -> Tuple[Chunk, int, List[BatchResult]]:
+        """
+        Picks the decode of every source of the chunk.
+        Returns the admitted sources, their estimated peak memory
+        and the results of the rejected sources.
+        """
+        if self.budget is None:
+            return [(index, source, None) for index, source in chunk], 0, []
+
+        admitted = []
+        nbytes = 0
+        rejected = []
+        for index, source in chunk:
+            try:
+                # The batch throttles itself, so only jobs that exceed
+                # the whole limit are rejected.
+                admission = self.budget.preflight(source, self.variations, queue=True)
+            except MemoryBudgetExceeded:
+                rejected.extend(_reject([(index, source, None)]))
+                continue
+            except Exception:
+                # The worker reports unreadable sources.
+                admission = None
+
+            admitted.append((index, source, admission))
+            if admission is not None:
+                nbytes += admission.peak_bytes
+        return admitted, nbytes, rejected
+
+    def _record(self, results: List[BatchResult]) -> List[BatchResult]:
+        if self.metrics is not None:
+            for result in results:
+                self.metrics.record_result(result)
+        return results
+
+
+def process_batch(
+    sources: Union[FilePath, Iterable[FilePointer]],
+    variations: Union[VariationSet, Mapping[Hashable, Variation], Iterable[Variation]],
+    destination: Destination,
+    **kwargs
+) -> Iterator[BatchResult]:
+    """
+    Shortcut for `BatchProcessor(...).imap_unordered(sources)` that shuts
+    the pool down when the iteration is over.
+    """
+    with BatchProcessor(variations, destination, **kwargs) as processor:
+        yield from processor.imap_unordered(sources)
@@ -0,0 +1,379 @@
+"""
+Benchmark of variations on a deterministic synthetic corpus.
+
+The corpus covers the formats and modes of the test images
+(JPEG, PNG, GIF and WebP; 1, L, LA, P, RGB, RGBA and CMYK).
+Processing with each mode, the legacy path and encoding are timed
+separately.
+
+Usage:
+    python -m variations.bench
+    python -m variations.bench --sizes 640x480 3000x2000 --repeat 5 --json results.json
+    python -m variations.bench --baseline results.json --threshold 0.1
+"""
+
+import argparse
+import io
+import json
+import platform
+import random
+import sys
+import time
+import warnings
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import PIL
+from pilkit.lib import Image, ImageDraw
+
+from . import __version__
+from .typing import Size
+from .variation import Variation
+
+__all__ = [
+    "CORPUS_FORMATS",
+    "CorpusImage",
+    "BenchResult",
+    "make_image",
+    "make_corpus",
+    "get_scenarios",
+    "run",
+    "compare",
+    "to_json",
+    "main",
+]
+
+# Formats and modes of the images in `tests/input/formats`.
+CORPUS_FORMATS = {
+    "JPEG": ("L", "RGB", "CMYK"),
+    "PNG": ("1", "L", "LA", "P", "RGB", "RGBA"),
+    "GIF": ("L", "P"),
+    "WEBP": ("RGB", "RGBA"),
+}
+
+DEFAULT_SIZES = ((640, 480), (1920, 1280))
+DEFAULT_TARGET_SIZE = (320, 240)
+ENCODE_FORMATS = ("JPEG", "PNG", "WEBP")
+
+
+class CorpusImage(NamedTuple):
+    format: str
+    mode: str
+    size: Size
+    data: bytes
+
+    @property
+    def name(self) -> str:
+        return "{}-{}-{}x{}".format(self.format, self.mode, *self.size)
+
+
+class BenchResult(NamedTuple):
+    scenario: str
+    count: int
+    seconds: float
+    images_per_second: float
+    megapixels_per_second: float
+    p50: float      # latencies, in milliseconds
+    p90: float
+    p99: float
+
+
+def make_image(size: Size, mode: str = "RGB", seed: int = 0) -> Image:
+    """
+    Generates a deterministic image with smooth gradients and sharp edges.
+    """
+    width, height = size
+    gradient = Image.linear_gradient("L")
+    red = gradient.resize(size)
+    green = Image.radial_gradient("L").resize(size)
+    blue = gradient.transpose(Image.ROTATE_90).resize(size)
+    alpha = Image.radial_gradient("L").resize(size).point(lambda x: 255 - x)
+    img = Image.merge("RGBA", (red, green, blue, alpha))
+
+    rng = random.Random(seed)
+    draw = ImageDraw.Draw(img)
+    for _ in range(24):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(1, width // 2 + 2), y0 + rng.randrange(1, height // 2 + 2)
+        color = tuple(rng.randrange(256) for _ in range(4))
+        if rng.random() < 0.5:
+            draw.ellipse((x0, y0, x1, y1), fill=color)
+        else:
+            draw.line((x0, y0, x1, y1), fill=color, width=rng.randrange(1, 8))
+
+    if mode == "RGBA":
+        return img
+    elif mode == "P":
+        return img.convert("RGB").quantize(256)
+    return img.convert(mode)
+
+
+def make_corpus(
+    sizes: Iterable[Size] = DEFAULT_SIZES,
+    formats: Optional[Dict[str, Sequence[str]]] = None,
+    seed: int = 0
+) -> List[CorpusImage]:
+    """
+    Encodes the synthetic images of every size, format and mode.
+    The same arguments always produce the same corpus.
+    """
+    formats = CORPUS_FORMATS if formats is None else formats
+    corpus = []
+    for size in sizes:
+        size = tuple(size)
+        for format, modes in formats.items():
+            for mode in modes:
+                buffer = io.BytesIO()
+                make_image(size, mode, seed).save(buffer, format=format)
+                corpus.append(CorpusImage(format, mode, size, buffer.getvalue()))
+    return corpus
+
+
+def get_scenarios(target_size: Size = DEFAULT_TARGET_SIZE) -> Dict[str, Variation]:
+    width, height = target_size
+    scenarios = {
+        "fill": Variation(size=(width, height)),
+        "fit": Variation(size=(width, height), mode=Variation.Mode.FIT),
+        "crop": Variation(size=(width, height), mode=Variation.Mode.CROP),
+        "none": Variation(size=(0, 0), mode=Variation.Mode.NONE),
+    }
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        scenarios["legacy"] = Variation(size=(width, height), clip=False)
+    return scenarios
+
+
+def _percentile(values: Sequence[float], percent: float) -> float:
+    """
+    Linear interpolation between the closest ranks of sorted values.
+    """
+    if not values:
+        return 0.0
+
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _summarize(scenario: str, timings: List[Tuple[float, int]]) -> BenchResult:
+    seconds = sum(t for t, _ in timings)
+    pixels = sum(p for _, p in timings)
+    latencies = sorted(t * 1000 for t, _ in timings)
+    return BenchResult(
+        scenario=scenario,
+        count=len(timings),
+        seconds=seconds,
+        images_per_second=len(timings) / seconds if seconds else 0.0,
+        megapixels_per_second=pixels / 1e6 / seconds if seconds else 0.0,
+        p50=_percentile(latencies, 50),
+        p90=_percentile(latencies, 90),
+        p99=_percentile(latencies, 99),
+    )
+
+
+def run(
+    corpus: Sequence[CorpusImage],
+    scenarios: Optional[Dict[str, Variation]] = None,
+    repeat: int = 3,
+    encode_formats: Sequence[str] = ENCODE_FORMATS,
+) -> List[BenchResult]:
+    """
+    Times every scenario over the corpus.
+
+    Processing scenarios measure decoding and processing of the source
+    (megapixels of the source). Encoding scenarios measure saving of the
+    processed images of the "fill" scenario (megapixels of the output).
+    """
+    scenarios = get_scenarios() if scenarios is None else scenarios
+    results = []
+    processed = []
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+
+        for name, variation in scenarios.items():
+            timings = []
+            for item in corpus:
+                pixels = item.size[0] * item.size[1]
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    with Image.open(io.BytesIO(item.data)) as img:
+                        new_img = variation.process(img)
+                        new_img.load()
+                    timings.append((time.perf_counter() - start, pixels))
+
+                if name == "fill":
+                    processed.append((variation, new_img))
+            results.append(_summarize(name, timings))
+
+        if not processed:
+            first = next(iter(scenarios.values()), None) or get_scenarios()["fill"]
+            for item in corpus:
+                with Image.open(io.BytesIO(item.data)) as img:
+                    new_img = first.process(img)
+                    new_img.load()
+                processed.append((first, new_img))
+
+        for format in encode_formats:
+            timings = []
+            for variation, img in processed:
+                pixels = img.size[0] * img.size[1]
+                for _ in range(repeat):
+                    buffer = io.BytesIO()
+                    start = time.perf_counter()
+                    variation.save(img, buffer, format)
+                    timings.append((time.perf_counter() - start, pixels))
+            results.append(_summarize("encode-{}".format(format.lower()), timings))
+
+    return results
+
+
+def compare(
+    results: Sequence[BenchResult],
+    baseline: Dict[str, Any],
+    threshold: float = 0.1
+) -> List[Dict[str, Any]]:
+    """
+    Compares the throughput of the scenarios with a saved baseline
+    (see ``to_json()``). A scenario has regressed if its throughput
+    has dropped by more than `threshold` (a fraction).
+    """
+    baseline_results = {
+        item["scenario"]: item
+        for item in baseline.get("results", ())
+    }
+
+    report = []
+    for result in results:
+        base = baseline_results.get(result.scenario)
+        if base is None or not base["images_per_second"]:
+            continue
+
+        change = result.images_per_second / base["images_per_second"] - 1
+        report.append({
+            "scenario": result.scenario,
+            "baseline": base["images_per_second"],
+            "current": result.images_per_second,
+            "change": change,
+            "regression": change < -threshold,
+        })
+    return report
+
+
+def to_json(results: Sequence[BenchResult], **params) -> Dict[str, Any]:
+    """
+    Returns the results and the environment as a JSON-serializable dict.
+    """
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pillow": PIL.__version__,
+            "variations": __version__,
+        },
+        "params": params,
+        "results": [result._asdict() for result in results],
+    }
+
+
+def _parse_size(value: str) -> Size:
+    try:
+        width, height = (int(x) for x in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid size: '{}'. Use WIDTHxHEIGHT.".format(value))
+    return width, height
+
+
+def _print_results(results: Sequence[BenchResult], file=None):
+    file = file or sys.stdout
+    header = "{:<14} {:>7} {:>10} {:>10} {:>9} {:>9} {:>9}".format(
+        "scenario", "count", "images/s", "MP/s", "p50 ms", "p90 ms", "p99 ms"
+    )
+    print(header, file=file)
+    print("-" * len(header), file=file)
+    for r in results:
+        print(
+            "{:<14} {:>7} {:>10.1f} {:>10.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+                r.scenario, r.count, r.images_per_second, r.megapixels_per_second,
+                r.p50, r.p90, r.p99
+            ),
+            file=file
+        )
+
+
+def _print_comparison(report: Sequence[Dict[str, Any]], file=None):
+    file = file or sys.stdout
+    print(file=file)
+    for item in report:
+        print(
+            "{:<14} {:>10.1f} -> {:>10.1f} images/s ({:+.1%}){}".format(
+                item["scenario"], item["baseline"], item["current"], item["change"],
+                "  REGRESSION" if item["regression"] else ""
+            ),
+            file=file
+        )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m variations.bench",
+        description="Benchmark of variations on a synthetic corpus."
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", type=_parse_size, default=list(DEFAULT_SIZES),
+        metavar="WxH", help="sizes of the source images"
+    )
+    parser.add_argument(
+        "--target", type=_parse_size, default=DEFAULT_TARGET_SIZE,
+        metavar="WxH", help="size of the variations"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per image")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the corpus")
+    parser.add_argument(
+        "-k", dest="scenarios", nargs="+", metavar="SCENARIO",
+        help="run only the given processing scenarios"
+    )
+    parser.add_argument("--json", metavar="PATH", help="save the results to a JSON file")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with saved results")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1,
+        help="allowed throughput drop against the baseline (default: 0.1)"
+    )
+    args = parser.parse_args(argv)
+
+    scenarios = get_scenarios(args.target)
+    if args.scenarios:
+        unknown = set(args.scenarios) - set(scenarios)
+        if unknown:
+            parser.error("unknown scenarios: {}".format(", ".join(sorted(unknown))))
+        scenarios = {key: scenarios[key] for key in args.scenarios}
+
+    corpus = make_corpus(args.sizes, seed=args.seed)
+    results = run(corpus, scenarios, repeat=args.repeat)
+    _print_results(results)
+
+    data = to_json(
+        results,
+        sizes=[list(size) for size in args.sizes],
+        target=list(args.target),
+        repeat=args.repeat,
+        seed=args.seed,
+    )
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(data, fp, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+
+        report = compare(results, baseline, args.threshold)
+        _print_comparison(report)
+        if any(item["regression"] for item in report):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,337 @@
+"""
+Content-addressed cache of rendered variations.
+
+The output of a variation depends only on the source bytes and the variation
+parameters, so a rendered image is stored under a key made of the hash of the
+source file and the fingerprint of the variation. Repeated requests return
+the stored bytes without decoding the source.
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+from abc import abstractmethod
+from itertools import chain
+from pathlib import Path
+from typing import List, Optional, Protocol, runtime_checkable
+
+from pilkit.lib import Image
+
+from . import conf
+from .typing import FilePath, FilePointer
+from .utils import guess_format
+
+__all__ = [
+    "get_source_hash",
+    "CacheBackendProtocol",
+    "FileSystemCache",
+    "RenderCache",
+]
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def get_source_hash(source: FilePointer) -> str:
+    """
+    Returns a hash of the source file content.
+    File objects are read from the beginning.
+    """
+    hasher = hashlib.blake2b(digest_size=20)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as fp:
+            for chunk in iter(lambda: fp.read(_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+    else:
+        source.seek(0)
+        for chunk in iter(lambda: source.read(_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+        source.seek(0)
+    return hasher.hexdigest()
+
+
+@runtime_checkable
+class CacheBackendProtocol(Protocol):
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: bytes):
+        pass
+
+
+class FileSystemCache:
+    """
+    Хранит данные в файлах локальной директории.
+
+    При превышении `max_size` (в байтах) удаляются файлы, к которым
+    дольше всего не обращались (LRU по времени модификации).
+
+    The total size is tracked in memory, so writes don't scan the directory.
+    The directory is scanned only when the size exceeds `max_size`, and
+    the entries are removed down to `EVICTION_RATIO` of it, so that
+    the next scan happens only after a number of writes.
+    """
+
+    # The fraction of `max_size` the cache is shrunk to by the eviction.
+    EVICTION_RATIO = 0.9
+
+    def __init__(self, path: FilePath, max_size: Optional[int] = None):
+        self.path = Path(path)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._size = None   # unknown until the first scan
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_size"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _get_path(self, key: str) -> Path:
+        return self.path / key[:2] / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._get_path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        try:
+            # Marks the entry as recently used.
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def _get_file_size(self, path: Path) -> int:
+        try:
+            return path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _add_size(self, delta: int):
+        with self._lock:
+            if self._size is not None:
+                self._size += delta
+
+    def set(self, key: str, value: bytes):
+        path = self._get_path(key)
+        path.parent.mkdir(exist_ok=True)
+        old_size = self._get_file_size(path) if self.max_size is not None else 0
+
+        # Readers never see a partially written file.
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(value)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        if self.max_size is not None:
+            self._add_size(len(value) - old_size)
+            if self._size is None or self._size > self.max_size:
+                self.evict()
+
+    def delete(self, key: str):
+        path = self._get_path(key)
+        size = self._get_file_size(path)
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            return
+        self._add_size(-size)
+
+    def clear(self):
+        with self._lock:
+            for entry in self.path.iterdir():
+                if entry.is_dir():
+                    shutil.rmtree(entry, ignore_errors=True)
+            self._size = 0
+
+    def evict(self):
+        """
+        Scans the directory and, if the total size of the cache exceeds
+        `max_size`, removes the least recently used entries until it fits
+        in ``max_size * EVICTION_RATIO``. Other processes may write to
+        the same directory, so the scan also corrects the tracked size.
+        """
+        if self.max_size is None:
+            return
+
+        with self._lock:
+            entries = []
+            total_size = 0
+            for path in self.path.glob("*/*"):
+                if path.name.startswith(".tmp"):
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+                total_size += stat.st_size
+
+            if total_size > self.max_size:
+                target_size = self.max_size * self.EVICTION_RATIO
+                entries.sort(key=lambda entry: entry[0])
+                for _, size, path in entries:
+                    try:
+                        path.unlink()
+                    except FileNotFoundError:
+                        pass
+                    total_size -= size
+                    if total_size <= target_size:
+                        break
+
+            self._size = total_size
+
+
+def _get_output_format(variation, img: Image, format: Optional[str] = None) -> str:
+    """
+    The explicit format, the format of the variation, or the format of the source.
+    """
+    return (
+        format
+        or variation.format
+        or img.format
+        or conf.MODE_TO_FORMAT.get(img.mode, "PNG")
+    ).upper()
+
+
+def _get_detectors(variation) -> List[str]:
+    """
+    Returns the representations of the detectors used by the face detection
+    processors of the variation. The default detector is global, so it is not
+    a part of the fingerprint of the variation.
+    """
+    from .processors.face_detection import FaceDetectionMixin, get_default_detector
+
+    if variation.legacy_mode:
+        # Legacy pipelines depend on the size of the source.
+        pipeline = chain(variation.preprocessors, variation.postprocessors)
+        detectors = [get_default_detector()] if variation._face_detection else []
+    else:
+        pipeline = variation.get_pipeline()
+        detectors = []
+
+    detectors.extend(
+        processor._get_detector()
+        for processor in pipeline
+        if isinstance(processor, FaceDetectionMixin)
+    )
+    return [repr(detector) for detector in detectors]
+
+
+class RenderCache:
+    """
+    Caches the encoded output of variations.
+
+    The key includes the hash of the source file, the fingerprint
+    of the variation, the output format and the detectors
+    of the face detection processors.
+    """
+
+    def __init__(self, backend: CacheBackendProtocol):
+        self.backend = backend
+
+    def get_key(
+        self,
+        variation,
+        source_hash: str,
+        format: str,
+        strip_metadata: bool = False
+    ) -> str:
+        data = "{}:{}:{}:{:d}".format(
+            source_hash,
+            variation.fingerprint(),
+            format.upper(),
+            strip_metadata
+        )
+        detectors = _get_detectors(variation)
+        if detectors:
+            data += ":" + ",".join(detectors)
+        return hashlib.blake2b(data.encode(), digest_size=20).hexdigest()
+
+    def render(
+        self,
+        variation,
+        source: FilePointer,
+        format: Optional[str] = None,
+        strip_metadata: bool = False
+    ) -> bytes:
+        """
+        Returns the encoded image of the variation applied to the source file.
+        On a cache miss, the source is processed and the result is stored.
+
+        :param variation: A `Variation` instance.
+        :param source: A filename, pathlib.Path object, or file object.
+        :param format: The output format. Defaults to the format of the variation
+                       or the format of the source.
+        :param strip_metadata: Remove Exif, XMP and comments from passthrough copies.
+        """
+        with Image.open(source) as img:
+            # Only the header is read here.
+            output_format = _get_output_format(variation, img, format)
+
+        if not isinstance(source, (str, os.PathLike)):
+            source.seek(0)
+
+        source_hash = get_source_hash(source)
+        key = self.get_key(variation, source_hash, output_format, strip_metadata)
+
+        data = self.backend.get(key)
+        if data is not None:
+            return data
+
+        buffer = io.BytesIO()
+        variation.process_file(
+            source,
+            buffer,
+            format=output_format,
+            strip_metadata=strip_metadata
+        )
+        data = buffer.getvalue()
+        self.backend.set(key, data)
+        return data
+
+    def save(
+        self,
+        variation,
+        source: FilePointer,
+        fp: FilePointer,
+        format: Optional[str] = None,
+        strip_metadata: bool = False
+    ):
+        """
+        Saves the cached (or just rendered) output of the variation.
+
+        :param variation: A `Variation` instance.
+        :param source: A filename, pathlib.Path object, or file object.
+        :param fp: A filename, pathlib.Path object, or file object.
+        :param format: The output format (optional).
+        :param strip_metadata: Remove Exif, XMP and comments from passthrough copies.
+        """
+        if format is None and isinstance(fp, (str, os.PathLike)):
+            format = variation.format or guess_format(fp)
+
+        data = self.render(variation, source, format=format, strip_metadata=strip_metadata)
+        if isinstance(fp, (str, os.PathLike)):
+            with open(fp, "wb") as dest:
+                dest.write(data)
+        else:
+            fp.write(data)
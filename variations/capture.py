@@ -0,0 +1,337 @@
+"""
+Capture of slow renders for offline analysis.
+
+When a job takes longer than the threshold, it is run again under
+`cProfile` and `tracemalloc`, and a report is saved to a separate
+directory:
+
+- ``info.json``: the duration, the source (name, format, mode, size,
+  number of frames), and the fingerprint and parameters of every variation
+- ``profile.pstats``: the profile, for ``pstats`` or ``snakeviz``
+- ``profile.txt``: the top functions by cumulative time
+- ``memory.txt``: the top lines by memory allocated during the job
+- the source file itself, if ``copy_source`` is set
+
+Jobs are profiled only after they have turned out to be slow, so fast jobs
+run without overhead. The repeated run writes to memory, not to the destination.
+The face caches are bypassed during the repeated run (see
+``processors.face_detection.bypass_cache()``), so the profile includes
+the face detection even though the first run has filled the cache.
+
+Notes:
+
+- ``tracemalloc`` traces only allocations made through the Python allocator.
+  The pixel data of Pillow images is allocated by Pillow itself, so it shows
+  up in the peak only indirectly (e.g. as the buffers of encoders or NumPy arrays).
+- ``tracemalloc`` is global to the process. Captures are serialized,
+  but allocations of other threads running at the same time are included.
+
+Example:
+```python
+from variations.batch import process_batch
+from variations.capture import SlowRenderCapture
+
+capture = SlowRenderCapture("/var/tmp/slow-renders", threshold=2.0)
+for result in process_batch("photos/", variations, "thumbnails/", capture=capture):
+    ...
+```
+"""
+
+import cProfile
+import io
+import json
+import logging
+import os
+import platform
+import pstats
+import shutil
+import threading
+import time
+import tracemalloc
+from collections.abc import Hashable, Mapping
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import PIL
+from pilkit.lib import Image
+
+from . import __version__
+from .processors.face_detection import bypass_cache
+from .typing import FilePath, FilePointer
+from .variation import Variation
+
+__all__ = ["SlowRenderCapture"]
+
+logger = logging.getLogger("variations")
+
+# tracemalloc is global, so only one job is captured at a time.
+_capture_lock = threading.Lock()
+
+
+def _rewind(source: FilePointer):
+    if not isinstance(source, (str, os.PathLike)):
+        source.seek(0)
+
+
+def _get_source_info(source: FilePointer) -> Dict[str, Any]:
+    if isinstance(source, (str, os.PathLike)):
+        name = os.fspath(source)
+        file_size = os.path.getsize(source)
+    else:
+        name = getattr(source, "name", None)
+        name = name if isinstance(name, str) else None
+        source.seek(0, io.SEEK_END)
+        file_size = source.tell()
+
+    _rewind(source)
+    with Image.open(source) as img:
+        info = {
+            "name": name,
+            "file_size": file_size,
+            "format": img.format,
+            "mode": img.mode,
+            "size": list(img.size),
+            "frames": getattr(img, "n_frames", 1),
+        }
+    _rewind(source)
+    return info
+
+
+def _get_variation_info(variation: Variation) -> Dict[str, Any]:
+    try:
+        params = variation.to_dict()
+    except TypeError:
+        # Some custom processors can't be serialized.
+        params = None
+    return {
+        "fingerprint": variation.fingerprint(),
+        "params": params,
+    }
+
+
+def _process_in_memory(variation: Variation, source: FilePointer, format: str):
+    with Image.open(source) as img:
+        new_img = variation.process(img)
+        buffer = io.BytesIO()
+        variation.save(new_img, buffer, format)
+    return new_img, buffer
+
+
+class SlowRenderCapture:
+    """
+    Saves a profile and a memory report of jobs that are slower than `threshold`.
+
+    :param path: The directory for the reports. Each report gets a subdirectory.
+    :param threshold: The duration of a job, in seconds, above which it is captured.
+    :param top: The number of entries in the text reports.
+    :param max_captures: The maximum number of reports in the directory.
+                         ``None`` removes the limit.
+    :param copy_source: Copy the source file to the report.
+    """
+
+    def __init__(
+        self,
+        path: FilePath,
+        threshold: float = 1.0,
+        top: int = 25,
+        max_captures: Optional[int] = 100,
+        copy_source: bool = False
+    ):
+        self.path = Path(path)
+        self.threshold = threshold
+        self.top = top
+        self.max_captures = max_captures
+        self.copy_source = copy_source
+
+    def is_slow(self, seconds: float) -> bool:
+        return seconds > self.threshold
+
+    def _is_full(self) -> bool:
+        if self.max_captures is None or not self.path.is_dir():
+            return False
+        count = sum(1 for entry in self.path.iterdir() if entry.is_dir())
+        return count >= self.max_captures
+
+    def _make_directory(self, source_info: Dict[str, Any]) -> Path:
+        stem = Path(source_info["name"]).stem if source_info["name"] else "source"
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        prefix = "{}-{}-{}".format(timestamp, os.getpid(), stem)
+        self.path.mkdir(parents=True, exist_ok=True)
+        for index in range(1000):
+            directory = self.path / "{}-{}".format(prefix, index)
+            try:
+                directory.mkdir()
+            except FileExistsError:
+                continue
+            return directory
+        raise FileExistsError(
+            "Cannot create a directory for the report in {}".format(self.path)
+        )
+
+    def capture(
+        self,
+        render: Callable[[], Any],
+        source: FilePointer,
+        variations: Mapping[Hashable, Variation],
+        seconds: float
+    ) -> Optional[Path]:
+        """
+        Runs `render` again under the profilers and saves the report.
+        Returns the directory of the report, or ``None`` if the limit
+        of reports has been reached or the capture has failed.
+        Errors are logged and don't affect the job.
+
+        :param render: A callable that repeats the job. Its result is kept
+                       until the memory snapshot is taken.
+        :param source: The source file of the job.
+        :param variations: The variations of the job, by key.
+        :param seconds: The duration of the original job.
+        """
+        with _capture_lock:
+            if self._is_full():
+                return None
+
+            try:
+                return self._capture(render, source, variations, seconds)
+            except Exception:
+                logger.exception("Cannot capture the slow render of %r.", source)
+                return None
+
+    def _capture(
+        self,
+        render: Callable[[], Any],
+        source: FilePointer,
+        variations: Mapping[Hashable, Variation],
+        seconds: float
+    ) -> Path:
+        source_info = _get_source_info(source)
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start(10)
+
+        try:
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+
+            profile = cProfile.Profile()
+            start = time.perf_counter()
+            profile.enable()
+            try:
+                with bypass_cache():
+                    result = render()
+            finally:
+                profile.disable()
+                rerun_seconds = time.perf_counter() - start
+                _rewind(source)
+
+            after = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            del result
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+
+        directory = self._make_directory(source_info)
+        info = {
+            "seconds": seconds,
+            "rerun_seconds": rerun_seconds,
+            "rerun_caches": "bypassed",
+            "threshold": self.threshold,
+            "source": source_info,
+            "variations": {
+                str(key): _get_variation_info(variation)
+                for key, variation in variations.items()
+            },
+            "memory": {"traced_peak": peak},
+            "environment": {
+                "python": platform.python_version(),
+                "pillow": PIL.__version__,
+                "variations": __version__,
+            },
+        }
+        with open(directory / "info.json", "w") as fp:
+            json.dump(info, fp, indent=2, default=repr)
+
+        profile.dump_stats(directory / "profile.pstats")
+        with open(directory / "profile.txt", "w") as fp:
+            stats = pstats.Stats(profile, stream=fp)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+
+        self._write_memory_report(directory / "memory.txt", before, after, peak)
+
+        if self.copy_source:
+            self._copy_source(source, directory, source_info)
+
+        return directory
+
+    def _write_memory_report(
+        self,
+        path: Path,
+        before: tracemalloc.Snapshot,
+        after: tracemalloc.Snapshot,
+        peak: int
+    ):
+        filters = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        )
+        before = before.filter_traces(filters)
+        after = after.filter_traces(filters)
+
+        with open(path, "w") as fp:
+            print("Traced peak: {:.1f} KiB".format(peak / 1024), file=fp)
+            print("Top {} lines by allocated memory:".format(self.top), file=fp)
+            for stat in after.compare_to(before, "lineno")[:self.top]:
+                print(stat, file=fp)
+
+    def _copy_source(
+        self,
+        source: FilePointer,
+        directory: Path,
+        source_info: Dict[str, Any]
+    ):
+        extension = "." + source_info["format"].lower() if source_info["format"] else ""
+        target = directory / ("source" + extension)
+        if isinstance(source, (str, os.PathLike)):
+            shutil.copyfile(source, target)
+        else:
+            with open(target, "wb") as fp:
+                shutil.copyfileobj(source, fp)
+            _rewind(source)
+
+    def process_file(
+        self,
+        variation: Variation,
+        source: FilePointer,
+        fp: FilePointer,
+        format: Optional[str] = None,
+        strip_metadata: bool = False
+    ) -> bool:
+        """
+        Same as ``variation.process_file()``, but the job is captured
+        if it is slow. Copying of the source is never captured.
+        """
+        start = time.perf_counter()
+        copied = variation.process_file(
+            source,
+            fp,
+            format=format,
+            strip_metadata=strip_metadata
+        )
+        seconds = time.perf_counter() - start
+        if copied or not self.is_slow(seconds):
+            return copied
+
+        _rewind(source)
+        with Image.open(source) as img:
+            output_format = variation.get_output_format(img, fp, format)
+        _rewind(source)
+
+        self.capture(
+            lambda: _process_in_memory(variation, source, output_format),
+            source,
+            {"": variation},
+            seconds
+        )
+        return copied
@@ -12,3 +12,30 @@ MODE_TO_FORMAT = {
     "RGB": "WEBP",
     "RGBA": "WEBP",
 }
+
+# Профили кодирования: параметры `Image.save()` по умолчанию для каждого формата.
+# Явно указанные параметры имеют приоритет над параметрами профиля.
+# Профиль "default" повторяет прежние параметры сохранения, остальные
+# включаются явно.
+ENCODING_PROFILES = {
+    "default": {
+        "JPEG": {"optimize": True},
+        "PNG": {"optimize": True},
+    },
+    "fast": {
+        "JPEG": {"optimize": False, "progressive": False},
+        "PNG": {"optimize": False, "compress_level": 1},
+        "WEBP": {"method": 0},
+    },
+    "balanced": {
+        "JPEG": {"optimize": True},
+        "PNG": {"optimize": False, "compress_level": 6},
+        "WEBP": {"method": 4},
+    },
+    "smallest": {
+        "JPEG": {"optimize": True, "progressive": True},
+        "PNG": {"optimize": True, "compress_level": 9},
+        "WEBP": {"method": 6},
+    },
+}
+DEFAULT_ENCODING_PROFILE = "default"
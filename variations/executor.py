@@ -0,0 +1,169 @@
+"""
+Concurrent processing of images on a pool of threads.
+
+Pillow releases the GIL while it decodes, resizes, filters and encodes
+images, so a thread pool gives multi-core throughput without the memory
+cost of worker processes.
+
+Thread safety:
+
+- A `Variation` can be shared between threads, as long as it is not
+  modified while images are being processed. Its cached pipelines are
+  built under a lock.
+- Bundled processors keep no state between calls. The face detection
+  cache is protected by a lock.
+- `Image` objects are loaded lazily, and loading is not thread-safe.
+  Each job should open its own source, or the image must be loaded
+  before it is shared (``ThreadedExecutor.process()`` does it, after
+  ``Image.draft()``, so that the result is the same as the one of
+  ``Variation.process()``).
+- `Variation.logger` is a standard `logging` logger, which is thread-safe.
+
+Example:
+```python
+from variations import ThreadedExecutor, Variation
+
+variation = Variation(size=(640, 480))
+with ThreadedExecutor(max_workers=4) as executor:
+    futures = [
+        executor.submit(variation, source, destination)
+        for source, destination in jobs
+    ]
+```
+"""
+
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional, Tuple
+
+from pilkit.lib import Image
+
+from . import utils
+from .capture import SlowRenderCapture
+from .typing import FilePointer
+from .variation import Variation
+
+__all__ = ["ThreadedExecutor"]
+
+
+class ThreadedExecutor:
+    """
+    Runs `process` and `save` jobs of variations on a thread pool.
+
+    :param max_workers: The maximum number of threads. Defaults to the default
+                        of ``ThreadPoolExecutor``.
+    :param executor: An existing executor to share (e.g. the one configured
+                     for ``variations.aio``). It isn't shut down by this object.
+    :param capture: Profiles `submit()` jobs that take longer than its threshold
+                    (see ``variations.capture.SlowRenderCapture``).
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        executor: Optional[Executor] = None,
+        capture: Optional[SlowRenderCapture] = None
+    ):
+        if executor is not None and max_workers is not None:
+            raise ValueError("Cannot use 'max_workers' with an existing executor.")
+
+        self.capture = capture
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="variations"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def shutdown(self, wait: bool = True):
+        if self._owns_executor:
+            self._executor.shutdown(wait=wait)
+
+    def submit(
+        self,
+        variation: Variation,
+        source: FilePointer,
+        fp: FilePointer,
+        format: Optional[str] = None,
+        strip_metadata: bool = False
+    ) -> "Future[bool]":
+        """
+        Processes the source file and saves the result in a worker thread
+        (see ``Variation.process_file()``). The future resolves to ``True``
+        if the source has been copied without processing.
+
+        File objects must not be shared between jobs.
+        """
+        if self.capture is not None:
+            return self._executor.submit(
+                self.capture.process_file,
+                variation,
+                source,
+                fp,
+                format=format,
+                strip_metadata=strip_metadata
+            )
+
+        return self._executor.submit(
+            variation.process_file,
+            source,
+            fp,
+            format=format,
+            strip_metadata=strip_metadata
+        )
+
+    def process(self, variation: Variation, img: Image) -> "Future[Image]":
+        """
+        Processes the image in a worker thread. The image is loaded in the calling
+        thread first, so the same image can be submitted several times.
+
+        Like ``Variation.process()``, the first call configures the decoder
+        to the draft size of the variation (see ``Image.draft()``), and
+        the following calls get the image already decoded.
+        """
+        if not variation.legacy_mode:
+            draft_size = variation.get_draft_size(img.size, utils.get_exif_orientation(img))
+            if draft_size is not None:
+                img.draft(img.mode, draft_size)
+        img.load()
+        return self._executor.submit(variation.process, img)
+
+    def save(
+        self,
+        variation: Variation,
+        img: Image,
+        fp: FilePointer,
+        format: Optional[str] = None,
+        **options
+    ) -> Future:
+        """
+        Saves the processed image in a worker thread (see ``Variation.save()``).
+        """
+        img.load()
+        return self._executor.submit(variation.save, img, fp, format, **options)
+
+    def map(
+        self,
+        variation: Variation,
+        jobs: Iterable[Tuple[FilePointer, FilePointer]],
+        format: Optional[str] = None,
+        strip_metadata: bool = False
+    ) -> Iterator[bool]:
+        """
+        Processes pairs of a source and a destination concurrently.
+        Results are yielded in the order of the jobs; the first error is raised.
+        """
+        futures = [
+            self.submit(variation, source, fp, format=format, strip_metadata=strip_metadata)
+            for source, fp in jobs
+        ]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,343 @@
+"""
+Aggregated metrics of image processing.
+
+Collectors are timing hooks (see `variations.timing`) that turn the stages
+of processing into counters and histograms:
+
+- ``stage_seconds`` (histogram): duration of every stage, by `stage` and `name`
+- ``decoded_megapixels_total``: megapixels of decoded sources (after
+  ``Image.draft()``), by `format`
+- ``encoded_images_total`` and ``encoded_bytes_total``: output, by `format`
+- ``detections_total``: face or saliency detections, by `detector`
+  and `result` (``hit`` or ``miss``)
+
+The batch engine also records its results with ``record_result()``:
+
+- ``renders_total``: saved outputs, by `variation` (the key in the `VariationSet`)
+- ``render_seconds`` (histogram): processing time of a source
+- ``errors_total``: failed sources
+
+`Metrics` keeps the values in memory and renders them in the Prometheus text
+exposition format. `StatsdClient` sends every value as a UDP datagram to
+a statsd-compatible collector.
+
+Example:
+```python
+from variations import metrics, timing
+
+registry = metrics.Metrics()
+timing.add_hook(registry)
+
+...
+
+print(registry.to_prometheus())
+```
+"""
+
+import bisect
+import re
+import socket
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .timing import StageTiming
+
+__all__ = [
+    "DEFAULT_BUCKETS",
+    "Collector",
+    "Histogram",
+    "Metrics",
+    "StatsdClient",
+]
+
+# Prometheus client defaults, in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    "stage_seconds": "Duration of processing stages.",
+    "decoded_megapixels_total": "Megapixels of decoded source images.",
+    "encoded_images_total": "Encoded output images.",
+    "encoded_bytes_total": "Bytes of encoded output images.",
+    "detections_total": "Face or saliency detections.",
+    "renders_total": "Saved outputs of the batch engine.",
+    "render_seconds": "Processing time of a source in the batch engine.",
+    "errors_total": "Sources that have failed in the batch engine.",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Collector:
+    """
+    Base class of collectors. Subclasses implement
+    ``increment()`` and ``observe()``.
+    """
+
+    #: Collectors that push metrics out of the process are also
+    #: installed as timing hooks in the workers of the batch engine.
+    push = False
+
+    def increment(self, metric: str, value: float = 1, **labels: str):
+        raise NotImplementedError
+
+    def observe(self, metric: str, value: float, **labels: str):
+        raise NotImplementedError
+
+    def __call__(self, timing: StageTiming):
+        self.observe("stage_seconds", timing.seconds, stage=timing.stage, name=timing.name)
+
+        decoded_size = timing.output_size or timing.input_size
+        if timing.stage == "decode" and decoded_size:
+            width, height = decoded_size
+            self.increment("decoded_megapixels_total", width * height / 1e6, format=timing.name)
+        elif timing.stage == "encode":
+            self.increment("encoded_images_total", format=timing.name)
+            if timing.bytes_written:
+                self.increment("encoded_bytes_total", timing.bytes_written, format=timing.name)
+        elif timing.stage == "detect":
+            self.increment(
+                "detections_total",
+                detector=timing.name,
+                result="hit" if timing.regions else "miss"
+            )
+
+    def record_result(self, result):
+        """
+        Records the result of the batch engine (see ``variations.batch.BatchResult``),
+        including the timings sent back by the workers.
+        """
+        for timing in result.timings:
+            self(timing)
+        for key in result.outputs:
+            self.increment("renders_total", variation=str(key))
+        if result.error:
+            self.increment("errors_total")
+        if result.seconds is not None:
+            self.observe("render_seconds", result.seconds)
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed upper bounds of buckets.
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[int]:
+        result = []
+        total = 0
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{{{}}}".format(",".join(
+        '{}="{}"'.format(key, _escape_label(value))
+        for key, value in labels
+    ))
+
+
+class Metrics(Collector):
+    """
+    Thread-safe in-memory registry of counters and histograms.
+
+    :param prefix: The prefix of metric names.
+    :param buckets: Upper bounds of histogram buckets, in seconds.
+    """
+
+    def __init__(self, prefix: str = "variations", buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, metric: str, value: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counters = self._counters.setdefault(metric, {})
+            counters[key] = counters.get(key, 0) + value
+
+    def observe(self, metric: str, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histograms = self._histograms.setdefault(metric, {})
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def get_counter(self, metric: str, **labels: str) -> float:
+        with self._lock:
+            return self._counters.get(metric, {}).get(tuple(sorted(labels.items())), 0)
+
+    def get_histogram(self, metric: str, **labels: str) -> Optional[Histogram]:
+        with self._lock:
+            return self._histograms.get(metric, {}).get(tuple(sorted(labels.items())))
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _iter_lines(self) -> Iterator[str]:
+        for name in sorted(self._counters):
+            full_name = "{}_{}".format(self.prefix, name)
+            if name in METRIC_HELP:
+                yield "# HELP {} {}".format(full_name, METRIC_HELP[name])
+            yield "# TYPE {} counter".format(full_name)
+            for labels, value in sorted(self._counters[name].items()):
+                yield "{}{} {}".format(full_name, _format_labels(labels), _format_value(value))
+
+        for name in sorted(self._histograms):
+            full_name = "{}_{}".format(self.prefix, name)
+            if name in METRIC_HELP:
+                yield "# HELP {} {}".format(full_name, METRIC_HELP[name])
+            yield "# TYPE {} histogram".format(full_name)
+            for labels, histogram in sorted(self._histograms[name].items()):
+                bounds = histogram.buckets + (float("inf"),)
+                counts = histogram.cumulative_counts() + [histogram.count]
+                for bound, count in zip(bounds, counts):
+                    yield "{}_bucket{} {}".format(
+                        full_name,
+                        _format_labels(labels + (("le", _format_value(bound)),)),
+                        count
+                    )
+                yield "{}_sum{} {}".format(
+                    full_name, _format_labels(labels), _format_value(histogram.sum)
+                )
+                yield "{}_count{} {}".format(
+                    full_name, _format_labels(labels), histogram.count
+                )
+
+    def to_prometheus(self) -> str:
+        """
+        Renders the metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        with self._lock:
+            lines = list(self._iter_lines())
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+_STATSD_INVALID = re.compile(r"[^A-Za-z0-9_\-]")
+
+
+class StatsdClient(Collector):
+    """
+    Sends metrics over UDP in the statsd line format. Counters are sent
+    as ``|c``, durations as ``|ms``.
+
+    By default, label values are appended to the metric name
+    (``variations.stage_seconds.processor.ResizeToFill``). With ``tags=True``
+    labels are sent as DogStatsD tags (``|#stage:processor,name:ResizeToFill``).
+
+    Errors of sending are ignored: metrics must not break the processing.
+
+    :param host: The host of the collector.
+    :param port: The port of the collector.
+    :param prefix: The prefix of metric names.
+    :param tags: Send labels as DogStatsD tags.
+    """
+
+    push = True
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8125,
+        prefix: str = "variations",
+        tags: bool = False
+    ):
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.tags = tags
+        self._socket = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_socket"] = None
+        return state
+
+    def _get_socket(self) -> socket.socket:
+        # The socket is created lazily, so that the client can be sent
+        # to worker processes.
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return self._socket
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def format_line(self, metric: str, value: float, metric_type: str, labels: Dict[str, str]) -> str:
+        parts = [self.prefix, metric] if self.prefix else [metric]
+        if self.tags:
+            line = "{}:{}|{}".format(".".join(parts), _format_value(value), metric_type)
+            if labels:
+                line += "|#" + ",".join(
+                    "{}:{}".format(key, _STATSD_INVALID.sub("_", str(labels[key])))
+                    for key in sorted(labels)
+                )
+            return line
+
+        parts.extend(
+            _STATSD_INVALID.sub("_", str(value)) or "_"
+            for value in labels.values()
+        )
+        return "{}:{}|{}".format(".".join(parts), _format_value(value), metric_type)
+
+    def send(self, line: str):
+        try:
+            self._get_socket().sendto(line.encode("utf-8"), (self.host, self.port))
+        except OSError:
+            pass
+
+    def increment(self, metric: str, value: float = 1, **labels: str):
+        self.send(self.format_line(metric, value, "c", labels))
+
+    def observe(self, metric: str, value: float, **labels: str):
+        # Durations are sent as timers, in milliseconds.
+        if metric.endswith("_seconds"):
+            self.send(self.format_line(metric, round(value * 1000, 3), "ms", labels))
+        else:
+            self.send(self.format_line(metric, value, "h", labels))
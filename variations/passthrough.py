@@ -0,0 +1,139 @@
+"""
+Copying of source files that don't need any processing.
+
+When a variation doesn't change the source image at all, the source bytes
+are copied to the destination as is. Decoding and re-encoding are skipped,
+and the quality of the image is preserved.
+"""
+
+import os
+import shutil
+import struct
+from typing import Optional
+
+from .typing import FilePointer
+
+__all__ = ["STRIP_METADATA_FORMATS", "remove_metadata", "copy_file"]
+
+# JPEG segments that are kept when the metadata is stripped:
+# APP0 (JFIF), APP2 (ICC profile) and APP14 (Adobe color transform).
+_JPEG_KEEP_APP_MARKERS = {0xE0, 0xE2, 0xEE}
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_PNG_METADATA_CHUNKS = {b"tEXt", b"zTXt", b"iTXt", b"eXIf", b"tIME"}
+
+STRIP_METADATA_FORMATS = {"JPEG", "PNG"}
+
+
+def _strip_jpeg(data: bytes) -> bytes:
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("Invalid JPEG data.")
+
+    chunks = [data[:2]]
+    pos = 2
+    while pos < len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("Invalid JPEG marker at offset {}.".format(pos))
+
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill byte
+            pos += 1
+            continue
+
+        if marker == 0xDA:
+            # Start of scan: the rest is the entropy-coded data.
+            chunks.append(data[pos:])
+            break
+
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        end = pos + 2 + length
+        is_app = 0xE0 <= marker <= 0xEF
+        if not (marker == 0xFE or (is_app and marker not in _JPEG_KEEP_APP_MARKERS)):
+            chunks.append(data[pos:end])
+        pos = end
+
+    return b"".join(chunks)
+
+
+def _strip_png(data: bytes) -> bytes:
+    if data[:8] != _PNG_SIGNATURE:
+        raise ValueError("Invalid PNG data.")
+
+    chunks = [data[:8]]
+    pos = 8
+    while pos < len(data):
+        length = struct.unpack(">I", data[pos:pos + 4])[0]
+        chunk_type = data[pos + 4:pos + 8]
+        end = pos + 12 + length
+        if chunk_type not in _PNG_METADATA_CHUNKS:
+            chunks.append(data[pos:end])
+        pos = end
+
+    return b"".join(chunks)
+
+
+def remove_metadata(data: bytes, format: str) -> bytes:
+    """
+    Removes Exif, XMP, comments and text chunks from the encoded image
+    without decoding it. Color profiles are preserved.
+    """
+    format = format.upper()
+    if format == "JPEG":
+        return _strip_jpeg(data)
+    elif format == "PNG":
+        return _strip_png(data)
+    raise ValueError("Cannot strip metadata from '{}' images.".format(format))
+
+
+def _read(source: FilePointer) -> bytes:
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as fp:
+            return fp.read()
+
+    source.seek(0)
+    return source.read()
+
+
+def copy_file(
+    source: FilePointer,
+    fp: FilePointer,
+    strip_metadata: bool = False,
+    format: Optional[str] = None
+):
+    """
+    Copies the source file to the destination.
+    File objects are read from the beginning.
+
+    :param source: A filename, pathlib.Path object, or file object.
+    :param fp: A filename, pathlib.Path object, or file object.
+    :param strip_metadata: Remove the metadata (see ``remove_metadata()``).
+    :param format: The format of the source. Required to strip the metadata.
+    """
+    if strip_metadata:
+        if format is None:
+            raise ValueError("The 'format' is required to strip the metadata.")
+
+        data = remove_metadata(_read(source), format)
+        if isinstance(fp, (str, os.PathLike)):
+            with open(fp, "wb") as dest:
+                dest.write(data)
+        else:
+            fp.write(data)
+        return
+
+    if isinstance(source, (str, os.PathLike)):
+        if isinstance(fp, (str, os.PathLike)):
+            # Uses os.sendfile() where available.
+            shutil.copyfile(source, fp)
+        else:
+            with open(source, "rb") as src:
+                shutil.copyfileobj(src, fp)
+        return
+
+    source.seek(0)
+    if isinstance(fp, (str, os.PathLike)):
+        with open(fp, "wb") as dest:
+            shutil.copyfileobj(source, dest)
+    else:
+        shutil.copyfileobj(source, fp)
@@ -0,0 +1,192 @@
+from typing import NamedTuple, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .typing import Size
+
+__all__ = ["VariationPlan", "VariationPlanArray"]
+
+
+class VariationPlan(NamedTuple):
+    """
+    Geometry of a variation applied to a source image of a particular size.
+
+    The source is resampled to `resize_size`, then pasted onto a canvas
+    of `canvas_size` at `offset`. A negative offset crops the resized image,
+    a positive one pads it with the background.
+
+    `offset` is ``None`` when the position depends on the image content
+    (``Gravity.AUTO``).
+
+    Preprocessors and postprocessors that change the image size
+    are not taken into account.
+    """
+
+    source_size: Size                   # size of the oriented source image
+    resize_size: Size                   # size the source is resampled to
+    canvas_size: Size                   # size of the processed image
+    offset: Optional[Tuple[int, int]]   # position of the resized image on the canvas
+
+    @property
+    def resized(self) -> bool:
+        return tuple(self.resize_size) != tuple(self.source_size)
+
+    @property
+    def crop_box(self) -> Optional[Tuple[int, int, int, int]]:
+        """
+        The region of the resized image that is visible on the canvas.
+        """
+        if self.offset is None:
+            return None
+
+        x, y = self.offset
+        return (
+            max(0, -x),
+            max(0, -y),
+            min(self.resize_size[0], self.canvas_size[0] - x),
+            min(self.resize_size[1], self.canvas_size[1] - y),
+        )
+
+    @property
+    def padding(self) -> Optional[Tuple[int, int, int, int]]:
+        """
+        The width of the background on each side of the canvas,
+        as `(left, top, right, bottom)`.
+        """
+        if self.offset is None:
+            return None
+
+        x, y = self.offset
+        return (
+            max(0, x),
+            max(0, y),
+            max(0, self.canvas_size[0] - x - self.resize_size[0]),
+            max(0, self.canvas_size[1] - y - self.resize_size[1]),
+        )
+
+    @property
+    def is_identity(self) -> bool:
+        """
+        Whether the source is passed through without any change of geometry.
+        """
+        return (
+            not self.resized
+            and tuple(self.canvas_size) == tuple(self.source_size)
+            and self.offset == (0, 0)
+        )
+
+
+class VariationPlanArray(NamedTuple):
+    """
+    Geometry of a variation for many source images at once.
+
+    Every field is a NumPy array of shape `(N, 2)` with the same meaning
+    as the corresponding field of `VariationPlan`.
+    """
+
+    source_size: "numpy.ndarray"
+    resize_size: "numpy.ndarray"
+    canvas_size: "numpy.ndarray"
+    offset: Optional["numpy.ndarray"]
+
+    def __len__(self) -> int:
+        return len(self.source_size)
+
+    @property
+    def resized(self) -> "numpy.ndarray":
+        return (self.resize_size != self.source_size).any(axis=1)
+
+    @property
+    def crop_box(self) -> Optional["numpy.ndarray"]:
+        """
+        An array of shape `(N, 4)`. See `VariationPlan.crop_box`.
+        """
+        if self.offset is None:
+            return None
+
+        return numpy.concatenate([
+            numpy.maximum(0, -self.offset),
+            numpy.minimum(self.resize_size, self.canvas_size - self.offset),
+        ], axis=1)
+
+    @property
+    def padding(self) -> Optional["numpy.ndarray"]:
+        """
+        An array of shape `(N, 4)`. See `VariationPlan.padding`.
+        """
+        if self.offset is None:
+            return None
+
+        return numpy.concatenate([
+            numpy.maximum(0, self.offset),
+            numpy.maximum(0, self.canvas_size - self.offset - self.resize_size),
+        ], axis=1)
+
+    def item(self, index: int) -> VariationPlan:
+        """
+        Returns the plan of a single source image.
+        """
+        return VariationPlan(
+            tuple(int(x) for x in self.source_size[index]),
+            tuple(int(x) for x in self.resize_size[index]),
+            tuple(int(x) for x in self.canvas_size[index]),
+            None if self.offset is None else tuple(int(x) for x in self.offset[index]),
+        )
+
+
+def _round_div(numerator, denominator):
+    """
+    Integer division rounded half to even, like ``round(Fraction(n, d))``.
+    """
+    quotient, remainder = numpy.divmod(numerator, denominator)
+    double = 2 * remainder
+    return quotient + ((double > denominator) | ((double == denominator) & (quotient % 2 == 1)))
+
+
+def fit_sizes(source_size, width: int, height: int):
+    """
+    Vectorized size calculation of ``ResizeToFit`` (without resampling check).
+    """
+    source_width, source_height = source_size[:, 0], source_size[:, 1]
+    if width and height:
+        # min(width / W, height / H), compared in integers
+        by_width = width * source_height <= height * source_width
+        new_width = numpy.where(by_width, width, _round_div(source_width * height, source_height))
+        new_height = numpy.where(by_width, _round_div(source_height * width, source_width), height)
+    elif width:
+        new_width = numpy.full_like(source_width, width)
+        new_height = _round_div(source_height * width, source_width)
+    else:
+        new_width = _round_div(source_width * height, source_height)
+        new_height = numpy.full_like(source_height, height)
+    return numpy.stack([new_width, new_height], axis=1)
+
+
+def cover_sizes(source_size, width: int, height: int):
+    """
+    Vectorized size calculation of ``ResizeToCover``.
+    """
+    ratio = numpy.maximum(width / source_size[:, 0], height / source_size[:, 1])
+    return numpy.rint(source_size * ratio[:, None]).astype(numpy.int64)
+
+
+def resize_sizes(source_size, new_size, upscale: bool):
+    """
+    The source isn't enlarged without `upscale` (see ``Resize``).
+    """
+    if upscale:
+        return new_size
+    shrink = (new_size < source_size).all(axis=1)
+    return numpy.where(shrink[:, None], new_size, source_size)
+
+
+def offsets(canvas_size, size, anchor):
+    """
+    Vectorized offset calculation of ``ResizeCanvas``.
+    """
+    delta = (canvas_size - size).astype(numpy.float64)
+    anchor = numpy.array([float(anchor[0]), float(anchor[1])])
+    return numpy.trunc(delta * anchor).astype(numpy.int64)
@@ -1,12 +1,15 @@
+import importlib
+import inspect
+import json
+import time
+from typing import Any, Dict
+
 from pilkit.lib import Image, ImageColor
-from pilkit.processors.base import (
-    Adjust,
-    Anchor,
-    ProcessorPipeline,
-    Reflection,
-    Transpose,
-)
+from pilkit.processors.base import Adjust, Anchor
+from pilkit.processors.base import ProcessorPipeline as BaseProcessorPipeline
+from pilkit.processors.base import Reflection, Transpose
 
+from .. import timing
 from ..typing import Color
 
 __all__ = [
@@ -16,10 +19,176 @@ __all__ = [
     "Transpose",
     "Anchor",
     "MakeOpaque",
+    "ParamsMixin",
+    "get_params",
+    "get_cache_key",
+    "processor_to_dict",
+    "processor_from_dict",
+    "register_processor",
 ]
 
+# Модули, процессоры из которых можно создать по описанию.
+PROCESSOR_MODULES = ("variations.processors", "pilkit.processors")
+
+# Other processor classes allowed by `register_processor()`, by class path.
+_registered_processors: Dict[str, type] = {}
+
+
+class ProcessorPipeline(BaseProcessorPipeline):
+    """
+    Подобен pilkit-классу ProcessorPipeline, но сообщает время работы
+    каждого процессора хукам модуля `variations.timing`.
+    """
+
+    def process(self, img):
+        hooks = timing.get_hooks()
+        if not hooks:
+            return super().process(img)
+
+        for proc in self:
+            start = time.perf_counter()
+            new_img = proc.process(img)
+            timing.report(
+                hooks,
+                "processor",
+                type(proc).__name__,
+                time.perf_counter() - start,
+                img,
+                new_img
+            )
+            img = new_img
+        return img
+
+
+def _get_class_path(cls: type) -> str:
+    return "{}.{}".format(cls.__module__, cls.__qualname__)
+
+
+def _make_cache_key(processor, params: Dict[str, Any]) -> str:
+    return "{}({})".format(
+        _get_class_path(type(processor)),
+        json.dumps(params, sort_keys=True, separators=(",", ":"), default=repr)
+    )
+
+
+def get_params(processor) -> Dict[str, Any]:
+    """
+    Returns the constructor arguments that recreate the processor.
+
+    Processors may define the ``params()`` method. For other processors
+    (e.g. the ones from pilkit) the arguments are taken from the attributes
+    named after the parameters of the constructor.
+    """
+    params = getattr(processor, "params", None)
+    if callable(params):
+        return params()
+
+    attrs = vars(processor)
+    result = {}
+    signature = inspect.signature(type(processor).__init__)
+    for name, param in list(signature.parameters.items())[1:]:
+        if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+            raise TypeError(
+                "Cannot get the parameters of '{}'.".format(type(processor).__name__)
+            )
+
+        if name in attrs:
+            result[name] = attrs[name]
+        elif param.default is param.empty:
+            raise TypeError(
+                "Cannot get the parameters of '{}'.".format(type(processor).__name__)
+            )
+    return result
+
+
+def get_cache_key(processor) -> str:
+    """
+    Returns a string that uniquely identifies the processing
+    performed by the processor.
+    """
+    cache_key = getattr(processor, "cache_key", None)
+    if callable(cache_key):
+        return cache_key()
+
+    try:
+        params = get_params(processor)
+    except TypeError:
+        params = vars(processor)
+    return _make_cache_key(processor, params)
 
-class MakeOpaque:
+
+def processor_to_dict(processor) -> Dict[str, Any]:
+    return {
+        "class": _get_class_path(type(processor)),
+        "params": get_params(processor),
+    }
+
+
+def _is_processor_module(module_name: str) -> bool:
+    return any(
+        module_name == prefix or module_name.startswith(prefix + ".")
+        for prefix in PROCESSOR_MODULES
+    )
+
+
+def _is_processor_class(cls) -> bool:
+    # Detectors of regions of interest are described the same way.
+    return isinstance(cls, type) and (
+        callable(getattr(cls, "process", None))
+        or callable(getattr(cls, "detect", None))
+    )
+
+
+def register_processor(cls: type) -> type:
+    """
+    Allows ``processor_from_dict()`` to create processors of a class
+    outside of `PROCESSOR_MODULES`. Can be used as a class decorator.
+    """
+    if not _is_processor_class(cls):
+        raise ValueError("'{}' is not a processor.".format(_get_class_path(cls)))
+    _registered_processors[_get_class_path(cls)] = cls
+    return cls
+
+
+def processor_from_dict(data: Dict[str, Any]):
+    """
+    Creates a processor from the description of ``processor_to_dict()``.
+
+    Only the processors of `PROCESSOR_MODULES` and the registered ones
+    (see ``register_processor()``) can be created: the description may come
+    from an untrusted source, and nothing else is imported.
+    """
+    path = data["class"]
+    cls = _registered_processors.get(path)
+    if cls is None:
+        module_name, _, qualname = path.rpartition(".")
+        if not module_name:
+            raise ValueError("Invalid processor class: '{}'.".format(path))
+        if not _is_processor_module(module_name):
+            raise ValueError("'{}' is not a processor.".format(path))
+
+        cls = importlib.import_module(module_name)
+        for name in qualname.split("."):
+            cls = getattr(cls, name, None)
+
+        if not _is_processor_class(cls) or not _is_processor_module(cls.__module__):
+            raise ValueError("'{}' is not a processor.".format(path))
+    return cls(**data.get("params", {}))
+
+
+class ParamsMixin:
+    """
+    Процессор, параметры которого описываются методом ``params()``.
+    """
+
+    def params(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def cache_key(self) -> str:
+        return _make_cache_key(self, self.params())
+
+
+class MakeOpaque(ParamsMixin):
     """
     Подобен pilkit-процессору MakeOpaque, но работает с изображениями
     любого типа, включая RGB, LA и P.
@@ -28,7 +197,10 @@ class MakeOpaque:
     def __init__(self, background_color: Color = "#FFFFFF"):
         if isinstance(background_color, str):
             background_color = ImageColor.getrgb(background_color)
-        self.background_color = background_color[:3]
+        self.background_color = tuple(background_color[:3])
+
+    def params(self):
+        return {"background_color": self.background_color}
 
     def process(self, img):
         has_transparency = img.info.get("transparency") is not None
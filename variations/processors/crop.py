@@ -1,9 +1,11 @@
 from pilkit.processors.crop import SmartCrop, TrimBorderColor
 
+from .base import ParamsMixin
+
 __all__ = ["Crop", "TrimBorderColor", "SmartCrop"]
 
 
-class Crop:
+class Crop(ParamsMixin):
     """
     Crops an image, cropping it to the specified width and height. You may
     optionally provide either an anchor or x and y coordinates. This processor
@@ -19,6 +21,15 @@ class Crop:
         self.x = x
         self.y = y
 
+    def params(self):
+        return {
+            "width": self.width,
+            "height": self.height,
+            "anchor": self.anchor,
+            "x": self.x,
+            "y": self.y,
+        }
+
     def process(self, img):
         original_width, original_height = img.size
         new_width = int(
@@ -0,0 +1,162 @@
+"""
+Cache of detected face locations.
+
+Face detection takes seconds on a large photo, while every AUTO-gravity
+variation of that photo detects the same faces again. The cache stores
+the face locations keyed by a hash of the image content, so the detection
+runs once per image. Images without faces are cached too.
+
+The key is a hash of all the decoded pixels (see `get_image_key()`), read
+in bands, so the image is never copied as a whole. A cache hit costs tens
+of milliseconds on a large photo, much less than the face detection. Cheap
+detectors (`SaliencyDetector`) don't use the default cache at all.
+
+Example:
+```python
+from variations.processors import face_detection
+from variations.processors.face_cache import FaceCache
+
+face_detection.set_default_cache(FaceCache(maxsize=1024, path="faces.sqlite3"))
+```
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from pilkit.lib import Image
+
+from ..typing import FilePath, Rectangle
+
+__all__ = ["KEY_CHUNK_SIZE", "FaceCache", "get_image_key"]
+
+# The approximate number of bytes of pixel data hashed at a time.
+KEY_CHUNK_SIZE = 1024 * 1024
+
+
+def get_image_key(img: Image) -> str:
+    """
+    Returns a hash of the image content: the mode, the size, the palette
+    and all the pixels. The pixels are hashed in bands of rows,
+    so the whole image is never copied.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update("{}:{}x{}:".format(img.mode, *img.size).encode())
+    if img.mode in {"P", "PA"}:
+        digest.update(bytes(img.getpalette() or ()))
+
+    width, height = img.size
+    row_size = max(1, width * len(img.getbands()))
+    rows = max(1, KEY_CHUNK_SIZE // row_size)
+    for y in range(0, height, rows):
+        digest.update(img.crop((0, y, width, min(height, y + rows))).tobytes())
+    return digest.hexdigest()
+
+
+class FaceCache:
+    """
+    An in-memory LRU cache of face locations with an optional
+    on-disk SQLite store.
+
+    Face locations are stored as `(top, right, bottom, left)` tuples.
+
+    Parameters:
+    - `maxsize` (int, optional): Maximum number of images kept in memory.
+    - `path` (path, optional): Path to the SQLite database. If set, the face
+      locations are persisted and shared between processes.
+    """
+
+    def __init__(self, maxsize: int = 1024, path: FilePath = None):
+        if maxsize < 0:
+            raise ValueError("'maxsize' must be a non-negative integer.")
+
+        self.maxsize = maxsize
+        self.path = path
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def __getstate__(self):
+        # Neither the lock nor the connection can be pickled,
+        # so the unpickled cache starts empty and reconnects on demand.
+        return {
+            "maxsize": self.maxsize,
+            "path": self.path,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS faces (key TEXT PRIMARY KEY, faces TEXT NOT NULL)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def _remember(self, key: str, faces: List[Rectangle]):
+        if self.maxsize == 0:
+            return
+
+        self._data[key] = faces
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key: str) -> Optional[List[Rectangle]]:
+        """
+        Returns the face locations for the given key,
+        or ``None`` if the image hasn't been processed yet.
+        """
+        with self._lock:
+            faces = self._data.get(key)
+            if faces is not None:
+                self._data.move_to_end(key)
+                return list(faces)
+
+            if self.path is None:
+                return None
+
+            row = self._get_connection().execute(
+                "SELECT faces FROM faces WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            faces = [tuple(face) for face in json.loads(row[0])]
+            self._remember(key, faces)
+            return list(faces)
+
+    def set(self, key: str, faces: List[Rectangle]):
+        faces = [tuple(int(x) for x in face) for face in faces]
+        with self._lock:
+            self._remember(key, faces)
+
+            if self.path is not None:
+                connection = self._get_connection()
+                connection.execute(
+                    "INSERT OR REPLACE INTO faces (key, faces) VALUES (?, ?)",
+                    (key, json.dumps(faces))
+                )
+                connection.commit()
+
+    def clear(self):
+        """
+        Clears the in-memory cache. The on-disk store is left intact.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -1,22 +1,239 @@
+import contextlib
+import time
+from contextvars import ContextVar
 from fractions import Fraction
-from typing import Optional
+from typing import Iterator, List, Optional, Protocol, runtime_checkable
 
 try:
-    import face_recognition
     import numpy
-    FACE_DETECTION_SUPPORT = True
+except ImportError:
+    numpy = None
+
+try:
+    import face_recognition
+    FACE_DETECTION_SUPPORT = numpy is not None
 except ImportError:
     FACE_DETECTION_SUPPORT = False
 
+from pilkit.lib import Image
+from pilkit.processors.utils import resolve_palette
+
+from .. import timing
 from ..typing import Rectangle
+from .face_cache import FaceCache, get_image_key
+
+__all__ = [
+    "FACE_DETECTION_SUPPORT", "DetectorProtocol", "FaceRecognitionDetector",
+    "SaliencyDetector", "FaceDetectionMixin", "ResizeToFillFace", "CropFace",
+    "get_default_cache", "set_default_cache", "get_default_detector", "set_default_detector",
+    "bypass_cache"
+]
+
+
+@runtime_checkable
+class DetectorProtocol(Protocol):
+    """
+    Детектор областей интереса изображения.
+
+    Метод `detect()` возвращает список прямоугольников
+    `(top, right, bottom, left)` в координатах исходного изображения.
+    Если `expand` истинно, прямоугольники считаются лицами и расширяются
+    до размеров головы.
+
+    Результаты кэшируются по `repr()` детектора, поэтому `repr()`
+    должен включать все параметры, влияющие на результат.
+    Detectors that are cheaper than the cache lookup set `cached`
+    to ``False`` and don't use the default cache.
+    """
+
+    expand: bool
+    cached: bool
+
+    def detect(self, img: Image) -> List[Rectangle]:
+        pass
+
+
+def _get_proxy(img: Image, max_size: Optional[int]) -> Image:
+    """
+    Возвращает уменьшенную черно-белую копию изображения.
+    """
+    from .base import MakeOpaque
+
+    if max_size and max(img.size) > max_size:
+        ratio = max_size / max(img.size)
+        proxy_size = (
+            max(1, round(img.size[0] * ratio)),
+            max(1, round(img.size[1] * ratio))
+        )
+        img = resolve_palette(img).resize(proxy_size, Image.BOX, reducing_gap=2.0)
+
+    return MakeOpaque().process(img).convert("L")
+
+
+def _scale_rects(rects: List[Rectangle], proxy: Image, img: Image) -> List[Rectangle]:
+    """
+    Переводит прямоугольники из координат уменьшенной копии
+    в координаты исходного изображения.
+    """
+    if proxy.size == img.size:
+        return [tuple(int(x) for x in rect) for rect in rects]
+
+    scale_x = img.size[0] / proxy.size[0]
+    scale_y = img.size[1] / proxy.size[1]
+    return [
+        (
+            round(top * scale_y),
+            round(right * scale_x),
+            round(bottom * scale_y),
+            round(left * scale_x),
+        )
+        for top, right, bottom, left in rects
+    ]
+
+
+class FaceRecognitionDetector:
+    """
+    Поиск лиц с помощью `face_recognition` (HOG).
+
+    :param max_size: Faces are detected on a copy of the image reduced
+        to this size along the longest side. ``None`` disables the reduction.
+    """
+
+    expand = True
+    cached = True
+
+    def __init__(self, max_size: Optional[int] = 800):
+        if not FACE_DETECTION_SUPPORT:
+            raise RuntimeError(
+                "Cannot use face detection because 'face_recognition' is not installed."
+            )
+        self.max_size = max_size
+
+    def __repr__(self):
+        return "{}(max_size={!r})".format(self.__class__.__name__, self.max_size)
+
+    def detect(self, img: Image) -> List[Rectangle]:
+        proxy = _get_proxy(img, self.max_size)
+        faces = face_recognition.face_locations(
+            numpy.array(proxy),
+            number_of_times_to_upsample=0,
+        )
+        return _scale_rects(faces, proxy, img)
+
+
+class SaliencyDetector:
+    """
+    Быстрый поиск наиболее детализированной области изображения.
+
+    The image is reduced to a thumbnail, and the density of its edges
+    is computed with numpy. The detected region is the smallest box that
+    holds the central `coverage` share of the edge energy along each axis.
+
+    :param max_size: The size of the thumbnail along the longest side.
+    :param coverage: The share of the edge energy inside the detected region.
+    """
 
-__all__ = ["FACE_DETECTION_SUPPORT", "FaceDetectionMixin", "ResizeToFillFace", "CropFace"]
+    expand = False
+    # Detection on a thumbnail is about as fast as hashing the image.
+    cached = False
+
+    def __init__(self, max_size: int = 128, coverage: float = 0.5):
+        if numpy is None:
+            raise RuntimeError("Cannot use saliency detection because 'numpy' is not installed.")
+
+        if not 0 < coverage <= 1:
+            raise ValueError("'coverage' must be in the range (0, 1].")
+
+        self.max_size = max_size
+        self.coverage = coverage
+
+    def __repr__(self):
+        return "{}(max_size={!r}, coverage={!r})".format(
+            self.__class__.__name__,
+            self.max_size,
+            self.coverage
+        )
+
+    def _get_bounds(self, energy) -> tuple:
+        cumulative = numpy.cumsum(energy)
+        total = cumulative[-1]
+        margin = total * (1 - self.coverage) / 2
+        start = int(numpy.searchsorted(cumulative, margin, side="right"))
+        end = int(numpy.searchsorted(cumulative, total - margin, side="left")) + 1
+        return start, max(end, start + 1)
+
+    def detect(self, img: Image) -> List[Rectangle]:
+        proxy = _get_proxy(img, self.max_size)
+        data = numpy.asarray(proxy, dtype=numpy.float32)
+
+        energy = numpy.zeros_like(data)
+        energy[:, 1:] += numpy.abs(numpy.diff(data, axis=1))
+        energy[1:, :] += numpy.abs(numpy.diff(data, axis=0))
+        if not energy.any():
+            return []
+
+        left, right = self._get_bounds(energy.sum(axis=0))
+        top, bottom = self._get_bounds(energy.sum(axis=1))
+        return _scale_rects([(top, right, bottom, left)], proxy, img)
+
+
+_default_cache: Optional[FaceCache] = FaceCache()
+_default_detector: Optional[DetectorProtocol] = (
+    FaceRecognitionDetector() if FACE_DETECTION_SUPPORT else None
+)
+
+
+def get_default_cache() -> Optional[FaceCache]:
+    return _default_cache
+
+
+def set_default_cache(cache: Optional[FaceCache]):
+    """
+    Sets the cache used by face detection processors
+    that have no cache of their own. ``None`` disables caching.
+    """
+    global _default_cache
+    _default_cache = cache
+
+
+# Whether the caches are bypassed in the current thread or asyncio task.
+_cache_bypassed: ContextVar[bool] = ContextVar("variations_face_cache_bypassed", default=False)
+
+
+@contextlib.contextmanager
+def bypass_cache() -> Iterator[None]:
+    """
+    Disables all face caches (the default one and the caches of the processors)
+    for the current thread (or asyncio task) within the context:
+    the faces are always detected, and nothing is stored.
+    """
+    token = _cache_bypassed.set(True)
+    try:
+        yield
+    finally:
+        _cache_bypassed.reset(token)
+
+
+def get_default_detector() -> Optional[DetectorProtocol]:
+    return _default_detector
+
+
+def set_default_detector(detector: Optional[DetectorProtocol]):
+    """
+    Sets the detector used by face detection processors that have
+    no detector of their own. ``None`` disables the detection, so
+    the processors fall back to `SmartResize` and `SmartCrop`.
+    """
+    global _default_detector
+    _default_detector = detector
 
 
 class FaceDetectionMixin:
     expand_face_top_factor = 0.7
     expand_face_x_factor = 0.5
     expand_face_bottom_factor = 0.5
+    cache = None
+    detector = None
 
     def _expand_face_rect(self, rect: Rectangle) -> Rectangle:
         """
@@ -33,26 +250,58 @@ class FaceDetectionMixin:
         rect[3] -= round(self.expand_face_x_factor * widht)
         return rect[0], rect[1], rect[2], rect[3]
 
+    def _get_detector(self) -> Optional[DetectorProtocol]:
+        return self.detector if self.detector is not None else _default_detector
+
+    def _get_cache_key(self, img, detector: DetectorProtocol) -> str:
+        # The locations depend on the detector settings.
+        return "{!r}:{}".format(detector, get_image_key(img))
+
+    def _get_face_locations(self, img, detector: DetectorProtocol) -> List[Rectangle]:
+        if _cache_bypassed.get():
+            return detector.detect(img)
+
+        cache = self.cache
+        if cache is None and getattr(detector, "cached", True):
+            cache = _default_cache
+        if cache is None:
+            return detector.detect(img)
+
+        key = self._get_cache_key(img, detector)
+        faces = cache.get(key)
+        if faces is None:
+            faces = detector.detect(img)
+            cache.set(key, faces)
+        return faces
+
     def _detect_faces(self, img) -> Optional[Rectangle]:
-        # Image must be 8bit gray or RGB image.
-        if img.mode in ("1", "CMYK", "LA"):
-            image_data = numpy.array(img.convert("RGB"))
-        elif img.mode == "RGBA":
-            from .base import MakeOpaque
-            image_data = numpy.array(MakeOpaque().process(img))
+        detector = self._get_detector()
+        if detector is None:
+            return
+
+        hooks = timing.get_hooks()
+        if hooks:
+            start = time.perf_counter()
+            faces = self._get_face_locations(img, detector)
+            timing.report(
+                hooks,
+                "detect",
+                type(detector).__name__,
+                time.perf_counter() - start,
+                img,
+                regions=len(faces)
+            )
         else:
-            image_data = numpy.array(img)
+            faces = self._get_face_locations(img, detector)
 
-        faces = face_recognition.face_locations(
-            image_data,
-            number_of_times_to_upsample=0,
-        )
         if not faces:
             return
 
-        rect = list(self._expand_face_rect(faces[0]))
-        for face in faces[1:]:
-            top, right, bottom, left = self._expand_face_rect(face)
+        if detector.expand:
+            faces = [self._expand_face_rect(face) for face in faces]
+
+        rect = list(faces[0])
+        for top, right, bottom, left in faces[1:]:
             rect[0] = min(rect[0], top)
             rect[1] = max(rect[1], right)
             rect[2] = max(rect[2], bottom)
@@ -63,25 +312,26 @@ class FaceDetectionMixin:
 
 
 class ResizeToFillFace(FaceDetectionMixin):
-    def __init__(self, width=None, height=None, upscale=True):
+    def __init__(self, width=None, height=None, upscale=True, cache=None, detector=None):
         """
         :param width: The target width, in pixels.
         :param height: The target height, in pixels.
         :param upscale: Should the image be enlarged if smaller than the dimensions?
+        :param cache: A cache of face locations. Defaults to the module-level cache.
+        :param detector: A detector of regions of interest. Defaults to the module-level detector.
 
         """
         self.width = width
         self.height = height
         self.upscale = upscale
+        self.cache = cache
+        self.detector = detector
 
     def process(self, img):
         from .resize import ResizeToFill, SmartResize
 
-        if FACE_DETECTION_SUPPORT:
-            rect = self._detect_faces(img)
-            if not rect:
-                return SmartResize(self.width, self.height, upscale=self.upscale).process(img)
-        else:
+        rect = self._detect_faces(img)
+        if not rect:
             return SmartResize(self.width, self.height, upscale=self.upscale).process(img)
 
         # Рассчет размеров изображения для покрытия (из класса ResizeToCover)
@@ -129,14 +379,18 @@ class ResizeToFillFace(FaceDetectionMixin):
 
 
 class CropFace(FaceDetectionMixin):
-    def __init__(self, width=None, height=None):
+    def __init__(self, width=None, height=None, cache=None, detector=None):
         """
         :param width: The target width, in pixels.
         :param height: The target height, in pixels.
+        :param cache: A cache of face locations. Defaults to the module-level cache.
+        :param detector: A detector of regions of interest. Defaults to the module-level detector.
 
         """
         self.width = width
         self.height = height
+        self.cache = cache
+        self.detector = detector
 
     def process(self, img):
         from .crop import SmartCrop
@@ -153,11 +407,8 @@ class CropFace(FaceDetectionMixin):
             else original_height
         )
 
-        if FACE_DETECTION_SUPPORT:
-            rect = self._detect_faces(img)
-            if not rect:
-                return SmartCrop(new_width, new_height).process(img)
-        else:
+        rect = self._detect_faces(img)
+        if not rect:
             return SmartCrop(new_width, new_height).process(img)
 
         rect_center_coords = (
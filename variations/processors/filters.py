@@ -14,6 +14,8 @@ except ImportError:
     StackBlurFilter = None
     StackBlur = None
 
+from .base import ParamsMixin
+
 __all__ = [
     "Grayscale",
     "GaussianBlur",
@@ -23,31 +25,40 @@ __all__ = [
 ]
 
 
-class Grayscale:
+class Grayscale(ParamsMixin):
+    def params(self):
+        return {}
+
     def process(self, img):
         return img.convert("LA")
 
 
-class GaussianBlur:
+class GaussianBlur(ParamsMixin):
     """
     Can't be applied to 1-bit images.
     """
     def __init__(self, radius=2):
         self.radius = radius
 
+    def params(self):
+        return {"radius": self.radius}
+
     def process(self, img):
         if img.mode == "P":
             img = img.convert()
         return img.filter(ImageFilter.GaussianBlur(self.radius))
 
 
-class BoxBlur:
+class BoxBlur(ParamsMixin):
     """
     Can't be applied to 1-bit images.
     """
     def __init__(self, radius):
         self.radius = radius
 
+    def params(self):
+        return {"radius": self.radius}
+
     def process(self, img):
         if img.mode == "P":
             img = img.convert()
@@ -56,10 +67,13 @@ class BoxBlur:
 
 if STACK_BLUR_SUPPORT:
 
-    class StackBlur:
+    class StackBlur(ParamsMixin):
         def __init__(self, radius):
             self.radius = radius
 
+        def params(self):
+            return {"radius": self.radius}
+
         def process(self, img):
             if img.mode == "1":
                 img = img.convert("L")
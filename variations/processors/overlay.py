@@ -1,11 +1,12 @@
 from pilkit.lib import Image, ImageColor
 
 from ..typing import Color
+from .base import ParamsMixin
 
 __all__ = ["ColorOverlay"]
 
 
-class ColorOverlay:
+class ColorOverlay(ParamsMixin):
     """
     Аналогичен pilkit-процессору ColorOverlay, но корректно работает с RGBA.
 
@@ -16,11 +17,15 @@ class ColorOverlay:
         if isinstance(color, str):
             color = ImageColor.getrgb(color)
 
+        color = tuple(color)
         if len(color) == 3:
             color += (int(overlay_opacity * 255 + 0.5),)
 
         self.color = color
 
+    def params(self):
+        return {"color": self.color}
+
     def process(self, img):
         overlay = Image.new("RGBA", img.size, self.color)
         return Image.alpha_composite(img.convert("RGBA"), overlay)
@@ -1,16 +1,17 @@
 from fractions import Fraction
 
+from pilkit.lib import Image
 from pilkit.processors.resize import (
     AddBorder,
     Resize,
     ResizeCanvas,
     ResizeToCover,
-    ResizeToFill,
     SmartResize,
     Thumbnail,
 )
+from pilkit.processors.utils import resolve_palette
 
-from .base import Anchor
+from .base import Anchor, ParamsMixin
 
 __all__ = [
     "Resize",
@@ -24,7 +25,7 @@ __all__ = [
 ]
 
 
-class ResizeToFit:
+class ResizeToFit(ParamsMixin):
     """
     Resizes an image to fit within the specified dimensions.
 
@@ -56,6 +57,15 @@ class ResizeToFit:
         self.mat_color = mat_color
         self.anchor = anchor
 
+    def params(self):
+        return {
+            "width": self.width,
+            "height": self.height,
+            "upscale": self.upscale,
+            "mat_color": self.mat_color,
+            "anchor": self.anchor,
+        }
+
     def process(self, img):
         original_width, original_height = img.size
         if self.width is not None and self.height is not None:
@@ -103,3 +113,109 @@ class ResizeToFit:
             ).process(img)
 
         return img
+
+
+class ResizeToFill(ParamsMixin):
+    """
+    Resizes an image, cropping it to the exact specified width and height.
+
+    Produces the same result as the pilkit processor, but instead of resizing
+    the whole image and cropping it afterwards, the crop box is computed
+    in the source coordinates and only that region is resampled by a single
+    ``Image.resize()`` call.
+    """
+
+    def __init__(
+        self,
+        width=None,
+        height=None,
+        anchor=None,
+        upscale=True,
+        reducing_gap=None
+    ):
+        """
+        :param width: The target width, in pixels.
+        :param height: The target height, in pixels.
+        :param anchor: Specifies which part of the image should be retained
+            when cropping.
+        :param upscale: Should the image be enlarged if smaller than the dimensions?
+        :param reducing_gap: Optimization parameter of ``Image.resize()``.
+            Speeds up large downscales at the cost of accuracy.
+
+        """
+        self.width = width
+        self.height = height
+        self.anchor = anchor
+        self.upscale = upscale
+        self.reducing_gap = reducing_gap
+
+    def params(self):
+        return {
+            "width": self.width,
+            "height": self.height,
+            "anchor": self.anchor,
+            "upscale": self.upscale,
+            "reducing_gap": self.reducing_gap,
+        }
+
+    def get_crop_box(self, size):
+        """
+        Returns the region of the source image of the given size that
+        is resampled, or ``None`` if the image is cropped without resampling.
+        """
+        original_width, original_height = size
+
+        # Рассчет размеров изображения для покрытия (из класса ResizeToCover)
+        ratio = max(
+            float(self.width) / original_width,
+            float(self.height) / original_height
+        )
+        new_width, new_height = (
+            int(round(original_width * ratio)),
+            int(round(original_height * ratio))
+        )
+        if not (
+            self.upscale
+            or (new_width < original_width and new_height < original_height)
+        ):
+            return None
+
+        # Смещение области обрезки (из класса ResizeCanvas)
+        anchor = Anchor.get_tuple(self.anchor or Anchor.CENTER)
+        left = -int(float(self.width - new_width) * float(anchor[0]))
+        top = -int(float(self.height - new_height) * float(anchor[1]))
+
+        scale_x = original_width / new_width
+        scale_y = original_height / new_height
+        return (
+            left * scale_x,
+            top * scale_y,
+            (left + self.width) * scale_x,
+            (top + self.height) * scale_y,
+        )
+
+    def process(self, img):
+        box = self.get_crop_box(img.size)
+        if box is None:
+            original_width, original_height = img.size
+            return ResizeCanvas(
+                min(original_width, self.width),
+                min(original_height, self.height),
+                anchor=self.anchor
+            ).process(img)
+
+        options = {}
+        if self.reducing_gap is not None:
+            options["reducing_gap"] = self.reducing_gap
+
+        img = resolve_palette(img).resize(
+            (self.width, self.height),
+            Resize.LANCZOS,
+            box=box,
+            **options
+        )
+
+        # Результат всегда в режиме RGBA, как и у pilkit-процессора
+        new_img = Image.new("RGBA", img.size, (255, 255, 255, 0))
+        new_img.paste(img, (0, 0))
+        return new_img
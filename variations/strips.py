@@ -0,0 +1,458 @@
+"""
+Processing of very large images in horizontal strips.
+
+The source is resampled strip by strip. Each strip of the output is computed
+from a window of source rows that includes the support of the resampling
+filter, so the result matches a single ``Image.resize()`` call.
+
+Sources stored without compression (TIFF strips and tiles, BMP, PPM, ...)
+are decoded band by band directly from the file, so only a window of rows
+is held in memory at a time. Other formats (JPEG, PNG, compressed TIFF)
+can't be decoded partially: they are decoded once (JPEG with
+``Image.draft()``), but the full-size intermediate copies of the regular
+pipeline (palette conversion, alpha premultiplication) are still avoided.
+
+The bands are decoded with the public ``Image.frombytes()``, but the layout
+of the source and the file are private loader state of Pillow (``img.tile``,
+``img.fp``). It is read only by `_get_raw_tiles()` and only for the versions
+in `PILLOW_VERSIONS`; with other versions the source is decoded entirely.
+If reading it fails, the image is processed by ``variation.process()``.
+
+The result matches ``process()`` up to rounding: ±1 per channel, compared
+in premultiplied colors for images with alpha (the unpremultiplied colors
+of nearly transparent pixels may differ more). Bilevel images are resampled
+by ``process()``, because the nearest neighbour can't be applied in strips.
+
+Example:
+```python
+from variations import Variation
+
+variation = Variation(size=(1600, 1200), mode=Variation.Mode.FIT)
+with Image.open("scan.tif") as img:
+    new_img = variation.process_in_strips(img)
+```
+"""
+
+import logging
+import math
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+import PIL
+from pilkit.lib import Image
+from pilkit.processors.resize import Resize
+from pilkit.processors.utils import resolve_palette
+
+from . import processors, utils
+from .typing import Size
+
+__all__ = [
+    "DEFAULT_STRIP_HEIGHT",
+    "StripReader",
+    "can_decode_in_strips",
+    "is_supported",
+    "resize_in_strips",
+    "process",
+]
+
+logger = logging.getLogger("variations")
+
+# The number of source rows resampled at a time.
+DEFAULT_STRIP_HEIGHT = 512
+
+# Support of the resampling filters, in pixels of the source at scale 1.
+FILTER_SUPPORT = {
+    Image.NEAREST: 0.0,
+    Image.BOX: 0.5,
+    Image.BILINEAR: 1.0,
+    Image.HAMMING: 1.0,
+    Image.BICUBIC: 2.0,
+    Image.LANCZOS: 3.0,
+}
+
+# Bits per pixel of raw modes, for raw data without an explicit stride.
+RAW_MODE_BITS = {
+    "1": 1, "1;I": 1,
+    "L": 8, "P": 8,
+    "LA": 16, "I;16": 16, "I;16L": 16, "I;16B": 16,
+    "RGB": 24, "BGR": 24,
+    "RGBA": 32, "RGBX": 32, "BGRA": 32, "BGRX": 32, "CMYK": 32, "I": 32, "F": 32,
+}
+
+# Versions of Pillow whose loader state (`tile`, `fp`) has been verified.
+# Other versions decode the source entirely.
+PILLOW_VERSIONS = ((9, 1), (12, 99))
+
+
+class RawTile(NamedTuple):
+    extents: Tuple[int, int, int, int]
+    offset: int
+    rawmode: str
+    stride: int
+    ystep: int
+
+
+Band = Tuple[int, int, List[RawTile]]
+
+
+def _get_pillow_version() -> Tuple[int, int]:
+    major, minor = re.match(r"(\d+)\.(\d+)", PIL.__version__).groups()
+    return int(major), int(minor)
+
+
+def _get_raw_tiles(img: Image) -> Optional[List[RawTile]]:
+    """
+    Returns the raw tiles of a source that isn't loaded yet, with explicit strides,
+    or ``None`` if the data isn't stored uncompressed. This is the only function
+    that reads the loader state of Pillow.
+    """
+    if not PILLOW_VERSIONS[0] <= _get_pillow_version() <= PILLOW_VERSIONS[1]:
+        return None
+
+    if (
+        not getattr(img, "tile", None)
+        or getattr(img, "fp", None) is None
+        or hasattr(img, "load_read")
+        or hasattr(img, "load_seek")
+        or getattr(img, "tile_prefix", b"")
+    ):
+        return None
+
+    tiles = []
+    for name, extents, offset, args in img.tile:
+        if name != "raw" or extents is None:
+            return None
+        if isinstance(args, str):
+            args = (args,)
+        # Arguments of the raw decoder: rawmode, stride = 0, ystep = 1
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        ystep = args[2] if len(args) > 2 else 1
+        if not stride:
+            bits = RAW_MODE_BITS.get(rawmode)
+            if bits is None:
+                return None
+            stride = (bits * (extents[2] - extents[0]) + 7) // 8
+        tiles.append(RawTile(tuple(extents), offset, rawmode, stride, ystep))
+    return tiles
+
+
+def _split_raw_tile(tile: RawTile, size: Size, strip_height: int) -> List[Band]:
+    """
+    Splits a raw tile that covers the whole image into bands of rows.
+    """
+    width, height = size
+    bands = []
+    for y0 in range(0, height, strip_height):
+        y1 = min(height, y0 + strip_height)
+        if tile.ystep < 0:
+            # Bottom-up rows (BMP)
+            band_offset = tile.offset + (height - y1) * tile.stride
+        else:
+            band_offset = tile.offset + y0 * tile.stride
+        band_tile = tile._replace(extents=(0, 0, width, y1 - y0), offset=band_offset)
+        bands.append((y0, y1, [band_tile]))
+    return bands
+
+
+def _group_tiles(
+    tiles: List[RawTile],
+    size: Size,
+    strip_height: int
+) -> Optional[List[Band]]:
+    """
+    Groups independent tiles (TIFF strips and tiles) into bands of rows.
+    Returns ``None`` if the tiles don't form bands.
+    """
+    rows = {}
+    for tile in tiles:
+        x0, y0, x1, y1 = tile.extents
+        rows.setdefault((y0, y1), []).append(tile)
+
+    bands = []
+    expected_y0 = 0
+    for (y0, y1), row_tiles in sorted(rows.items()):
+        if y0 != expected_y0:
+            return None
+        expected_y0 = y1
+        if bands and bands[-1][1] - bands[-1][0] < strip_height:
+            band_y0, _, band_tiles = bands[-1]
+        else:
+            band_y0, band_tiles = y0, []
+            bands.append(None)
+        for tile in row_tiles:
+            x0, _, x1, _ = tile.extents
+            band_tiles.append(tile._replace(extents=(x0, y0 - band_y0, x1, y1 - band_y0)))
+        bands[-1] = (band_y0, y1, band_tiles)
+
+    if expected_y0 != size[1]:
+        return None
+    return bands
+
+
+def _get_bands(img: Image, strip_height: int) -> Optional[List[Band]]:
+    tiles = _get_raw_tiles(img)
+    if tiles is None:
+        return None
+
+    if len(tiles) == 1 and tiles[0].extents == (0, 0) + img.size:
+        return _split_raw_tile(tiles[0], img.size, strip_height)
+    return _group_tiles(tiles, img.size, strip_height)
+
+
+def _new_image(img: Image, size: Size) -> Image:
+    """
+    Returns a blank image with the mode, palette and info of `img`.
+    """
+    new_img = Image.new(img.mode, size)
+    palette = img.palette
+    if img.mode in {"P", "PA"} and palette is not None:
+        # The palette of a source that isn't loaded yet is raw data.
+        new_img.putpalette(palette.palette, palette.rawmode or palette.mode)
+    new_img.info = img.info.copy()
+    return new_img
+
+
+def can_decode_in_strips(img: Image) -> bool:
+    """
+    Whether the (not loaded) image can be decoded band by band.
+    """
+    return _get_bands(img, DEFAULT_STRIP_HEIGHT) is not None
+
+
+class StripReader:
+    """
+    Provides windows of rows of a source image. Rows are requested
+    from the top to the bottom, windows may overlap.
+
+    If the image isn't loaded yet and its data is stored uncompressed,
+    bands of rows are decoded from the file on demand and dropped as soon
+    as they are above the requested window. Otherwise the image is loaded.
+
+    `peak_rows` is the maximum number of decoded rows held at once.
+    """
+
+    def __init__(self, img: Image, strip_height: int = DEFAULT_STRIP_HEIGHT):
+        self.img = img
+        self.size = img.size
+        self.peak_rows = 0
+        self._bands = _get_bands(img, strip_height)
+        self._next_band = 0
+        self._decoded = []    # (y0, y1, image)
+        if self._bands is None:
+            img.load()
+            self.peak_rows = img.size[1]
+
+    @property
+    def streaming(self) -> bool:
+        return self._bands is not None
+
+    def _decode_band(self, y0: int, y1: int, tiles: List[RawTile]) -> Image:
+        img = self.img
+        band = _new_image(img, (img.size[0], y1 - y0))
+        for tile in sorted(tiles, key=lambda tile: tile.offset):
+            x0, tile_y0, x1, tile_y1 = tile.extents
+            width, height = x1 - x0, tile_y1 - tile_y0
+            size = tile.stride * height
+            img.fp.seek(tile.offset)
+            data = img.fp.read(size)
+            if len(data) < size - tile.stride + 1:
+                raise OSError("image file is truncated")
+            # The padding of the last row may be missing.
+            data = data.ljust(size, b"\0")
+            part = Image.frombytes(
+                img.mode, (width, height), data, "raw", tile.rawmode, tile.stride, tile.ystep
+            )
+            band.paste(part, (x0, tile_y0))
+        return band
+
+    def get_rows(self, y0: int, y1: int) -> Image:
+        """
+        Returns the rows from `y0` to `y1` (exclusive) as a separate image.
+        """
+        width = self.size[0]
+        if self._bands is None:
+            return self.img.crop((0, y0, width, y1))
+
+        # Bands above the window are no longer needed.
+        self._decoded = [band for band in self._decoded if band[1] > y0]
+        while (
+            (not self._decoded or self._decoded[-1][1] < y1)
+            and self._next_band < len(self._bands)
+        ):
+            band_y0, band_y1, tiles = self._bands[self._next_band]
+            self._next_band += 1
+            if band_y1 > y0:
+                band = self._decode_band(band_y0, band_y1, tiles)
+                self._decoded.append((band_y0, band_y1, band))
+
+        if self._decoded:
+            rows = self._decoded[-1][1] - self._decoded[0][0]
+            self.peak_rows = max(self.peak_rows, rows)
+
+        window = None
+        for band_y0, band_y1, band in self._decoded:
+            top, bottom = max(y0, band_y0), min(y1, band_y1)
+            if top >= bottom:
+                continue
+            part = band.crop((0, top - band_y0, width, bottom - band_y0))
+            if top == y0 and bottom == y1:
+                return part
+            if window is None:
+                window = _new_image(band, (width, y1 - y0))
+            window.paste(part, (0, top - y0))
+        return window
+
+
+def resize_in_strips(
+    reader: StripReader,
+    size: Size,
+    box: Optional[Tuple[float, float, float, float]] = None,
+    resample: int = Image.LANCZOS,
+    strip_height: int = DEFAULT_STRIP_HEIGHT
+) -> Image:
+    """
+    Same as ``resolve_palette(img).resize(size, resample, box=box)``,
+    but the source is read in windows of about `strip_height` rows.
+
+    The nearest neighbour (also used by Pillow for bilevel images) picks
+    source rows by rounding, which can't be reproduced for a shifted box,
+    so it resamples all rows at once.
+    """
+    source_width, source_height = reader.size
+    width, height = size
+    box = tuple(box) if box is not None else (0, 0, source_width, source_height)
+    left, top, right, bottom = box
+    scale = (bottom - top) / height
+
+    if resample == Image.NEAREST or reader.img.mode == "1":
+        window = resolve_palette(reader.get_rows(0, source_height))
+        return window.resize(size, resample, box=box)
+
+    support = FILTER_SUPPORT.get(resample, 3.0) * max(scale, 1.0)
+    margin = math.ceil(support) + 1
+    rows_per_strip = max(1, int(strip_height / scale))
+
+    def source_y(output_y):
+        if output_y == height:
+            return bottom
+        return top + (bottom - top) * output_y / height
+
+    new_img = None
+    for output_y0 in range(0, height, rows_per_strip):
+        output_y1 = min(height, output_y0 + rows_per_strip)
+        y0, y1 = source_y(output_y0), source_y(output_y1)
+        window_y0 = max(0, math.floor(y0) - margin)
+        window_y1 = min(source_height, math.ceil(y1) + margin)
+
+        window = resolve_palette(reader.get_rows(window_y0, window_y1))
+        part = window.resize(
+            (width, output_y1 - output_y0),
+            resample,
+            box=(left, y0 - window_y0, right, min(y1 - window_y0, window_y1 - window_y0))
+        )
+        if new_img is None:
+            new_img = Image.new(part.mode, size)
+            new_img.info = part.info.copy()
+        new_img.paste(part, (0, output_y0))
+    return new_img
+
+
+def _crop_in_strips(
+    reader: StripReader,
+    box: Tuple[int, int, int, int],
+    strip_height: int
+) -> Image:
+    left, top, right, bottom = box
+    new_img = None
+    for y0 in range(top, bottom, strip_height):
+        y1 = min(bottom, y0 + strip_height)
+        part = reader.get_rows(y0, y1).crop((left, 0, right, y1 - y0))
+        if new_img is None:
+            new_img = _new_image(part, (right - left, bottom - top))
+        new_img.paste(part, (0, y0 - top))
+    return new_img
+
+
+def is_supported(variation, img: Image) -> bool:
+    """
+    Whether ``process()`` reads the source in strips rather than falling
+    back to ``variation.process()``.
+    """
+    return not (
+        variation.legacy_mode
+        or variation.preprocessors
+        or variation.gravity is variation.Gravity.AUTO
+        or utils.get_exif_orientation(img) not in {None, 1}
+    )
+
+
+def process(variation, img: Image, strip_height: Optional[int] = None) -> Image:
+    """
+    Processes the image like ``variation.process()``, reading the source
+    in strips (see ``Variation.process_in_strips()``).
+    """
+    if not is_supported(variation, img):
+        return variation.process(img)
+
+    strip_height = strip_height or DEFAULT_STRIP_HEIGHT
+    draft_size = variation.get_draft_size(img.size)
+    if draft_size is not None:
+        img.draft(img.mode, draft_size)
+
+    plan = variation.plan(img.size)
+    if plan.is_identity:
+        return variation.process(img)
+
+    if plan.resized and img.mode == "1":
+        # Bilevel images are resampled by the nearest neighbour (see resize_in_strips()).
+        return variation.process(img)
+
+    try:
+        new_img = _process_geometry(variation, img, plan, strip_height)
+    except Exception:
+        # Reading of the loader state of Pillow is version-dependent.
+        logger.warning("Cannot process %r in strips, falling back to process().", img, exc_info=True)
+        return variation.process(img)
+
+    if new_img is None:
+        return variation.process(img)
+    if plan.resized:
+        return variation.get_pipeline().process(new_img)
+    return processors.ProcessorPipeline(variation.postprocessors).process(new_img)
+
+
+def _process_geometry(variation, img: Image, plan, strip_height: int) -> Optional[Image]:
+    """
+    Resamples or crops the source in strips. The result is passed to the main
+    processor (when resampled) or to the postprocessors (when cropped).
+    Returns ``None`` if the geometry can't be applied in strips.
+    """
+    pipeline = variation.get_pipeline()
+    if plan.resized:
+        box = None
+        size = plan.resize_size
+        if variation.mode is variation.Mode.FILL and variation.width and variation.height:
+            # ResizeToFill resamples only the visible region.
+            box = pipeline[0].get_crop_box(img.size)
+            size = variation.size
+
+        # The resampled image has the geometry of the output of the main
+        # processor, so the processor only completes it (e.g. adds the background).
+        reader = StripReader(img, strip_height)
+        return resize_in_strips(reader, size, box, Resize.LANCZOS, strip_height)
+
+    # FILL and CROP without resampling crop the source: only the visible rows are read.
+    crop_box = plan.crop_box
+    if (
+        variation.mode is variation.Mode.FIT
+        or crop_box[2] <= crop_box[0]
+        or crop_box[3] <= crop_box[1]
+    ):
+        return None
+
+    reader = StripReader(img, strip_height)
+    region = _crop_in_strips(reader, crop_box, strip_height)
+    canvas = Image.new("RGBA", plan.canvas_size, (255, 255, 255, 0))
+    canvas.paste(region, (max(0, plan.offset[0]), max(0, plan.offset[1])))
+    return canvas
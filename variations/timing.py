@@ -0,0 +1,167 @@
+"""
+Per-stage timing of image processing.
+
+Hooks are callables that receive a `StageTiming` for every stage
+of ``Variation.process()``, ``Variation.save()`` and ``ProcessorPipeline``:
+
+- ``decode``: ``Image.draft()`` and decoding of the source
+- ``exif``: application of the Exif orientation
+- ``processor``: a single processor (`name` is its class name)
+- ``convert``: the mode conversion before saving
+- ``encode``: encoding (`name` is the format, `bytes_written` is the size)
+- ``detect``: face or saliency detection (`name` is the detector class,
+  `regions` is the number of detected regions)
+
+When no hook is installed, the only overhead is a check of an empty tuple.
+
+Example:
+```python
+from variations import timing
+
+with timing.collect() as timings:
+    img = variation.process(source)
+    variation.save(img, "dest.jpg")
+
+for t in timings:
+    print(t.stage, t.name, t.seconds, t.input_size, t.output_size)
+```
+"""
+
+import contextlib
+import logging
+from contextvars import ContextVar
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from pilkit.lib import Image
+
+from .typing import Size
+
+__all__ = [
+    "StageTiming",
+    "add_hook",
+    "remove_hook",
+    "hook",
+    "collect",
+    "get_hooks",
+    "report",
+]
+
+logger = logging.getLogger("variations")
+
+
+class StageTiming(NamedTuple):
+    stage: str
+    name: str
+    seconds: float
+    input_size: Optional[Size]
+    input_mode: Optional[str]
+    output_size: Optional[Size]
+    output_mode: Optional[str]
+    bytes_written: Optional[int] = None
+    regions: Optional[int] = None
+
+
+Hook = Callable[[StageTiming], None]
+
+# Hooks installed for the whole process.
+_global_hooks: Tuple[Hook, ...] = ()
+
+# Hooks installed for the current thread or asyncio task.
+_context_hooks: ContextVar[Tuple[Hook, ...]] = ContextVar("variations_timing_hooks", default=())
+
+
+def add_hook(callback: Hook):
+    """
+    Installs a hook for all threads.
+    """
+    global _global_hooks
+    _global_hooks = _global_hooks + (callback,)
+
+
+def remove_hook(callback: Hook):
+    global _global_hooks
+    hooks = list(_global_hooks)
+    hooks.remove(callback)
+    _global_hooks = tuple(hooks)
+
+
+@contextlib.contextmanager
+def hook(callback: Hook) -> Iterator[Hook]:
+    """
+    Installs a hook for the current thread (or asyncio task)
+    within the context.
+    """
+    token = _context_hooks.set(_context_hooks.get() + (callback,))
+    try:
+        yield callback
+    finally:
+        _context_hooks.reset(token)
+
+
+@contextlib.contextmanager
+def collect() -> Iterator[List[StageTiming]]:
+    """
+    Collects the timings of the current thread within the context.
+    """
+    timings = []
+    with hook(timings.append):
+        yield timings
+
+
+def get_hooks() -> Tuple[Hook, ...]:
+    """
+    Returns the installed hooks. Callers check the result before
+    measuring anything, so that there is no overhead without hooks.
+    """
+    context_hooks = _context_hooks.get()
+    if not context_hooks:
+        return _global_hooks
+    return _global_hooks + context_hooks
+
+
+ImageInfo = Union["Image.Image", Tuple[Size, str], None]
+
+
+def _describe(img: ImageInfo) -> Tuple[Optional[Size], Optional[str]]:
+    if img is None:
+        return None, None
+    if isinstance(img, tuple):
+        return img
+    return img.size, img.mode
+
+
+def report(
+    hooks: Tuple[Hook, ...],
+    stage: str,
+    name: str,
+    seconds: float,
+    input_img: ImageInfo = None,
+    output_img: ImageInfo = None,
+    bytes_written: Optional[int] = None,
+    regions: Optional[int] = None
+):
+    """
+    Passes the timing of a stage to the hooks.
+    Errors of the hooks are logged and don't affect the processing.
+
+    :param input_img: The input image, or a tuple of its size and mode.
+    :param output_img: The output image, or a tuple of its size and mode.
+    """
+    input_size, input_mode = _describe(input_img)
+    output_size, output_mode = _describe(output_img)
+    timing = StageTiming(
+        stage=stage,
+        name=name,
+        seconds=seconds,
+        input_size=input_size,
+        input_mode=input_mode,
+        output_size=output_size,
+        output_mode=output_mode,
+        bytes_written=bytes_written,
+        regions=regions,
+    )
+    for callback in hooks:
+        try:
+            callback(timing)
+        except Exception:
+            logger.exception("Timing hook %r has failed.", callback)
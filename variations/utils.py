@@ -1,13 +1,16 @@
+import errno
+import io
 import os
+import time
 import warnings
 from pathlib import Path
-from typing import Optional
+from typing import IO, Optional
 
 from pilkit.exceptions import UnknownExtension
 from pilkit.lib import Image
 from pilkit.utils import extension_to_format, format_to_extension
 
-from . import conf
+from . import aio, conf, timing
 from .processors import MakeOpaque, Transpose
 from .typing import Color, FilePath, FilePointer, Size
 
@@ -61,15 +64,22 @@ def replace_extension(path: FilePath, format: str = None) -> FilePath:
         return path
 
 
-def apply_exif_orientation(img: Image) -> Image:
+def get_exif_orientation(img: Image) -> Optional[int]:
     """
-    Applies the Exif orientation to the given image.
+    Returns the Exif orientation of the given image, if any.
     """
     exif = img.getexif()
     if not exif:
-        return img
+        return None
+
+    return exif.get(0x0112)
+
 
-    orientation = exif.get(0x0112)
+def apply_exif_orientation(img: Image) -> Image:
+    """
+    Applies the Exif orientation to the given image.
+    """
+    orientation = get_exif_orientation(img)
     if orientation is None:
         return img
 
@@ -80,6 +90,38 @@ def apply_exif_orientation(img: Image) -> Image:
     return img
 
 
+def draft_and_orient(img: Image, draft_size: Optional[Size] = None) -> Image:
+    """
+    Configures the decoder to the draft size (see ``Image.draft()``)
+    and applies the Exif orientation.
+    """
+    hooks = timing.get_hooks()
+    if not hooks:
+        if draft_size is not None:
+            img.draft(img.mode, draft_size)
+        return apply_exif_orientation(img)
+
+    source_size, source_mode = img.size, img.mode
+    start = time.perf_counter()
+    if draft_size is not None:
+        img.draft(img.mode, draft_size)
+    # Decoding is timed separately from the following stages.
+    img.load()
+    timing.report(
+        hooks,
+        "decode",
+        img.format or "",
+        time.perf_counter() - start,
+        (source_size, source_mode),
+        img
+    )
+
+    start = time.perf_counter()
+    new_img = apply_exif_orientation(img)
+    timing.report(hooks, "exif", "", time.perf_counter() - start, img, new_img)
+    return new_img
+
+
 def make_opaque(img: Image, color: Color = "#FFFFFF") -> Image:
     """
     Замена RGB-составляющей полностью прозрачных пикселей на указанный цвет.
@@ -127,41 +169,172 @@ def prepare_image(
     return img
 
 
-def save_image(img: Image, fp: FilePointer, format: str = None, **options):
+def get_encoding_options(format: str, profile: Optional[str] = None) -> dict:
     """
-    Wraps PIL's ``Image.save()`` method.
+    Returns the default encoder options of the profile for the given format.
     """
-    format = (
-        format
-        or guess_format(fp)
-        or conf.MODE_TO_FORMAT[img.mode]
-    ).upper()
+    profile = profile or conf.DEFAULT_ENCODING_PROFILE
+    try:
+        presets = conf.ENCODING_PROFILES[profile]
+    except KeyError:
+        raise ValueError(
+            "Unknown encoding profile: '{}'. Must be one of {}.".format(
+                profile,
+                ", ".join(conf.ENCODING_PROFILES)
+            )
+        )
+    return dict(presets.get(format.upper(), {}))
+
 
+def _get_conversion(img: Image, format: str) -> Optional[str]:
+    """
+    Returns the conversion needed to save the image in the given format.
+    """
     if img.mode == "LA":
         if format in conf.RGBA_TRANSPARENCY_FORMATS:
             pass
         elif format in conf.PALETTE_TRANSPARENCY_FORMATS:
             # При сохранении LA в GIF теряются все цвета.
             # При конвертации в PA - тоже.
-            img = img.convert("RGBA")
+            return "RGBA"
         else:
             # LA нельзя сохранить в формат, не поддерживающий прозрачность.
-            img = MakeOpaque().process(img)
+            return "opaque"
     elif img.mode in {"P", "PA"}:
         transparency = img.info.get("transparency")
         if format == "GIF" and isinstance(transparency, bytes):
-            img = img.convert("RGBA")
+            return "RGBA"
         elif format not in conf.TRANSPARENCY_FORMATS:
             if transparency is None:
-                img = img.convert("RGB")
+                return "RGB"
             else:
-                img = MakeOpaque().process(img)
+                return "opaque"
     elif img.mode == "RGBA":
         if format not in conf.TRANSPARENCY_FORMATS:
-            img = MakeOpaque().process(img)
+            return "opaque"
+    return None
+
+
+def convert_for_format(img: Image, format: str, cache: Optional[dict] = None) -> Image:
+    """
+    Converts the image to a mode that can be saved in the given format.
+
+    :param cache: A dictionary to share the converted images between calls
+                  for the same source image and different formats.
+    """
+    conversion = _get_conversion(img, format.upper())
+    if conversion is None:
+        return img
 
-    # Enable optimization by default
-    if format in {"JPEG", "PNG"}:
-        options.setdefault("optimize", True)
+    if cache is not None and conversion in cache:
+        return cache[conversion]
 
+    if conversion == "opaque":
+        new_img = MakeOpaque().process(img)
+    else:
+        new_img = img.convert(conversion)
+
+    if cache is not None:
+        cache[conversion] = new_img
+    return new_img
+
+
+def save_image(
+    img: Image,
+    fp: FilePointer,
+    format: str = None,
+    profile: Optional[str] = None,
+    **options
+):
+    """
+    Wraps PIL's ``Image.save()`` method.
+
+    :param profile: The name of the encoding profile (see ``conf.ENCODING_PROFILES``).
+                    Explicit options take precedence over the profile.
+    """
+    format = (
+        format
+        or guess_format(fp)
+        or conf.MODE_TO_FORMAT[img.mode]
+    ).upper()
+
+    for key, value in get_encoding_options(format, profile).items():
+        options.setdefault(key, value)
+
+    hooks = timing.get_hooks()
+    if hooks:
+        _save_image_timed(img, fp, format, options, hooks)
+        return
+
+    img = convert_for_format(img, format)
     img.save(fp, format=format, **options)
+
+
+def _save_image_timed(img: Image, fp: FilePointer, format: str, options: dict, hooks):
+    start = time.perf_counter()
+    new_img = convert_for_format(img, format)
+    timing.report(hooks, "convert", format, time.perf_counter() - start, img, new_img)
+
+    is_path = isinstance(fp, (str, os.PathLike))
+    position = None if is_path else _tell(fp)
+
+    start = time.perf_counter()
+    new_img.save(fp, format=format, **options)
+    seconds = time.perf_counter() - start
+
+    if is_path:
+        bytes_written = os.path.getsize(fp)
+    else:
+        end = _tell(fp)
+        bytes_written = end - position if end is not None and position is not None else None
+    timing.report(hooks, "encode", format, seconds, new_img, None, bytes_written)
+
+
+def _tell(fp) -> Optional[int]:
+    try:
+        return fp.tell()
+    except (AttributeError, OSError):
+        return None
+
+
+def write_chunked(data, fp: IO, chunk_size: int = 64 * 1024) -> int:
+    """
+    Writes the data to a writable object in chunks, without copying it.
+    Partial writes are retried. Writers that return ``None`` (e.g. Django's
+    ``HttpResponse``) are considered to have written the whole chunk.
+
+    Raises ``BlockingIOError`` if a non-blocking raw stream (``io.RawIOBase``)
+    can't write anything (returns ``None``); its ``characters_written`` is
+    the number of bytes written so far.
+
+    Returns the number of bytes written.
+    """
+    view = memoryview(data).cast("B")
+    total = len(view)
+    raw = isinstance(fp, io.RawIOBase)
+    pos = 0
+    while pos < total:
+        chunk = view[pos:pos + chunk_size]
+        written = fp.write(chunk)
+        if written is None:
+            if raw:
+                raise BlockingIOError(errno.EAGAIN, "The stream is not ready for writing", pos)
+            written = len(chunk)
+        elif written == 0:
+            raise BlockingIOError(errno.EAGAIN, "The stream is not ready for writing", pos)
+        pos += written
+    return total
+
+
+async def asave_image(
+    img: Image,
+    fp: FilePointer,
+    format: str = None,
+    profile: Optional[str] = None,
+    **options
+):
+    """
+    Awaitable counterpart of ``save_image()``.
+    The image is saved in the executor configured by ``variations.aio``.
+    """
+    await aio.run(save_image, img, fp, format, profile, **options)
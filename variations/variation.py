@@ -1,18 +1,27 @@
 import copy
+import hashlib
+import io
+import json
 import logging
+import math
+import threading
 import warnings
 from collections.abc import Collection, Mapping, Set
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from fractions import Fraction
 from itertools import chain
 from numbers import Real
-from typing import Any, Dict, Iterable, Union
+from typing import IO, Any, Dict, Iterable, List, Optional, Tuple, Union
 
 from PIL import ImageColor
 from pilkit.exceptions import UnknownFormat
 from pilkit.lib import Image
 from pilkit.utils import format_to_extension
 
-from . import conf, processors, utils
+from . import aio, conf, passthrough, processors, strips, utils
+from . import plan as plan_utils
+from .plan import VariationPlan, VariationPlanArray
 from .scaler import Scaler
 from .typing import (
     Color,
@@ -40,6 +49,8 @@ class Variation:
     - `format` (str, optional): The desired output image format.
     - `preprocessors` (iterable, optional): Iterable of processors to apply before the main processing.
     - `postprocessors` (iterable, optional): Iterable of processors to apply after the main processing.
+    - `detector` (optional): The detector of regions of interest for the 'auto' gravity
+      (e.g. `face_detection.SaliencyDetector()`). Defaults to the module-level detector.
     - `**kwargs`: Additional options.
 
     Methods:
@@ -91,6 +102,17 @@ class Variation:
 
     logger = logging.getLogger("variations")
 
+    # Maximum number of source sizes to keep legacy pipelines for.
+    LEGACY_PIPELINE_CACHE_SIZE = 32
+
+    # The source is drafted to at least this many times the resampled size,
+    # so that the final resize is still done by a high-quality filter.
+    DRAFT_REDUCING_GAP = 2
+
+    # Guards the cached pipelines when a variation is shared between threads.
+    # Class-level, so that variations remain copyable and picklable.
+    _pipeline_lock = threading.RLock()
+
     def __init__(
         self,
         size: Size = NOT_SET,
@@ -107,8 +129,10 @@ class Variation:
         format: str = None,
         preprocessors: Iterable[ProcessorProtocol] = None,
         postprocessors: Iterable[ProcessorProtocol] = None,
+        detector: Any = None,
         **kwargs
     ):
+        self._invalidate_pipeline()
         self.legacy_mode = NOT_SET
 
         if size is NOT_SET:
@@ -206,8 +230,12 @@ class Variation:
         self.format = format
         self.preprocessors = preprocessors
         self.postprocessors = postprocessors
+        self.detector = detector
         self.options = kwargs
 
+        if detector is not None and (self.legacy_mode or self.gravity is not self.Gravity.AUTO):
+            self.logger.warning("'detector' makes sense only when 'gravity' is set to 'AUTO'")
+
         # check face_recognition installed
         if self._face_detection:
             try:
@@ -218,8 +246,10 @@ class Variation:
                 )
 
     def __getattr__(self, item):
-        if item in self._options:
-            return self._options[item]
+        # `_options` may not be set yet, for example during unpickling.
+        options = self.__dict__.get("_options", {})
+        if item in options:
+            return options[item]
 
         raise AttributeError(
             f"'{self.__class__.__name__}' object has no attribute '{item}'"
@@ -247,6 +277,7 @@ class Variation:
         if not all(x >= 0 for x in formatted_value):
             raise ValueError(error_msg)
 
+        self._invalidate_pipeline()
         self._size = formatted_value
 
     @property
@@ -255,6 +286,8 @@ class Variation:
 
     @mode.setter
     def mode(self, value: Union[Mode, str]):
+        self._invalidate_pipeline()
+
         if isinstance(value, self.Mode):
             self._mode = value
             return
@@ -296,6 +329,7 @@ class Variation:
             raise TypeError(error_msg)
 
         if value is self.Gravity.AUTO:
+            self._invalidate_pipeline()
             self._gravity = value
             return
 
@@ -315,6 +349,7 @@ class Variation:
         if not all(0 <= x <= 1 for x in value):
             raise ValueError(error_msg)
 
+        self._invalidate_pipeline()
         self._gravity = value
 
     @property
@@ -330,6 +365,7 @@ class Variation:
         )
 
         if value is None:
+            self._invalidate_pipeline()
             self._background = value
             return
 
@@ -346,6 +382,7 @@ class Variation:
         ):
             raise TypeError(error_msg)
 
+        value = tuple(value)
         if len(value) == 3:
             value += (255, )
 
@@ -355,8 +392,25 @@ class Variation:
         if not all(0 <= x <= 255 for x in value):
             raise ValueError(error_msg)
 
+        self._invalidate_pipeline()
         self._background = value
 
+    @property
+    def detector(self) -> Any:
+        """
+        Детектор для `Gravity.AUTO` (см. ``processors.face_detection.DetectorProtocol``).
+        ``None`` means the default detector (see ``face_detection.set_default_detector()``).
+        """
+        return self._detector
+
+    @detector.setter
+    def detector(self, value: Any):
+        if value is not None and not callable(getattr(value, "detect", None)):
+            raise TypeError("Invalid value for 'detector'. It must have a 'detect()' method.")
+
+        self._invalidate_pipeline()
+        self._detector = value
+
     @property
     def clip(self) -> bool:
         return self._clip
@@ -373,6 +427,7 @@ class Variation:
                 "The 'clip' attribute must be a boolean value."
             )
 
+        self._invalidate_pipeline()
         self._clip = value
 
     @property
@@ -386,6 +441,7 @@ class Variation:
                 "The 'upscale' attribute must be a boolean value."
             )
 
+        self._invalidate_pipeline()
         self._upscale = value
 
     @property
@@ -416,6 +472,7 @@ class Variation:
         if value and self.width:
             self.logger.warning("'max_width' makes sense only when 'width' is 0")
 
+        self._invalidate_pipeline()
         self._max_width = value
 
     @property
@@ -446,6 +503,7 @@ class Variation:
         if value and self.height:
             self.logger.warning("`max_height` makes sense only when 'height' is 0")
 
+        self._invalidate_pipeline()
         self._max_height = value
 
     @property
@@ -487,6 +545,7 @@ class Variation:
         if not all(0 <= x <= 1 for x in value):
             raise ValueError(error_msg)
 
+        self._invalidate_pipeline()
         self._anchor = value
 
     @property
@@ -510,6 +569,7 @@ class Variation:
                 "The 'face_detection' attribute must be a boolean value."
             )
 
+        self._invalidate_pipeline()
         self._face_detection = value
 
     @property
@@ -554,6 +614,7 @@ class Variation:
                 "the 'ProcessorProtocol' and provide a 'process' method."
             )
 
+        self._invalidate_pipeline()
         self._preprocessors = tuple(value)
 
     @property
@@ -574,6 +635,7 @@ class Variation:
                 "the 'ProcessorProtocol' and provide a 'process' method."
             )
 
+        self._invalidate_pipeline()
         self._postprocessors = tuple(value)
 
     @property
@@ -584,7 +646,15 @@ class Variation:
     def options(self, value: Dict[str, Any]):
         if not isinstance(value, dict):
             raise TypeError(value)
-        self._options = {k.lower(): v for k, v in value.items()}
+
+        value = {k.lower(): v for k, v in value.items()}
+        profile = value.get("profile")
+        if profile is not None and profile not in conf.ENCODING_PROFILES:
+            raise ValueError(
+                f"Invalid encoding profile: '{profile}'. "
+                f"Must be one of {', '.join(conf.ENCODING_PROFILES)}."
+            )
+        self._options = value
 
     @property
     def width(self) -> Dimension:
@@ -594,11 +664,101 @@ class Variation:
     def height(self) -> Dimension:
         return self._size[1]
 
+    def _invalidate_pipeline(self):
+        """
+        Drops the cached pipelines. Called whenever a parameter
+        that affects the processing is changed.
+        """
+        self._pipeline = None
+        self._legacy_pipelines = {}
+
     def copy(self):
         obj = type(self).__new__(type(self))
         obj.__dict__ = copy.deepcopy(self.__dict__)
         return obj
 
+    def _get_params(self) -> Dict[str, Any]:
+        if self.legacy_mode:
+            params = {
+                "size": self.size,
+                "clip": self._clip,
+                "max_width": self._max_width,
+                "max_height": self._max_height,
+                "anchor": self._anchor,
+                "face_detection": self._face_detection,
+                "upscale": self.upscale,
+            }
+        else:
+            gravity = self.gravity
+            params = {
+                "size": self.size,
+                "mode": self.mode.value,
+                "gravity": gravity.value if gravity is self.Gravity.AUTO else gravity,
+                "upscale": self.upscale,
+                "background": self.background,
+            }
+
+        params["format"] = self.format
+        params["options"] = copy.deepcopy(self.options)
+        return params
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns a description of the variation that can be pickled,
+        serialized to JSON and passed to ``from_dict()``.
+
+        Processors are described by their class and the constructor
+        arguments (see ``processors.get_params()``).
+        """
+        data = self._get_params()
+        data["preprocessors"] = [processors.processor_to_dict(p) for p in self.preprocessors]
+        data["postprocessors"] = [processors.processor_to_dict(p) for p in self.postprocessors]
+        if self.detector is not None:
+            data["detector"] = processors.processor_to_dict(self.detector)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Variation":
+        """
+        Creates a variation from the description returned by ``to_dict()``.
+        """
+        params = dict(data)
+        options = params.pop("options", None) or {}
+        params["preprocessors"] = [
+            processors.processor_from_dict(p)
+            for p in params.pop("preprocessors", None) or ()
+        ]
+        params["postprocessors"] = [
+            processors.processor_from_dict(p)
+            for p in params.pop("postprocessors", None) or ()
+        ]
+        if params.get("detector") is not None:
+            params["detector"] = processors.processor_from_dict(params["detector"])
+
+        if params.get("background", NOT_SET) is None:
+            del params["background"]
+
+        if "clip" in params:
+            # Legacy parameters are deprecated, but they are still valid.
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", DeprecationWarning)
+                return cls(**params, **options)
+        return cls(**params, **options)
+
+    def fingerprint(self) -> str:
+        """
+        Returns a stable hash of all the parameters that affect the output
+        of the variation. Equal variations have equal fingerprints.
+        """
+        data = self._get_params()
+        data["preprocessors"] = [processors.get_cache_key(p) for p in self.preprocessors]
+        data["postprocessors"] = [processors.get_cache_key(p) for p in self.postprocessors]
+        if self.detector is not None:
+            data["detector"] = processors.get_cache_key(self.detector)
+
+        encoded = json.dumps(data, sort_keys=True, separators=(",", ":"), default=repr)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
     def get_output_size(self, source_size: Size) -> Size:  # noqa
         """
         Вычисление финальных размеров холста по размерам исходного изображения.
@@ -655,7 +815,7 @@ class Variation:
         canvas_size = self.get_output_size(size)
         if self.clip:
             if self.face_detection:
-                from processors.face_detection import ResizeToFillFace
+                from .processors.face_detection import ResizeToFillFace
                 proc = ResizeToFillFace(
                     width=canvas_size[0],
                     height=canvas_size[1],
@@ -694,12 +854,13 @@ class Variation:
             ]
 
         if self.gravity is self.Gravity.AUTO:
-            from processors.face_detection import ResizeToFillFace
+            from .processors.face_detection import ResizeToFillFace
             return [
                 ResizeToFillFace(
                     self.width or None,
                     self.height or None,
-                    upscale=self.upscale
+                    upscale=self.upscale,
+                    detector=self.detector
                 )
             ]
         else:
@@ -725,11 +886,12 @@ class Variation:
 
     def _get_crop_processors(self) -> Iterable[ProcessorProtocol]:
         if self.gravity is self.Gravity.AUTO:
-            from processors.face_detection import CropFace
+            from .processors.face_detection import CropFace
             return [
                 CropFace(
                     self.width or None,
                     self.height or None,
+                    detector=self.detector
                 )
             ]
         else:
@@ -742,6 +904,19 @@ class Variation:
             ]
 
     def get_pipeline(self) -> processors.ProcessorPipeline:
+        """
+        Returns the processors of the variation. The processors are built once
+        and cached until one of the variation parameters is changed.
+        """
+        pipeline = self._pipeline
+        if pipeline is None:
+            with self._pipeline_lock:
+                if self._pipeline is None:
+                    self._pipeline = tuple(self._build_pipeline())
+                pipeline = self._pipeline
+        return processors.ProcessorPipeline(pipeline)
+
+    def _build_pipeline(self) -> Iterable[ProcessorProtocol]:
         pipeline = list(self.preprocessors)
 
         if self.mode is self.Mode.NONE or self.size == (0, 0):
@@ -754,20 +929,288 @@ class Variation:
             pipeline.extend(self._get_crop_processors())
 
         pipeline.extend(self.postprocessors)
+        return pipeline
+
+    def _get_legacy_pipeline(self, size: Size) -> processors.ProcessorPipeline:
+        """
+        Cached version of ``get_processor()``.
+        """
+        size = tuple(size)
+        with self._pipeline_lock:
+            pipeline = self._legacy_pipelines.get(size)
+            if pipeline is None:
+                if len(self._legacy_pipelines) >= self.LEGACY_PIPELINE_CACHE_SIZE:
+                    # Drop the oldest entry
+                    del self._legacy_pipelines[next(iter(self._legacy_pipelines))]
+
+                pipeline = self._legacy_pipelines[size] = tuple(self.get_processor(size))
+
         return processors.ProcessorPipeline(pipeline)
 
+    def get_draft_size(self, source_size: Size, orientation: int = None) -> Optional[Size]:
+        """
+        Returns the size that should be passed to ``Image.draft()``
+        for a source image of the given size. This is the size the source
+        would be resampled to, multiplied by ``DRAFT_REDUCING_GAP``.
+        ``None`` means that the image must be decoded at full resolution.
+
+        :param source_size: The size of the stored (not rotated) image.
+        :param orientation: The Exif orientation of the image.
+        """
+        if (
+            self.legacy_mode
+            or self.mode in {self.Mode.NONE, self.Mode.CROP}
+            or self.size == (0, 0)
+        ):
+            return None
+
+        # Orientations 5-8 swap the image dimensions.
+        transposed = orientation in {5, 6, 7, 8}
+        width, height = source_size
+        if transposed:
+            width, height = height, width
+
+        if self.width and self.height:
+            if self.mode is self.Mode.FILL:
+                ratio = max(self.width / width, self.height / height)
+            else:
+                ratio = min(self.width / width, self.height / height)
+        elif self.width:
+            ratio = self.width / width
+        else:
+            ratio = self.height / height
+
+        ratio *= self.DRAFT_REDUCING_GAP
+        if ratio >= 1:
+            return None
+
+        draft_size = (math.ceil(width * ratio), math.ceil(height * ratio))
+        if transposed:
+            draft_size = draft_size[::-1]
+        return draft_size
+
+    def plan(self, source_size: Size, orientation: int = None) -> VariationPlan:
+        """
+        Returns the geometry of the variation for a source image of the given
+        size without touching any pixels. The result matches the processors
+        returned by ``get_pipeline()``.
+
+        :param source_size: The size of the stored (not rotated) image.
+        :param orientation: The Exif orientation of the image.
+        """
+        if self.legacy_mode:
+            raise ValueError("Cannot plan a legacy variation.")
+
+        width, height = source_size
+        if orientation in {5, 6, 7, 8}:
+            width, height = height, width
+        source_size = (width, height)
+
+        if self.mode is self.Mode.NONE or self.size == (0, 0):
+            return VariationPlan(source_size, source_size, source_size, (0, 0))
+        elif self.mode is self.Mode.FILL:
+            return self._plan_fill(source_size)
+        elif self.mode is self.Mode.FIT:
+            return self._plan_fit(source_size)
+        else:
+            return self._plan_crop(source_size)
+
+    def plan_many(self, widths, heights, orientations=None) -> VariationPlanArray:
+        """
+        Vectorized counterpart of ``plan()`` for many source images.
+        Requires NumPy. The results are identical to the ones of ``plan()``.
+
+        :param widths: Array of widths of the stored (not rotated) images.
+        :param heights: Array of heights of the stored (not rotated) images.
+        :param orientations: Array of Exif orientations of the images.
+        """
+        numpy = plan_utils.numpy
+        if numpy is None:
+            raise RuntimeError("Cannot plan many images because 'numpy' is not installed.")
+
+        if self.legacy_mode:
+            raise ValueError("Cannot plan a legacy variation.")
+
+        source_size = numpy.stack([
+            numpy.asarray(widths, dtype=numpy.int64),
+            numpy.asarray(heights, dtype=numpy.int64),
+        ], axis=1)
+        if orientations is not None:
+            transposed = numpy.isin(numpy.asarray(orientations), [5, 6, 7, 8])
+            source_size = numpy.where(transposed[:, None], source_size[:, ::-1], source_size)
+
+        zero_offset = numpy.zeros_like(source_size)
+        if self.mode is self.Mode.NONE or self.size == (0, 0):
+            return VariationPlanArray(source_size, source_size, source_size, zero_offset)
+
+        if self.mode is self.Mode.CROP:
+            canvas_size = source_size.copy()
+            if self.width:
+                canvas_size[:, 0] = numpy.minimum(canvas_size[:, 0], self.width)
+            if self.height:
+                canvas_size[:, 1] = numpy.minimum(canvas_size[:, 1], self.height)
+            offset = (
+                None if self.gravity is self.Gravity.AUTO
+                else plan_utils.offsets(canvas_size, source_size, self.gravity)
+            )
+            return VariationPlanArray(source_size, source_size, canvas_size, offset)
+
+        if self.mode is self.Mode.FILL and self.width and self.height:
+            new_size = plan_utils.cover_sizes(source_size, self.width, self.height)
+            resize_size = plan_utils.resize_sizes(source_size, new_size, self.upscale)
+            resized = (resize_size != source_size).any(axis=1)
+            canvas_size = numpy.where(
+                resized[:, None],
+                numpy.array([self.width, self.height]),
+                numpy.minimum(source_size, [self.width, self.height])
+            )
+            offset = (
+                None if self.gravity is self.Gravity.AUTO
+                else plan_utils.offsets(canvas_size, resize_size, self.gravity)
+            )
+            return VariationPlanArray(source_size, resize_size, canvas_size, offset)
+
+        new_size = plan_utils.fit_sizes(source_size, self.width, self.height)
+        resize_size = plan_utils.resize_sizes(source_size, new_size, self.upscale)
+        if self.mode is self.Mode.FILL or self.background is None:
+            return VariationPlanArray(source_size, resize_size, resize_size, zero_offset)
+
+        canvas_size = new_size if self.upscale else numpy.minimum(source_size, new_size)
+        canvas_size = canvas_size.copy()
+        if self.width:
+            canvas_size[:, 0] = self.width
+        if self.height:
+            canvas_size[:, 1] = self.height
+        offset = plan_utils.offsets(canvas_size, resize_size, self.gravity)
+        return VariationPlanArray(source_size, resize_size, canvas_size, offset)
+
+    @staticmethod
+    def _get_offset(canvas_size: Size, size: Size, anchor: GravityTuple) -> Tuple[int, int]:
+        # Смещение изображения на холсте (из класса ResizeCanvas)
+        return (
+            int(float(canvas_size[0] - size[0]) * float(anchor[0])),
+            int(float(canvas_size[1] - size[1]) * float(anchor[1])),
+        )
+
+    def _get_fit_size(self, source_size: Size) -> Size:
+        # Рассчет размеров изображения (из класса ResizeToFit)
+        original_width, original_height = source_size
+        if self.width and self.height:
+            ratio = min(
+                Fraction(self.width, original_width),
+                Fraction(self.height, original_height)
+            )
+        elif self.width:
+            ratio = Fraction(self.width, original_width)
+        else:
+            ratio = Fraction(self.height, original_height)
+
+        return (
+            round(original_width * ratio),
+            round(original_height * ratio)
+        )
+
+    def _get_resize_size(self, source_size: Size, new_size: Size) -> Size:
+        # Изображение не увеличивается без upscale (из класса Resize)
+        if self.upscale or (new_size[0] < source_size[0] and new_size[1] < source_size[1]):
+            return tuple(new_size)
+        return source_size
+
+    def _plan_fill(self, source_size: Size) -> VariationPlan:
+        if not self.width or not self.height:
+            resize_size = self._get_resize_size(source_size, self._get_fit_size(source_size))
+            return VariationPlan(source_size, resize_size, resize_size, (0, 0))
+
+        original_width, original_height = source_size
+
+        # Рассчет размеров изображения для покрытия (из класса ResizeToCover)
+        ratio = max(
+            float(self.width) / original_width,
+            float(self.height) / original_height
+        )
+        new_width, new_height = (
+            int(round(original_width * ratio)),
+            int(round(original_height * ratio))
+        )
+        resize_size = self._get_resize_size(source_size, (new_width, new_height))
+        if resize_size != source_size:
+            canvas_size = (self.width, self.height)
+        else:
+            canvas_size = (
+                min(original_width, self.width),
+                min(original_height, self.height)
+            )
+
+        if self.gravity is self.Gravity.AUTO:
+            offset = None
+        else:
+            offset = self._get_offset(canvas_size, resize_size, self.gravity)
+
+        return VariationPlan(source_size, resize_size, canvas_size, offset)
+
+    def _plan_fit(self, source_size: Size) -> VariationPlan:
+        new_width, new_height = self._get_fit_size(source_size)
+        resize_size = self._get_resize_size(source_size, (new_width, new_height))
+        if self.background is None:
+            return VariationPlan(source_size, resize_size, resize_size, (0, 0))
+
+        original_width, original_height = source_size
+        canvas_size = (
+            self.width or (new_width if self.upscale else min(original_width, new_width)),
+            self.height or (new_height if self.upscale else min(original_height, new_height)),
+        )
+        offset = self._get_offset(canvas_size, resize_size, self.gravity)
+        return VariationPlan(source_size, resize_size, canvas_size, offset)
+
+    def _plan_crop(self, source_size: Size) -> VariationPlan:
+        original_width, original_height = source_size
+        canvas_size = (
+            min(original_width, self.width) if self.width else original_width,
+            min(original_height, self.height) if self.height else original_height,
+        )
+
+        if self.gravity is self.Gravity.AUTO:
+            offset = None
+        else:
+            offset = self._get_offset(canvas_size, source_size, self.gravity)
+
+        return VariationPlan(source_size, source_size, canvas_size, offset)
+
     def process(self, img: Image) -> Image:
         """
         Обработка изображения в соответствии с вариацией.
         """
         if self.legacy_mode:
-            return self.get_processor(img.size).process(img)
+            return self._get_legacy_pipeline(img.size).process(img)
         else:
-            if self.width and self.height:
-                img.draft(img.mode, self.size)
-            img = utils.apply_exif_orientation(img)
+            draft_size = self.get_draft_size(img.size, utils.get_exif_orientation(img))
+            img = utils.draft_and_orient(img, draft_size)
             return self.get_pipeline().process(img)
 
+    async def aprocess(self, img: Image) -> Image:
+        """
+        Awaitable counterpart of ``process()``.
+        The image is processed in the executor configured by ``variations.aio``.
+        """
+        return await aio.run(self.process, img)
+
+    def process_in_strips(self, img: Image, strip_height: Optional[int] = None) -> Image:
+        """
+        Processes a very large image with bounded memory. The source is read
+        and resampled in strips of about `strip_height` rows, and only the
+        output is processed as a whole (see ``variations.strips``).
+
+        Uncompressed sources (TIFF, BMP, PPM) are never decoded entirely.
+        Variations with preprocessors or ``Gravity.AUTO``, legacy variations
+        and sources with an Exif orientation are processed by ``process()``.
+
+        Bilevel images are resampled by ``process()``. Otherwise the result
+        matches ``process()`` up to rounding: ±1 per channel, compared in
+        premultiplied colors for images with alpha (the colors of nearly
+        transparent pixels may differ more).
+        """
+        return strips.process(self, img, strip_height)
+
     def output_format(self, path: FilePath) -> str:
         """
         Определение итогового формата изображения.
@@ -789,6 +1232,78 @@ class Variation:
         )
         return utils.replace_extension(path, self.format)
 
+    def get_output_format(self, img: Image, fp: FilePointer = None, format=None) -> str:
+        """
+        Returns the format the image would be saved in by ``save()``.
+        """
+        return (
+            format
+            or self.format
+            or (utils.guess_format(fp) if fp is not None else None)
+            or conf.MODE_TO_FORMAT[img.mode]
+        ).upper()
+
+    def is_passthrough(self, img: Image, format=None, strip_metadata: bool = False) -> bool:
+        """
+        Whether the source file of the image can be copied to the destination
+        as is: the variation doesn't change the image, the output format
+        is the format of the source and no encoder options are set for it.
+
+        :param img: The source image. It doesn't have to be loaded.
+        :param format: The output format. Defaults to the format of the source.
+        :param strip_metadata: Whether the metadata must be removed from the copy.
+        """
+        if self.legacy_mode or self.preprocessors or self.postprocessors:
+            return False
+
+        if img.format is None:
+            return False
+
+        output_format = (format or self.format or img.format).upper()
+        if output_format != img.format or self.options.get(output_format.lower()):
+            return False
+
+        if strip_metadata and output_format not in passthrough.STRIP_METADATA_FORMATS:
+            return False
+
+        if utils.get_exif_orientation(img) not in {None, 1}:
+            return False
+
+        return self.plan(img.size).is_identity
+
+    def process_file(
+        self,
+        source: FilePointer,
+        fp: FilePointer,
+        format=None,
+        strip_metadata: bool = False
+    ) -> bool:
+        """
+        Processes the source file and saves the result. If the variation doesn't
+        change the image, the source file is copied without decoding.
+
+        Returns ``True`` if the source file has been copied.
+
+        :param source: A filename, pathlib.Path object, or file object.
+        :param fp: A filename, pathlib.Path object, or file object.
+        :param format: The format to use for saving (optional).
+        :param strip_metadata: Remove Exif, XMP and comments from the copied file.
+        """
+        with Image.open(source) as img:
+            output_format = self.get_output_format(img, fp, format)
+            if self.is_passthrough(img, output_format, strip_metadata=strip_metadata):
+                passthrough.copy_file(
+                    source,
+                    fp,
+                    strip_metadata=strip_metadata,
+                    format=output_format
+                )
+                return True
+
+            new_img = self.process(img)
+            self.save(new_img, fp, output_format)
+            return False
+
     def save(self, img: Image, fp: FilePointer, format=None, **options):
         """
         Saves this image under the given filename. If no format is
@@ -800,20 +1315,139 @@ class Variation:
         :param format: The format to use for saving (optional).
         :param options: Additional options for saving the image.
         """
-        opts = options.copy()
+        final_format = self.get_output_format(img, fp, format)
+        opts = self._get_save_options(final_format, options)
+        utils.save_image(img, fp, final_format, **opts)
 
-        final_format = (
-            format
-            or self.format
-            or utils.guess_format(fp)
-            or conf.MODE_TO_FORMAT[img.mode]
-        ).upper()
+    def _get_save_options(self, format: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        opts = options.copy()
 
         # Transfer additional parameters specific
         # to a particular image format from the variation.
         format_options = {}
-        format_options.update(self.options.get(final_format.lower(), {}))
+        format_options.update(self.options.get(format.lower(), {}))
         for k, v in format_options.items():
             opts.setdefault(k, v)
 
-        utils.save_image(img, fp, final_format, **opts)
+        # The encoding profile can be set for all formats at once.
+        if "profile" in self.options:
+            opts.setdefault("profile", self.options["profile"])
+
+        return opts
+
+    def save_many(
+        self,
+        img: Image,
+        targets: Iterable[Union[FilePointer, Tuple[FilePointer, Optional[str]]]],
+        max_workers: Optional[int] = None,
+        **options
+    ) -> List[str]:
+        """
+        Saves the image to several files (usually in different formats)
+        at once. Pillow encoders release the GIL, so the files are encoded
+        in parallel on a thread pool. Mode conversions shared by several
+        formats are performed only once.
+
+        Returns the list of the formats the files have been saved in.
+
+        :param img: The image to save.
+        :param targets: Filenames, pathlib.Path objects or file objects,
+                        or tuples of a file and a format.
+        :param max_workers: The maximum number of threads. Defaults to
+                            the number of targets.
+        :param options: Additional options for saving the image.
+        """
+        jobs = []
+        conversions = {}
+        img.load()
+        for target in targets:
+            if isinstance(target, tuple):
+                fp, format = target
+            else:
+                fp, format = target, None
+
+            final_format = self.get_output_format(img, fp, format)
+            prepared = utils.convert_for_format(img, final_format, cache=conversions)
+            opts = self._get_save_options(final_format, options)
+            jobs.append((prepared, fp, final_format, opts))
+
+        if len(jobs) <= 1 or max_workers == 1:
+            for prepared, fp, final_format, opts in jobs:
+                utils.save_image(prepared, fp, final_format, **opts)
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers or len(jobs)) as executor:
+                futures = [
+                    executor.submit(utils.save_image, prepared, fp, final_format, **opts)
+                    for prepared, fp, final_format, opts in jobs
+                ]
+
+            # Всё сохранено (или упало) - пробрасываем первую ошибку.
+            for future in futures:
+                future.result()
+
+        return [final_format for _, _, final_format, _ in jobs]
+
+    def encode(
+        self,
+        img: Image,
+        format=None,
+        buffer: Optional[io.BytesIO] = None,
+        **options
+    ) -> memoryview:
+        """
+        Encodes the image in memory and returns a memoryview over the encoded data.
+
+        The view refers to the internal memory of `buffer`, so the data isn't copied.
+        A buffer can be reused for the next image once the previous view has been
+        released (``view.release()``); otherwise a new buffer is created.
+
+        :param img: The image to encode.
+        :param format: The format to use (optional).
+        :param buffer: A ``BytesIO`` object to encode into (optional).
+        :param options: Additional options for saving the image.
+        """
+        final_format = self.get_output_format(img, format=format)
+        if buffer is None:
+            buffer = io.BytesIO()
+        else:
+            try:
+                buffer.seek(0)
+                buffer.truncate()
+            except BufferError:
+                # A view of the previous data is still held.
+                buffer = io.BytesIO()
+
+        self.save(img, buffer, final_format, **options)
+        return buffer.getbuffer()
+
+    def encode_to(
+        self,
+        img: Image,
+        fp: IO,
+        format=None,
+        chunk_size: int = 64 * 1024,
+        **options
+    ) -> int:
+        """
+        Encodes the image and writes the result to any writable object
+        (e.g. a socket file or an HTTP response) in chunks of `chunk_size`.
+        The object doesn't have to be seekable.
+
+        Returns the number of bytes written.
+        """
+        with self.encode(img, format, **options) as view:
+            return utils.write_chunked(view, fp, chunk_size)
+
+    async def aencode(self, img: Image, format=None, **options) -> memoryview:
+        """
+        Awaitable counterpart of ``encode()``.
+        The image is encoded in the executor configured by ``variations.aio``.
+        """
+        return await aio.run(self.encode, img, format, **options)
+
+    async def asave(self, img: Image, fp: FilePointer, format=None, **options):
+        """
+        Awaitable counterpart of ``save()``.
+        The image is saved in the executor configured by ``variations.aio``.
+        """
+        await aio.run(self.save, img, fp, format, **options)
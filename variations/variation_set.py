@@ -0,0 +1,355 @@
+from collections.abc import Hashable, Iterable, Iterator, Mapping
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from pilkit.lib import Image
+from pilkit.processors.utils import resolve_palette
+
+from . import processors, utils
+from .typing import Size
+from .variation import Variation
+
+
+class _ResizeGeometry(NamedTuple):
+    fill: bool                                  # crop the result to the exact size
+    box: Tuple[float, float, float, float]      # source region to resample
+    size: Size                                  # size of the resampled region
+
+
+def _is_cascadable(variation: Variation) -> bool:
+    """
+    Whether the main processor of the variation is a plain resampling
+    of a source region, so it can be derived from a larger intermediate.
+    """
+    if variation.legacy_mode or variation.size == (0, 0):
+        return False
+
+    if variation.mode is Variation.Mode.FILL:
+        return (
+            not (variation.width and variation.height)
+            or variation.gravity is not Variation.Gravity.AUTO
+        )
+    elif variation.mode is Variation.Mode.FIT:
+        return variation.background is None
+
+    return False
+
+
+def _get_resize_geometry(
+    variation: Variation,
+    source_size: Size
+) -> Optional[_ResizeGeometry]:
+    """
+    Returns the source region and the output size of the main processor.
+    Returns ``None`` if the source won't be resampled.
+    """
+    plan = variation.plan(source_size)
+    if not plan.resized:
+        return None
+
+    # Map the visible region of the resized image to the source coordinates.
+    x, y = plan.offset
+    (width, height), (new_width, new_height) = source_size, plan.resize_size
+    box = (
+        -x * width / new_width,
+        -y * height / new_height,
+        (plan.canvas_size[0] - x) * width / new_width,
+        (plan.canvas_size[1] - y) * height / new_height,
+    )
+    return _ResizeGeometry(
+        fill=bool(variation.mode is Variation.Mode.FILL and variation.width and variation.height),
+        box=box,
+        size=plan.canvas_size
+    )
+
+
+def _get_resolution(geometry: _ResizeGeometry) -> Tuple[float, float]:
+    """
+    Number of output pixels per source pixel along each axis.
+    """
+    box = geometry.box
+    return (
+        geometry.size[0] / (box[2] - box[0]),
+        geometry.size[1] / (box[3] - box[1]),
+    )
+
+
+def _contains(outer: Sequence[float], inner: Sequence[float]) -> bool:
+    eps = 1e-6
+    return (
+        outer[0] <= inner[0] + eps
+        and outer[1] <= inner[1] + eps
+        and outer[2] >= inner[2] - eps
+        and outer[3] >= inner[3] - eps
+    )
+
+
+class VariationSet(Mapping):
+    """
+    A named group of variations that are rendered from the same source image.
+
+    The source image is drafted to the largest size required by any of
+    the variations and rotated according to its EXIF orientation only once.
+    Then every variation's pipeline is fed from that shared base image.
+
+    A variation that would draft the source to a smaller scale on its own
+    is resampled from more pixels, so its result is not identical to
+    ``Variation.process()`` (for JPEG, about 1 on average per channel,
+    up to about 20 at sharp edges). The results of variations that need
+    the same draft scale are identical.
+
+    Parameters:
+    - `variations` (mapping or iterable): Variations of the set. When an iterable
+      is given, the variations are keyed by their index.
+    - `cascade` (bool, optional): Derive smaller outputs from the nearest larger
+      intermediate instead of resampling the full-size source. Defaults to False.
+    - `cascade_ratio` (float, optional): Quality guard for the cascade. An intermediate
+      is used only if its resolution is at least `cascade_ratio` times the resolution
+      of the derived output. Defaults to 2.
+
+    Example:
+    ```python
+    from PIL import Image
+    from variations import Variation, VariationSet
+
+    variations = VariationSet({
+        "desktop": Variation(size=(1920, 1080)),
+        "tablet": Variation(size=(1024, 768)),
+        "mobile": Variation(size=(640, 480)),
+    })
+
+    img = Image.open("source.jpg")
+    for name, new_img in variations.process(img).items():
+        variations[name].save(new_img, f"{name}.jpg")
+    ```
+    """
+
+    def __init__(
+        self,
+        variations: Union[Mapping[Hashable, Variation], Iterable[Variation]],
+        *,
+        cascade: bool = False,
+        cascade_ratio: float = 2,
+    ):
+        if isinstance(variations, Mapping):
+            items = dict(variations)
+        else:
+            items = dict(enumerate(variations))
+
+        if not all(isinstance(v, Variation) for v in items.values()):
+            raise TypeError(
+                "Each item of a 'VariationSet' must be an instance of 'Variation'."
+            )
+
+        if cascade_ratio < 1:
+            raise ValueError("'cascade_ratio' must be greater than or equal to 1.")
+
+        self._variations = items
+        self.cascade = bool(cascade)
+        self.cascade_ratio = cascade_ratio
+
+    def __getitem__(self, key: Hashable) -> Variation:
+        return self._variations[key]
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self._variations)
+
+    def __len__(self) -> int:
+        return len(self._variations)
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, list(self._variations))
+
+    def get_draft_size(
+        self,
+        source_size: Size,
+        orientation: int = None,
+        keys: Iterable[Hashable] = None
+    ) -> Optional[Size]:
+        """
+        Returns the smallest size that satisfies the draft requirements
+        of every variation in the set. ``None`` means that the image
+        must be decoded at full resolution.
+        """
+        if keys is None:
+            keys = self._variations.keys()
+
+        draft_sizes = []
+        for key in keys:
+            variation = self._variations[key]
+            if variation.legacy_mode:
+                return None
+
+            draft_size = variation.get_draft_size(source_size, orientation)
+            if draft_size is None:
+                return None
+
+            draft_sizes.append(draft_size)
+
+        if not draft_sizes:
+            return None
+
+        return (
+            max(size[0] for size in draft_sizes),
+            max(size[1] for size in draft_sizes),
+        )
+
+    def get_cascade_plan(
+        self,
+        source_size: Size,
+        keys: Iterable[Hashable] = None
+    ) -> List[Tuple[Hashable, Optional[Hashable]]]:
+        """
+        Orders the variations from the largest to the smallest one and picks
+        for each of them the nearest larger intermediate it can be derived from.
+
+        Returns a list of `(key, parent_key)` pairs in processing order.
+        `parent_key` is ``None`` when the variation must be rendered from
+        the source image. Variations that cannot take part in the cascade
+        are not included.
+
+        The geometry is computed for the image passed to the main processor,
+        so `source_size` must take the preprocessors into account.
+        """
+        if keys is None:
+            keys = self._variations.keys()
+
+        geometries = {}
+        for key in keys:
+            variation = self._variations[key]
+            if _is_cascadable(variation):
+                geometry = _get_resize_geometry(variation, source_size)
+                if geometry is not None:
+                    geometries[key] = geometry
+
+        ordered = sorted(
+            geometries,
+            key=lambda k: _get_resolution(geometries[k]),
+            reverse=True
+        )
+
+        plan = []
+        for index, key in enumerate(ordered):
+            geometry = geometries[key]
+            resolution = _get_resolution(geometry)
+
+            parent = None
+            for candidate in reversed(ordered[:index] if self.cascade else ()):
+                candidate_geometry = geometries[candidate]
+
+                # Crop results can't be an intermediate for plain resizes,
+                # because the image mode of the output would change.
+                if candidate_geometry.fill and not geometry.fill:
+                    continue
+
+                if not _contains(candidate_geometry.box, geometry.box):
+                    continue
+
+                candidate_resolution = _get_resolution(candidate_geometry)
+                if (
+                    candidate_resolution[0] >= resolution[0] * self.cascade_ratio
+                    and candidate_resolution[1] >= resolution[1] * self.cascade_ratio
+                ):
+                    parent = candidate
+                    break
+
+            plan.append((key, parent))
+
+        return plan
+
+    def prepare(self, img: Image, keys: Iterable[Hashable] = None) -> Image:
+        """
+        Drafts and orients the source image once for the whole set.
+        """
+        draft_size = self.get_draft_size(img.size, utils.get_exif_orientation(img), keys)
+        return utils.draft_and_orient(img, draft_size)
+
+    def process(self, img: Image, keys: Iterable[Hashable] = None) -> Dict[Hashable, Image]:
+        """
+        Processes the image with every variation of the set, or only with
+        the variations of the given keys. Returns a dictionary of processed
+        images with the same keys.
+        """
+        if keys is None:
+            keys = list(self._variations)
+        else:
+            selected = set(keys)
+            keys = [key for key in self._variations if key in selected]
+
+        results = {}
+        groups = {}
+        base = None
+        for key in keys:
+            variation = self._variations[key]
+            if variation.legacy_mode:
+                # Legacy variations neither draft nor orient the source.
+                results[key] = variation.process(img)
+                continue
+
+            if base is None:
+                base = self.prepare(img, keys)
+
+            if self.cascade and _is_cascadable(variation):
+                # Variations with the same preprocessors share the intermediates.
+                group_key = tuple(id(p) for p in variation.preprocessors)
+                groups.setdefault(group_key, []).append(key)
+            else:
+                results[key] = variation.get_pipeline().process(base)
+
+        for group in groups.values():
+            results.update(self._process_cascade(base, group))
+
+        return {key: results[key] for key in keys}
+
+    def _process_cascade(
+        self,
+        img: Image,
+        keys: List[Hashable]
+    ) -> Dict[Hashable, Image]:
+        preprocessors = self._variations[keys[0]].preprocessors
+        source = processors.ProcessorPipeline(preprocessors).process(img)
+        source_box = (0, 0, source.size[0], source.size[1])
+
+        results = {}
+        intermediates = {}
+        for key, parent in self.get_cascade_plan(source.size, keys):
+            variation = self._variations[key]
+            geometry = _get_resize_geometry(variation, source.size)
+
+            if parent is None:
+                parent_img, parent_box = source, source_box
+            else:
+                parent_img, parent_box = intermediates[parent]
+
+            # Map the source region to the coordinates of the parent image.
+            scale_x = parent_img.size[0] / (parent_box[2] - parent_box[0])
+            scale_y = parent_img.size[1] / (parent_box[3] - parent_box[1])
+            box = (
+                max(0, (geometry.box[0] - parent_box[0]) * scale_x),
+                max(0, (geometry.box[1] - parent_box[1]) * scale_y),
+                min(parent_img.size[0], (geometry.box[2] - parent_box[0]) * scale_x),
+                min(parent_img.size[1], (geometry.box[3] - parent_box[1]) * scale_y),
+            )
+
+            new_img = resolve_palette(parent_img).resize(
+                geometry.size,
+                processors.Resize.LANCZOS,
+                box=box
+            )
+            intermediates[key] = (new_img, geometry.box)
+
+            if geometry.fill and new_img.mode != "RGBA":
+                # ResizeToFill always returns an RGBA image.
+                canvas = Image.new("RGBA", new_img.size, (255, 255, 255, 0))
+                canvas.paste(new_img, (0, 0))
+                new_img = canvas
+
+            results[key] = processors.ProcessorPipeline(
+                variation.postprocessors
+            ).process(new_img)
+
+        # Variations that don't resample the source at all.
+        for key in keys:
+            if key not in results:
+                results[key] = self._variations[key].get_pipeline().process(img)
+
+        return results